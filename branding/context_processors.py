@@ -1,21 +1,14 @@
 from .models import SiteBranding
-from cart.cart import Cart
 
 
 def branding_context(request):
     """
-    Context processor to make branding and cart info available 
-    in all templates.
+    Context processor to make branding available in all templates.
+
+    Per-visitor data (cart badge, flash messages, CSRF token) is not added
+    here on purpose: catalog pages must stay identical for every visitor so
+    shared caches can store them. base.html loads it from `cart_state`.
     """
-    branding = SiteBranding.get_current()
-    cart = Cart(request)
-    
-    # Count total number of items in cart (not unique products, but total quantity)
-    cart_item_count = sum(item.get('qty', 0) for item in cart.cart.values())
-    
-    context = {
-        'site_branding': branding,
-        'cart_item_count': cart_item_count,
+    return {
+        'site_branding': SiteBranding.get_current(),
     }
-    
-    return context
\ No newline at end of file
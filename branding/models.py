@@ -134,6 +134,10 @@ class SiteBranding(models.Model):
         # Generate favicon variants after saving
         if self.favicon:
             self._generate_favicon_variants()
+
+        # Logo/favicon are rendered on every catalog page - invalidate their ETags
+        from catalog import versioning
+        versioning.bump(versioning.SITE)
     
     def _generate_favicon_variants(self):
         """Generate favicon variants from the uploaded favicon."""
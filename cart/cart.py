@@ -1,25 +1,31 @@
+from dataclasses import dataclass, field
 from decimal import Decimal
-from catalog.models import Product, ProductVariant
+from typing import Optional
+
+from catalog.models import Product, ProductVariant, StockShard
 from django.contrib import messages
+from django.db.models import FilteredRelation, OuterRef, Q, Subquery, Sum
 
-CART_SESSION_ID = 'cart'
+from . import holds
+from .storage import CART_SESSION_ID, get_storage  # noqa: F401 (CART_SESSION_ID за съвместимост)
 
 
 class Cart:
     def __init__(self, request):
         self.request = request
-        self.session = request.session
-        cart = self.session.get(CART_SESSION_ID)
-        if not cart:
-            cart = self.session[CART_SESSION_ID] = {}
-        self.cart = cart  # структура: {cart_item_id: {"type": "variant"/"product", "item_id": int, "qty": int}}
+        # къде стои количката зависи от settings.CART_STORAGE (сесия / подписана бисквитка / кеш);
+        # load() само чете – нищо не се записва, докато няма add/add_variant
+        self.storage = get_storage(request)
+        self.cart = self.storage.load()  # структура: {cart_item_id: {"type": "variant"/"product", "item_id": int, "qty": int}}
 
     def save(self):
-        self.session.modified = True
+        self.storage.save(self.cart)
+        # снимките от тази заявка вече не отговарят на съдържанието
+        self.request.__dict__.pop("_cart_snapshots", None)
 
     def add_variant(self, variant_id: int, qty: int = 1):
         """Добавя вариант на продукт; не надвишава наличността. Връща реално добавеното количество."""
-        variant = ProductVariant.objects.select_related('product').filter(id=variant_id, product__active=True).first()
+        variant = ProductVariant.objects.with_stock().select_related('product').filter(id=variant_id, product__active=True).first()
         if not variant:
             messages.error(self.request, "Вариантът не е намерен.")
             return 0
@@ -29,8 +35,9 @@ class Cart:
         current_qty = int(self.cart.get(cart_item_id, {}).get("qty", 0))
         wanted = current_qty + qty
 
-        # лимит до наличността на варианта
-        allowed = min(wanted, max(0, int(variant.stock)))
+        # лимит до наличността на варианта (минус задържаното от други колички)
+        stock = self._claim("variant", variant_id, variant.available_stock, wanted)
+        allowed = min(wanted, stock)
         diff_added = max(0, allowed - current_qty)
 
         variant_display = f"{variant.product.name}"
@@ -39,7 +46,7 @@ class Cart:
             variant_display += f" [{attrs}]"
 
         if diff_added == 0:
-            messages.warning(self.request, f"Наличност: {variant.stock} бр. Не може да добавиш повече за {variant_display}.")
+            messages.warning(self.request, f"Наличност: {stock} бр. Не може да добавиш повече за {variant_display}.")
         else:
             self.cart[cart_item_id] = {
                 "type": "variant",
@@ -47,7 +54,7 @@ class Cart:
                 "qty": allowed
             }
             if allowed < wanted:
-                messages.warning(self.request, f"Добавени са {diff_added} бр. (ограничено до наличността: {variant.stock}) за {variant_display}.")
+                messages.warning(self.request, f"Добавени са {diff_added} бр. (ограничено до наличността: {stock}) за {variant_display}.")
             else:
                 messages.success(self.request, f"Добавени {diff_added} бр. от {variant_display}.")
 
@@ -67,12 +74,13 @@ class Cart:
         current_qty = int(self.cart.get(cart_item_id, {}).get("qty", 0))
         wanted = current_qty + qty
 
-        # лимит до наличността
-        allowed = min(wanted, max(0, int(product.stock)))
+        # лимит до наличността (минус задържаното от други колички)
+        stock = self._claim("product", product_id, product.stock, wanted)
+        allowed = min(wanted, stock)
         diff_added = max(0, allowed - current_qty)
 
         if diff_added == 0:
-            messages.warning(self.request, f"Наличност: {product.stock} бр. Не може да добавиш повече.")
+            messages.warning(self.request, f"Наличност: {stock} бр. Не може да добавиш повече.")
         else:
             self.cart[cart_item_id] = {
                 "type": "product",
@@ -80,7 +88,7 @@ class Cart:
                 "qty": allowed
             }
             if allowed < wanted:
-                messages.warning(self.request, f"Добавени са {diff_added} бр. (ограничено до наличността: {product.stock}).")
+                messages.warning(self.request, f"Добавени са {diff_added} бр. (ограничено до наличността: {stock}).")
             else:
                 messages.success(self.request, f"Добавени {diff_added} бр. от '{product.name}'.")
 
@@ -100,17 +108,19 @@ class Cart:
         if qty == 0:
             del self.cart[cart_item_id]
             self.save()
+            self._hold(item["type"], item["item_id"], 0)
             messages.info(self.request, "Продуктът е премахнат от количката.")
             return 0
 
         # Get the item for stock validation
         if item["type"] == "variant":
-            variant = ProductVariant.objects.select_related('product').filter(id=item["item_id"], product__active=True).first()
+            variant = ProductVariant.objects.with_stock().select_related('product').filter(id=item["item_id"], product__active=True).first()
             if not variant:
                 messages.error(self.request, "Вариантът не е намерен.")
                 return 0
             
-            allowed = min(qty, max(0, int(variant.stock)))
+            stock = self._claim("variant", variant.id, variant.available_stock, qty)
+            allowed = min(qty, stock)
             
             variant_display = f"{variant.product.name}"
             if variant.size or variant.color:
@@ -118,16 +128,15 @@ class Cart:
                 variant_display += f" [{attrs}]"
             
             display_name = variant_display
-            stock = variant.stock
         else:  # product
             product = Product.objects.filter(id=item["item_id"], active=True).first()
             if not product:
                 messages.error(self.request, "Продуктът не е намерен.")
                 return 0
             
-            allowed = min(qty, max(0, int(product.stock)))
+            stock = self._claim("product", product.id, product.stock, qty)
+            allowed = min(qty, stock)
             display_name = product.name
-            stock = product.stock
 
         self.cart[cart_item_id]["qty"] = allowed
         self.save()
@@ -141,82 +150,185 @@ class Cart:
 
     def remove(self, cart_item_id: str):
         if cart_item_id in self.cart:
-            del self.cart[cart_item_id]
+            item = self.cart.pop(cart_item_id)
             self.save()
+            self._hold(item["type"], item["item_id"], 0)
 
     def clear(self):
-        self.session[CART_SESSION_ID] = {}
+        if holds.enabled():
+            holds.release(self.storage.key)
+        self.cart = {}
         self.save()
 
+    # --- задържане на наличност (settings.CART_STOCK_HOLDS) ---
+    def _claim(self, kind: str, item_id: int, stock, wanted: int) -> int:
+        """Свободното за количката; със задържания – заедно със задържането на min(wanted, свободното)."""
+        if not holds.enabled():
+            return max(0, int(stock))
+        return holds.claim(self.storage.ensure_key(), kind, item_id, stock, wanted)
+
+    def _hold(self, kind: str, item_id: int, qty: int):
+        if holds.enabled():
+            holds.hold(self.storage.ensure_key(), kind, item_id, qty)
+
+    @property
+    def item_count(self) -> int:
+        """Брой бройки (за баджа) – директно от storage-а, без заявки."""
+        return sum(int(item.get("qty", 0)) for item in self.cart.values())
+
+    def snapshot(self, coupon_code: str = "") -> "CartSnapshot":
+        """
+        Оценена, неизменяема снимка на количката. Строи се веднъж на заявка (за даден
+        промокод) и се ползва от страницата на количката, checkout-а и поръчката.
+        """
+        cache = self.request.__dict__.setdefault("_cart_snapshots", {})
+        code = (coupon_code or "").strip()
+        if code not in cache:
+            cache[code] = CartSnapshot.build(self.cart, code)
+        return cache[code]
+
     def __iter__(self):
-        """Итерация с обогатени данни за продукта/варианта (име/цена/тотал)."""
-        variant_ids = []
-        product_ids = []
-        
-        # Collect all IDs
-        for cart_item_id, item in self.cart.items():
-            if item["type"] == "variant":
-                variant_ids.append(item["item_id"])
-            elif item["type"] == "product":
-                product_ids.append(item["item_id"])
+        """Редовете от снимката (CartLine) – име/цена/тотал/наличност."""
+        return iter(self.snapshot().lines)
+
+    def total(self):
+        return self.snapshot().subtotal
+
+    def is_empty(self):
+        return not bool(self.cart)
+
+
+@dataclass(frozen=True)
+class CartLine:
+    cart_item_id: str
+    type: str
+    id: int  # Product ID (за съвместимост с шаблоните)
+    variant_id: Optional[int]
+    name: str
+    slug: str
+    size: str
+    color: str
+    sku: str
+    price: Decimal
+    qty: int
+    stock: int
+    product: Product = field(repr=False, compare=False)
+    variant: Optional[ProductVariant] = field(default=None, repr=False, compare=False)
+
+    @property
+    def line_total(self) -> Decimal:
+        return self.price * self.qty
+
+    @property
+    def in_stock(self) -> bool:
+        return self.qty <= self.stock
+
+
+@dataclass(frozen=True)
+class CartSnapshot:
+    lines: tuple
+    subtotal: Decimal
+    total: Decimal
+    coupon: object = None  # checkout.models.Coupon, ако е валиден
 
-        # Fetch variants and products
-        variants = {v.id: v for v in ProductVariant.objects.select_related('product').filter(id__in=variant_ids)}
-        products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-        
-        for cart_item_id, item in self.cart.items():
+    @property
+    def item_count(self) -> int:
+        return sum(line.qty for line in self.lines)
+
+    @property
+    def all_in_stock(self) -> bool:
+        return all(line.in_stock for line in self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    @classmethod
+    def _load(cls, product_ids, variant_ids):
+        """
+        Продуктите и вариантите от количката с една заявка: продуктите с LEFT JOIN към
+        вариантите им от количката (FilteredRelation) – по ред на (продукт, вариант);
+        наличността на горещите варианти (сума на шардовете) е подзаявка в същия SELECT.
+        """
+        if not variant_ids:
+            # празен IN в условието на JOIN-а изпразва целия резултат – тук JOIN не трябва
+            return {p.id: p for p in Product.objects.filter(id__in=product_ids)} if product_ids else {}, {}
+        shard_stock = (
+            StockShard.objects.filter(variant=OuterRef('line_variant__pk'))
+            .values('variant').annotate(total=Sum('stock')).values('total')
+        )
+        rows = (
+            Product.objects
+            .annotate(line_variant=FilteredRelation('variants', condition=Q(variants__id__in=variant_ids)))
+            .filter(Q(id__in=product_ids) | Q(line_variant__isnull=False))
+            .select_related('line_variant')
+            .annotate(line_shard_stock=Subquery(shard_stock))
+        )
+        products, variants = {}, {}
+        for product in rows:
+            products.setdefault(product.id, product)
+            variant = getattr(product, 'line_variant', None)  # без вариант в количката – не е зададено
+            if variant is not None:
+                variant.product = products[product.id]
+                variant.shard_stock = product.line_shard_stock
+                variants[variant.id] = variant
+        return products, variants
+
+    @classmethod
+    def build(cls, cart: dict, coupon_code: str = "") -> "CartSnapshot":
+        variant_ids = [item["item_id"] for item in cart.values() if item["type"] == "variant"]
+        product_ids = [item["item_id"] for item in cart.values() if item["type"] == "product"]
+
+        products, variants = cls._load(product_ids, variant_ids)
+
+        lines = []
+        for cart_item_id, item in cart.items():
             qty = int(item["qty"])
-            
+
             if item["type"] == "variant":
                 variant = variants.get(item["item_id"])
                 if not variant:
                     continue
-                
-                price = Decimal(variant.price)
+
                 name = variant.product.name
                 if variant.size or variant.color:
                     attrs = ", ".join(a for a in [variant.size, variant.color] if a)
                     name += f" [{attrs}]"
-                
-                yield {
-                    "cart_item_id": cart_item_id,
-                    "type": "variant",
-                    "id": variant.product.id,  # Product ID for template compatibility
-                    "variant_id": variant.id,
-                    "name": name,
-                    "slug": variant.product.slug,
-                    "size": variant.size,
-                    "color": variant.color,
-                    "sku": variant.sku,
-                    "price": price,
-                    "qty": qty,
-                    "line_total": price * qty,
-                }
-            
+
+                lines.append(CartLine(
+                    cart_item_id=cart_item_id, type="variant",
+                    id=variant.product.id, variant_id=variant.id,
+                    name=name, slug=variant.product.slug,
+                    size=variant.size, color=variant.color, sku=variant.sku,
+                    price=Decimal(variant.price), qty=qty, stock=int(variant.available_stock),
+                    product=variant.product, variant=variant,
+                ))
+
             elif item["type"] == "product":
                 product = products.get(item["item_id"])
                 if not product:
                     continue
-                
-                price = Decimal(product.price)
-                yield {
-                    "cart_item_id": cart_item_id,
-                    "type": "product",
-                    "id": product.id,
-                    "variant_id": None,
-                    "name": product.name,
-                    "slug": product.slug,
-                    "size": "",
-                    "color": "",
-                    "sku": "",
-                    "price": price,
-                    "qty": qty,
-                    "line_total": price * qty,
-                }
 
-    def total(self):
-        from decimal import Decimal
-        return sum((i["line_total"] for i in self), Decimal("0.00"))
+                lines.append(CartLine(
+                    cart_item_id=cart_item_id, type="product",
+                    id=product.id, variant_id=None,
+                    name=product.name, slug=product.slug,
+                    size="", color="", sku="",
+                    price=Decimal(product.price), qty=qty, stock=int(product.stock),
+                    product=product,
+                ))
 
-    def is_empty(self):
-        return not bool(self.cart)
\ No newline at end of file
+        subtotal = sum((line.line_total for line in lines), Decimal("0.00"))
+
+        # Промокод
+        coupon = None
+        total = subtotal
+        if coupon_code:
+            from checkout import coupons  # checkout зависи от cart, не обратното
+            coupon = coupons.valid(coupon_code)
+            if coupon:
+                total = coupon.apply(subtotal)
+
+        return cls(lines=tuple(lines), subtotal=subtotal, total=total, coupon=coupon)
@@ -0,0 +1,93 @@
+"""
+Задържане на наличност при добавяне в количката (settings.CART_STOCK_HOLDS).
+
+Всяка количка има по едно задържане на ред (вариант или продукт без варианти),
+което изтича след CART_HOLD_MINUTES и се подновява при всяка промяна.
+Наличното = stock − сумата на активните задържания на *другите* колички;
+сумата идва от индекса (variant/product, expires_at, qty). Проверката и
+задържането стават заедно в claim() под заключения ред на варианта/продукта.
+
+При поръчка задържанията на количката се трият в транзакцията на поръчката,
+а изтеклите се чистят с `manage.py release_expired_holds`.
+Листингът на каталога не ги чете – там се показва суровата наличност.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from catalog.models import Product, ProductVariant
+from .models import StockHold
+
+
+def enabled() -> bool:
+    return getattr(settings, 'CART_STOCK_HOLDS', False)
+
+
+def _field(kind: str) -> str:
+    return 'variant_id' if kind == 'variant' else 'product_id'
+
+
+def held_by_others(kind: str, item_ids, cart_key=None) -> dict:
+    """{item_id: задържани бройки от други колички} с една агрегираща заявка."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}
+    field = _field(kind)
+    qs = StockHold.objects.filter(**{f'{field}__in': item_ids}, expires_at__gt=timezone.now())
+    if cart_key:
+        qs = qs.exclude(cart_key=cart_key)
+    return dict(qs.values_list(field).annotate(total=Sum('qty')).order_by())
+
+
+def available(kind: str, item_id: int, stock: int, cart_key=None) -> int:
+    return max(0, int(stock) - held_by_others(kind, [item_id], cart_key).get(item_id, 0))
+
+
+def hold(cart_key: str, kind: str, item_id: int, qty: int):
+    """Създава/подновява задържането на реда; qty=0 го премахва."""
+    lookup = {'cart_key': cart_key, _field(kind): item_id}
+    if qty <= 0:
+        StockHold.objects.filter(**lookup).delete()
+        return
+    expires_at = timezone.now() + timedelta(minutes=settings.CART_HOLD_MINUTES)
+    StockHold.objects.update_or_create(**lookup, defaults={'qty': qty, 'expires_at': expires_at})
+
+
+def claim(cart_key: str, kind: str, item_id: int, stock: int, wanted: int) -> int:
+    """
+    Проверка и задържане в една транзакция под заключения ред на варианта/продукта –
+    две колички не могат да вземат едновременно последната бройка.
+    Задържа min(wanted, свободното); връща свободното за количката.
+    """
+    model = ProductVariant if kind == 'variant' else Product
+    with transaction.atomic():
+        list(model.objects.select_for_update().filter(id=item_id).values_list('id', flat=True))
+        free = available(kind, item_id, stock, cart_key)
+        hold(cart_key, kind, item_id, min(wanted, free))
+    return free
+
+
+def release(cart_key, kind=None, item_id=None):
+    """Освобождава задържанията на количката (всички или на един ред)."""
+    if not cart_key:
+        return
+    qs = StockHold.objects.filter(cart_key=cart_key)
+    if kind:
+        qs = qs.filter(**{_field(kind): item_id})
+    qs.delete()
+
+
+def release_expired(batch_size=1000, max_batches=0):
+    """Трие изтеклите задържания на партиди по id; връща броя изтрити."""
+    now = timezone.now()
+    total = batches = 0
+    while not max_batches or batches < max_batches:
+        ids = list(StockHold.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        total += StockHold.objects.filter(id__in=ids).delete()[0]
+        batches += 1
+    return total
@@ -0,0 +1,82 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from cart.cart import CART_SESSION_ID
+
+DELETE_CHUNK = 100  # условия (ключ + данни) в едно DELETE – под лимита за дълбочина на SQLite
+
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = "Трие изтекли сесии и сесии само с празна количка, на малки партиди (за cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=0, help="0 = докато има какво да се трие")
+        parser.add_argument('--sleep', type=float, default=0.0, help="пауза между партидите (сек.)")
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+            raise CommandError(f"SESSION_ENGINE={settings.SESSION_ENGINE} не пази сесии в базата.")
+
+        self.batch_size = options['batch_size']
+        self.max_batches = options['max_batches']
+        self.sleep = options['sleep']
+
+        expired = self.prune_expired()
+        empty = self.prune_empty()
+        self.stdout.write(self.style.SUCCESS(f"Изтрити сесии: изтекли {expired}, празни {empty}"))
+
+    def _batches(self):
+        n = 0
+        while not self.max_batches or n < self.max_batches:
+            yield n
+            n += 1
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def prune_expired(self):
+        now = timezone.now()
+        total = 0
+        for _ in self._batches():
+            keys = list(
+                Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:self.batch_size]
+            )
+            if not keys:
+                break
+            total += Session.objects.filter(session_key__in=keys).delete()[0]
+        return total
+
+    def prune_empty(self):
+        total = 0
+        last_key = ''
+        for _ in self._batches():
+            batch = list(Session.objects.filter(session_key__gt=last_key).order_by('session_key')[:self.batch_size])
+            if not batch:
+                break
+            last_key = batch[-1].session_key
+            empty = [s for s in batch if self.is_empty(s)]
+            for i in range(0, len(empty), DELETE_CHUNK):
+                # само ако данните са същите като прочетените – сесия, в която междувременно
+                # е добавен продукт, остава
+                match = Q()
+                for s in empty[i:i + DELETE_CHUNK]:
+                    match |= Q(session_key=s.session_key, session_data=s.session_data)
+                total += Session.objects.filter(match).delete()[0]
+        return total
+
+    @staticmethod
+    def is_empty(session):
+        data = session.get_decoded()  # невалидни/повредени данни → {}
+        if data.get(CART_SESSION_ID):
+            return False
+        return not (set(data) - {CART_SESSION_ID})
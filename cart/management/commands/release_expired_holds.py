@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from cart.holds import release_expired
+
+
+class Command(BaseCommand):
+    help = "Освобождава изтеклите задържания на наличност, на партиди (за cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=0, help="0 = докато има какво да се трие")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f"Освободени задържания: {released}"))
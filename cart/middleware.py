@@ -0,0 +1,26 @@
+from django.conf import settings
+
+from .storage import COOKIE_SALT
+
+
+class CartCookieMiddleware:
+    """Слага/трие бисквитката на количката, ако storage-ът е поискал (cookie/cache режим)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        value = getattr(request, '_cart_cookie', None)
+        if value is None:
+            return response
+        if value:
+            response.set_signed_cookie(
+                settings.CART_COOKIE_NAME, value, salt=COOKIE_SALT,
+                max_age=settings.CART_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('catalog', '0010_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_key', models.CharField(max_length=64)),
+                ('qty', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='catalog.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='catalog.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['variant', 'expires_at', 'cart_key', 'qty'], name='cart_hold_variant_idx'), models.Index(fields=['product', 'expires_at', 'cart_key', 'qty'], name='cart_hold_product_idx'), models.Index(fields=['cart_key'], name='cart_hold_cart_idx'), models.Index(fields=['expires_at'], name='cart_hold_expires_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('variant__isnull', False)), fields=('cart_key', 'variant'), name='cart_hold_unique_variant'), models.UniqueConstraint(condition=models.Q(('product__isnull', False)), fields=('cart_key', 'product'), name='cart_hold_unique_product')],
+            },
+        ),
+    ]
@@ -1,3 +1,34 @@
 from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+from catalog.models import Product, ProductVariant
+
+
+class StockHold(models.Model):
+    """
+    Временно задържане на бройки за дадена количка (settings.CART_STOCK_HOLDS).
+    Наличното за останалите = stock − активните задържания на другите колички.
+    """
+    cart_key = models.CharField(max_length=64)
+    variant = models.ForeignKey(ProductVariant, null=True, blank=True, on_delete=models.CASCADE, related_name='holds')
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.CASCADE, related_name='holds')
+    qty = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # сумата на активните задържания се чете само от индекса
+            models.Index(fields=['variant', 'expires_at', 'cart_key', 'qty'], name='cart_hold_variant_idx'),
+            models.Index(fields=['product', 'expires_at', 'cart_key', 'qty'], name='cart_hold_product_idx'),
+            models.Index(fields=['cart_key'], name='cart_hold_cart_idx'),
+            models.Index(fields=['expires_at'], name='cart_hold_expires_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['cart_key', 'variant'], condition=Q(variant__isnull=False),
+                                    name='cart_hold_unique_variant'),
+            models.UniqueConstraint(fields=['cart_key', 'product'], condition=Q(product__isnull=False),
+                                    name='cart_hold_unique_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.cart_key}: {self.variant_id or self.product_id} x{self.qty}"
@@ -0,0 +1,151 @@
+"""
+Къде живее количката. Избира се с settings.CART_STORAGE:
+
+- SessionCartStorage      – Django сесията (по подразбиране, досегашното поведение)
+- SignedCookieCartStorage – подписана бисквитка с компактен запис, без базата
+- CacheCartStorage        – Django кеша (LocMem/файлов локално, Redis в прод);
+                            в бисквитката стои само id-то на количката
+
+Всички storage-и само четат при load(); пишат едва при save() (т.е. при промяна).
+Бисквитките се слагат в отговора от cart.middleware.CartCookieMiddleware.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+CART_SESSION_ID = 'cart'
+COOKIE_SALT = 'cart.storage'
+
+
+def encode_items(cart: dict) -> str:
+    """{"v12": {"qty": 3, ...}, "p5": {...}} → "v12.3,p5.1" """
+    return ','.join(f"{cart_item_id}.{int(item['qty'])}" for cart_item_id, item in cart.items())
+
+
+def decode_items(value: str) -> dict:
+    cart = {}
+    for token in filter(None, (value or '').split(',')):
+        try:
+            cart_item_id, qty = token.split('.')
+            kind = {'v': 'variant', 'p': 'product'}[cart_item_id[0]]
+            cart[cart_item_id] = {"type": kind, "item_id": int(cart_item_id[1:]), "qty": int(qty)}
+        except (ValueError, KeyError, IndexError):
+            continue  # повреден запис – просто го пропускаме
+    return cart
+
+
+class BaseCartStorage:
+    def __init__(self, request):
+        self.request = request
+
+    def load(self) -> dict:
+        raise NotImplementedError
+
+    def save(self, cart: dict):
+        raise NotImplementedError
+
+    @property
+    def key(self):
+        """Стабилен идентификатор на количката (None, докато не е записана)."""
+        raise NotImplementedError
+
+    def ensure_key(self):
+        """Ключът на количката след save() – нужен за задържанията на наличност."""
+        return self.key
+
+    # --- бисквитка, която middleware-ът ще сложи в отговора ---
+    def _pending_cookie(self):
+        return getattr(self.request, '_cart_cookie', None)
+
+    def _set_cookie(self, value: str):
+        self.request._cart_cookie = value  # '' = изтрий бисквитката
+
+    def _cookie(self):
+        pending = self._pending_cookie()
+        if pending is not None:
+            return pending
+        return self.request.get_signed_cookie(settings.CART_COOKIE_NAME, default='', salt=COOKIE_SALT)
+
+
+class SessionCartStorage(BaseCartStorage):
+    def load(self):
+        return self.request.session.get(CART_SESSION_ID) or {}
+
+    def save(self, cart):
+        session = self.request.session
+        if cart:
+            session[CART_SESSION_ID] = cart
+        else:
+            # празна количка = няма ключ (prune_cart_sessions чисти празните сесии)
+            session.pop(CART_SESSION_ID, None)
+        session.modified = True
+
+    @property
+    def key(self):
+        return self.request.session.session_key
+
+    def ensure_key(self):
+        if not self.request.session.session_key:
+            self.request.session.save()  # нова сесия – ключът се създава при запис
+        return self.request.session.session_key
+
+
+class SignedCookieCartStorage(BaseCartStorage):
+    """Бисквитка "<cart_id>|v12.3,p5.1" – подписана, така че клиентът не може да я подправи."""
+
+    def _parts(self):
+        cart_id, _, items = self._cookie().partition('|')
+        return cart_id, items
+
+    def load(self):
+        return decode_items(self._parts()[1])
+
+    def save(self, cart):
+        if not cart:
+            self._set_cookie('')
+            return
+        cart_id = self._parts()[0] or uuid.uuid4().hex
+        self._set_cookie(f"{cart_id}|{encode_items(cart)}")
+
+    @property
+    def key(self):
+        return self._parts()[0] or None
+
+
+class CacheCartStorage(BaseCartStorage):
+    """Съдържанието е в кеша под cart:<id>; бисквитката носи само id-то."""
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+
+    def _cache_key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def load(self):
+        cart_id = self._cookie()
+        if not cart_id:
+            return {}
+        return decode_items(self.cache.get(self._cache_key(cart_id), ''))
+
+    def save(self, cart):
+        cart_id = self._cookie()
+        if not cart:
+            if cart_id:
+                self.cache.delete(self._cache_key(cart_id))
+                self._set_cookie('')
+            return
+        if not cart_id:
+            cart_id = uuid.uuid4().hex
+            self._set_cookie(cart_id)
+        self.cache.set(self._cache_key(cart_id), encode_items(cart), settings.CART_COOKIE_AGE)
+
+    @property
+    def key(self):
+        return self._cookie() or None
+
+
+def get_storage(request) -> BaseCartStorage:
+    return import_string(settings.CART_STORAGE)(request)
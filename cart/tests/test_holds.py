@@ -0,0 +1,119 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import Client
+from django.utils import timezone
+from cart import holds
+from cart.models import StockHold
+from catalog.models import Category, Product, ProductVariant
+from checkout.models import Order
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.fixture
+def variant(db, settings):
+    settings.CART_STOCK_HOLDS = True
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=0)
+    return ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('10'), stock=3)
+
+
+def add(client, variant, qty):
+    client.post(f'/cart/add/{variant.product_id}/', {'qty': qty, 'variant_id': variant.id})
+    return client.session.get('cart', {}).get(f'v{variant.id}', {}).get('qty', 0)
+
+
+def test_holds_limit_other_carts(variant):
+    a, b, c = Client(), Client(), Client()
+    assert add(a, variant, 2) == 2
+    assert add(b, variant, 2) == 1  # 3 − 2 задържани от a
+    assert add(c, variant, 1) == 0
+
+    assert holds.held_by_others('variant', [variant.id]) == {variant.id: 3}
+    assert holds.held_by_others('variant', [variant.id], a.session.session_key) == {variant.id: 1}
+
+
+def test_checkout_converts_own_holds(variant):
+    a, b = Client(), Client()
+    add(a, variant, 2)
+    add(b, variant, 1)
+
+    assert a.post('/checkout/', FORM).status_code == 302
+    variant.refresh_from_db()
+    assert variant.stock == 1
+    assert list(StockHold.objects.values_list('cart_key', 'qty')) == [(b.session.session_key, 1)]
+    # последната бройка е задържана от b – друга количка не може да я вземе
+    assert add(Client(), variant, 1) == 0
+    assert b.post('/checkout/', FORM).status_code == 302
+    assert Order.objects.count() == 2
+
+
+def test_expired_holds_free_stock(variant):
+    a = Client()
+    add(a, variant, 3)
+    StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+    assert add(Client(), variant, 1) == 1
+
+    call_command('release_expired_holds', batch_size=1)
+    assert StockHold.objects.count() == 1
+
+
+def test_removing_line_releases_hold(variant):
+    a = Client()
+    add(a, variant, 2)
+    a.post(f'/cart/remove/v{variant.id}/')
+    assert not StockHold.objects.exists()
+
+
+def test_hold_sum_reads_only_the_index(variant):
+    expires = timezone.now() + timedelta(minutes=15)
+    StockHold.objects.bulk_create(
+        StockHold(cart_key=f'k{i}', variant_id=variant.id if i % 10 == 0 else None,
+                  product_id=None if i % 10 == 0 else variant.product_id, qty=1, expires_at=expires)
+        for i in range(5000)
+    )
+    qs = StockHold.objects.filter(variant_id__in=[variant.id], expires_at__gt=timezone.now()).exclude(cart_key='k0')
+    sql, params = qs.values_list('variant_id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+    assert 'COVERING INDEX cart_hold_variant_idx' in plan
+    assert holds.held_by_others('variant', [variant.id], 'k0') == {variant.id: 499}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_claims_hold_the_last_unit_once(settings):
+    settings.CART_STOCK_HOLDS = True
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=0)
+    v = ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('10'), stock=1)
+    start = threading.Barrier(8)
+
+    def claim(key):
+        start.wait()
+        try:
+            for _ in range(500):
+                try:
+                    return min(1, holds.claim(key, 'variant', v.id, v.stock, 1))
+                except OperationalError:
+                    # тестовата SQLite база заключва цели таблици и не чака – транзакцията е върната
+                    time.sleep(0.001)
+            raise AssertionError("базата остана заключена")
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        granted = list(pool.map(claim, [f'cart{i}' for i in range(8)]))
+
+    assert sum(granted) == 1
+    assert list(StockHold.objects.values_list('qty', flat=True)) == [1]
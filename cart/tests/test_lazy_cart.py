@@ -0,0 +1,61 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.utils import timezone
+from catalog.models import Category, Product
+
+
+@pytest.mark.django_db
+def test_browsing_creates_no_sessions(client):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=3)
+    for url in ('/', '/p/a/', '/cart/', '/cart/state/', '/checkout/'):
+        assert client.get(url).status_code == 200
+    assert Session.objects.count() == 0
+
+    client.post(f'/cart/add/{p.id}/', {'qty': 1})
+    assert Session.objects.count() == 1
+
+
+def make_session(data, expired=False):
+    s = SessionStore()
+    s.update(data)
+    s.create()
+    if expired:
+        Session.objects.filter(session_key=s.session_key).update(expire_date=timezone.now() - timedelta(days=1))
+    return s.session_key
+
+
+@pytest.mark.django_db
+def test_prune_cart_sessions():
+    keep = make_session({'cart': {'p1': {'type': 'product', 'item_id': 1, 'qty': 1}}})
+    auth = make_session({'_auth_user_id': '1'})
+    make_session({'cart': {}})
+    make_session({})
+    make_session({'cart': {'p1': {'type': 'product', 'item_id': 1, 'qty': 1}}}, expired=True)
+
+    call_command('prune_cart_sessions', batch_size=2)
+    assert set(Session.objects.values_list('session_key', flat=True)) == {keep, auth}
+
+
+@pytest.mark.django_db
+def test_prune_skips_sessions_changed_after_read(monkeypatch):
+    from cart.management.commands.prune_cart_sessions import Command
+
+    racing = make_session({'cart': {}})
+    make_session({})
+    is_empty = Command.is_empty
+
+    def add_to_cart_meanwhile(session):
+        if session.session_key == racing:
+            s = SessionStore(session_key=racing)
+            s['cart'] = {'p1': {'type': 'product', 'item_id': 1, 'qty': 1}}
+            s.save()
+        return is_empty(session)
+
+    monkeypatch.setattr(Command, 'is_empty', staticmethod(add_to_cart_meanwhile))
+    call_command('prune_cart_sessions')
+    assert list(Session.objects.values_list('session_key', flat=True)) == [racing]
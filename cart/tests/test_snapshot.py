@@ -0,0 +1,72 @@
+import pytest
+from decimal import Decimal
+from django.test import RequestFactory
+from django.contrib.sessions.backends.db import SessionStore
+from cart.cart import Cart, CartSnapshot
+from catalog.models import Category, Product, ProductVariant
+from checkout.models import Coupon
+
+
+@pytest.fixture
+def cart(db):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=1)
+    v = ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('12.50'), stock=5)
+    request = RequestFactory().get('/')
+    request.session = SessionStore()
+    cart = Cart(request)
+    cart.cart = {
+        f'p{p.id}': {'type': 'product', 'item_id': p.id, 'qty': 2},
+        f'v{v.id}': {'type': 'variant', 'item_id': v.id, 'qty': 1},
+    }
+    return cart
+
+
+def test_snapshot_is_priced_once_per_request(cart, django_assert_num_queries):
+    with django_assert_num_queries(1):  # продукти и варианти в един SELECT
+        snap = cart.snapshot()
+        list(cart)
+        cart.total()
+        assert cart.snapshot() is snap
+    assert snap.subtotal == Decimal('32.50')
+    assert snap.item_count == 3
+    assert not snap.all_in_stock  # 2 бр. при наличност 1
+    assert [line.in_stock for line in snap] == [False, True]
+
+
+def test_snapshot_applies_valid_coupon(cart):
+    Coupon.objects.create(code='SALE10', percent_off=10)
+    snap = cart.snapshot('sale10')
+    assert snap.coupon.code == 'SALE10'
+    assert snap.total == Decimal('29.25')
+    assert cart.snapshot('missing').coupon is None
+
+
+def test_snapshot_mixes_lines_of_the_same_product(db, django_assert_num_queries):
+    from catalog import stock
+
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=4)
+    m = ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('12'), stock=5)
+    l = ProductVariant.objects.create(product=p, sku='A-L', size='L', price=Decimal('13'), stock=9)
+    ProductVariant.objects.create(product=p, sku='A-S', size='S', price=Decimal('11'), stock=1)  # не е в количката
+    only_variants = Product.objects.create(category=c, name='B', slug='b', price=Decimal('1'), stock=0)
+    v = ProductVariant.objects.create(product=only_variants, sku='B-M', size='M', price=Decimal('2'), stock=3)
+    stock.split(l.id, 3)
+
+    cart = {
+        f'p{p.id}': {'type': 'product', 'item_id': p.id, 'qty': 1},
+        f'v{m.id}': {'type': 'variant', 'item_id': m.id, 'qty': 1},
+        f'v{l.id}': {'type': 'variant', 'item_id': l.id, 'qty': 1},
+        f'v{v.id}': {'type': 'variant', 'item_id': v.id, 'qty': 1},
+        'p999999': {'type': 'product', 'item_id': 999999, 'qty': 1},  # изтрит продукт
+    }
+    with django_assert_num_queries(1):
+        snap = CartSnapshot.build(cart)
+        lines = {(line.id, line.variant_id): line for line in snap.lines}
+        assert lines[(p.id, m.id)].variant.product is lines[(p.id, None)].product
+    assert set(lines) == {(p.id, None), (p.id, m.id), (p.id, l.id), (only_variants.id, v.id)}
+    assert [lines[k].stock for k in sorted(lines, key=lambda k: (k[0], k[1] or 0))] == [4, 5, 9, 3]
+
+    assert [line.id for line in CartSnapshot.build({f'v{v.id}': cart[f'v{v.id}']}).lines] == [only_variants.id]
+    assert [line.variant_id for line in CartSnapshot.build({f'p{p.id}': cart[f'p{p.id}']}).lines] == [None]
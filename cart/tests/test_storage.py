@@ -0,0 +1,53 @@
+import pytest
+from decimal import Decimal
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.test import override_settings
+from cart.storage import decode_items, encode_items
+from catalog.models import Category, Product, ProductVariant
+
+STORAGES = [
+    'cart.storage.SessionCartStorage',
+    'cart.storage.SignedCookieCartStorage',
+    'cart.storage.CacheCartStorage',
+]
+
+
+def test_compact_encoding_roundtrip():
+    cart = {
+        'v12': {'type': 'variant', 'item_id': 12, 'qty': 3},
+        'p5': {'type': 'product', 'item_id': 5, 'qty': 1},
+    }
+    assert encode_items(cart) == 'v12.3,p5.1'
+    assert decode_items(encode_items(cart)) == cart
+    assert decode_items('v1.x,zz,p2.2') == {'p2': {'type': 'product', 'item_id': 2, 'qty': 2}}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('storage', STORAGES)
+def test_cart_flow_per_storage(client, storage):
+    cache.clear()
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=5)
+    v = ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('12'), stock=5)
+
+    with override_settings(CART_STORAGE=storage):
+        client.post(f'/cart/add/{p.id}/', {'qty': 2})
+        client.post(f'/cart/add/{p.id}/', {'qty': 1, 'variant_id': v.id})
+        r = client.get('/cart/')
+        assert r.context['total'] == Decimal('32')
+        client.post(f'/cart/update/p{p.id}/', {'qty': 1})
+        assert client.get('/cart/state/').json()['count'] == 2
+        client.post(f'/cart/remove/p{p.id}/')
+        client.post(f'/cart/remove/v{v.id}/')
+        assert client.get('/cart/state/').json()['count'] == 0
+
+    # само сесийният режим пише в django_session
+    assert Session.objects.exists() == (storage == 'cart.storage.SessionCartStorage')
+
+
+@pytest.mark.django_db
+@override_settings(CART_STORAGE='cart.storage.SignedCookieCartStorage')
+def test_tampered_cookie_is_ignored(client):
+    client.cookies['cart'] = 'abc|p1.99'
+    assert client.get('/cart/state/').json()['count'] == 0
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path("", views.cart_detail, name="cart_detail"),
+    path("state/", views.cart_state, name="cart_state"),
     path("add/<int:product_id>/", views.add_to_cart, name="cart_add"),
     path("update/<str:cart_item_id>/", views.update_cart, name="cart_update"),
     path("remove/<str:cart_item_id>/", views.remove_from_cart, name="cart_remove"),
@@ -1,4 +1,8 @@
+from django.contrib import messages
+from django.http import JsonResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import redirect, render, get_object_or_404
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_POST
 from catalog.models import Product, ProductVariant
 from .cart import Cart
@@ -32,8 +36,20 @@ def remove_from_cart(request, cart_item_id):
     return redirect("cart_detail")
 
 def cart_detail(request):
-    cart = Cart(request)
+    snapshot = Cart(request).snapshot()
     return render(request, "cart/detail.html", {
-        "items": list(cart),
-        "total": cart.total(),
+        "items": snapshot.lines,
+        "total": snapshot.subtotal,
+    })
+
+
+@never_cache
+def cart_state(request):
+    """Състоянието на посетителя за кешируемите страници: бадж, съобщения, CSRF токен."""
+    cart = Cart(request)
+    return JsonResponse({
+        "count": cart.item_count,
+        "messages": [{"tags": m.tags, "text": str(m)} for m in messages.get_messages(request)],
+        "csrf_token": get_token(request),
+        "is_staff": request.user.is_staff,
     })
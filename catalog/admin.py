@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, ProductVariant
+from .models import Category, ImageJob, Product, ProductImage, ProductVariant
 from django.forms.models import BaseInlineFormSet
 
 class MaxFiveInlineFormSet(BaseInlineFormSet):
@@ -34,7 +34,8 @@ class ProductImageInline(admin.TabularInline):
 class ProductVariantInline(admin.TabularInline):
     model = ProductVariant
     extra = 1
-    fields = ('sku', 'size', 'color', 'price', 'stock')
+    fields = ('sku', 'size', 'color', 'price', 'stock', 'sharded')
+    readonly_fields = ('sharded',)  # при разделена наличност: manage.py stock_shards
     ordering = ('sku',)
 
 @admin.register(Category)
@@ -55,3 +56,10 @@ class ProductAdmin(admin.ModelAdmin):
         'image', 'image_webp', 'image_avif',   # <- добавени тук за визуализация
         # добави и други полета, които имаш
     )
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'object_id', 'source', 'status', 'attempts', 'error', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('source',)
+    readonly_fields = ('kind', 'object_id', 'source', 'attempts', 'error', 'created_at', 'started_at', 'finished_at')
@@ -0,0 +1,40 @@
+"""
+Кеш на рендерираните продуктови карти в листинга.
+
+Всяка карта се пази под ключ с `Product.cache_version`, който расте при
+всяка промяна на продукта или на негова снимка – няма нужда от изрично
+изтриване. CATALOG_ETAG_SALT също е част от ключа – деплой с променен
+шаблон сменя солта и не сервира стари карти. Картите на една страница се
+взимат с един `get_many`.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'catalog/product_card.html'
+CARD_CACHE_SECONDS = getattr(settings, 'CATALOG_CARD_CACHE_SECONDS', 60 * 60 * 24)
+
+
+def card_key(product) -> str:
+    return f'catalog:card:{settings.CATALOG_ETAG_SALT}:{product.pk}:{product.cache_version}'
+
+
+def render_card(product) -> str:
+    return render_to_string(CARD_TEMPLATE, {'p': product})
+
+
+def render_cards(products) -> list:
+    """HTML на картите в реда на `products`; липсващите се рендерират и кешират."""
+    keys = [card_key(p) for p in products]
+    cached = cache.get_many(keys)
+
+    missing = {}
+    for key, product in zip(keys, products):
+        if key not in cached:
+            missing[key] = render_card(product)
+    if missing:
+        cache.set_many(missing, CARD_CACHE_SECONDS)
+        cached.update(missing)
+
+    return [mark_safe(cached[key]) for key in keys]
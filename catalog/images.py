@@ -0,0 +1,251 @@
+"""
+Деривати на продуктовите снимки (WebP + AVIF, ако има pillow_avif) във фонов режим.
+
+Product.save()/ProductImage.save() само записват ImageJob (сигналите, в
+същата транзакция); `manage.py process_image_jobs` ги взима с условен UPDATE и
+кодира в пул от процеси (по един на ядро). Готовите имена се записват с
+queryset.update() – без втори save() и сигнали – и картите се инвалидират
+с versioning.touch_products. Докато дериватите ги няма, шаблоните показват
+оригинала. Грешките остават в ImageJob.error.
+
+Дериватите са адресирани по съдържание: derivatives/<sha256 на оригинала>-<отпечатък
+на енкодера>[-<ширина>w].<формат>. Еднакви снимки на различни продукти (или повторно
+качен същият файл) ползват едни и същи файлове, без ново кодиране; кодира се наново
+само при нов оригинал или при смяна на настройките в ENCODERS / IMAGE_WIDTHS
+(`process_image_jobs --outdated`).
+
+Освен пълния размер се прави и стълба от ширини (settings.IMAGE_WIDTHS, без
+увеличаване) във всеки формат; кои варианти има стои в image_variants, така че
+шаблоните (catalog_images: srcset/picture_sources) не пипат storage-а.
+"""
+import hashlib
+import json
+from concurrent.futures import as_completed
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+
+from . import placeholders, versioning
+from .models import ImageJob, Product, ProductImage
+
+# опитай да заредиш AVIF плъгина; ако го няма, просто няма да правим avif
+try:
+    import pillow_avif  # noqa: F401
+    HAS_AVIF = True
+except Exception:
+    HAS_AVIF = False
+
+RETRY_SECONDS = 60  # пауза преди втори опит; удвоява се
+
+# формат → (поле на модела, параметри на енкодера)
+ENCODERS = {
+    'webp': ('image_webp', {'quality': 85, 'method': 6}),  # method 6 = по-добра компресия
+    'avif': ('image_avif', {'quality': 50}),                # avif дава отличен размер и на по-ниско качество
+}
+MODELS = {
+    ImageJob.Kind.PRODUCT: Product,
+    ImageJob.Kind.PRODUCT_IMAGE: ProductImage,
+}
+
+
+def formats():
+    return ['webp', 'avif'] if HAS_AVIF else ['webp']
+
+
+def widths():
+    return sorted({int(w) for w in settings.IMAGE_WIDTHS if int(w) > 0})
+
+
+def format_fingerprint() -> str:
+    """Отпечатък на форматите и настройките им – част от имената на файловете."""
+    spec = json.dumps({fmt: ENCODERS[fmt] for fmt in formats()}, sort_keys=True)
+    return hashlib.sha256(spec.encode()).hexdigest()[:12]
+
+
+def encoder_fingerprint() -> str:
+    """Форматите + стълбата от ширини; при промяна дериватите се допълват/правят наново."""
+    spec = f"{format_fingerprint()}:{','.join(map(str, widths()))}"
+    return hashlib.sha256(spec.encode()).hexdigest()[:12]
+
+
+def derivative_name(source_hash, fingerprint, fmt, width=None) -> str:
+    suffix = f"-{width}w" if width else ''
+    return f"derivatives/{source_hash[:2]}/{source_hash[:32]}-{fingerprint}{suffix}.{fmt}"
+
+
+def encode(im, fmt) -> bytes:
+    out = BytesIO()
+    im.save(out, format=fmt.upper(), **ENCODERS[fmt][1])
+    return out.getvalue()
+
+
+def resize(im, width):
+    if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA' if 'transparency' in im.info or im.mode in ('LA', 'PA') else 'RGB')
+    return im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+
+
+def metadata(im) -> dict:
+    """Размерите и placeholder-ът на оригинала (INGEST_FIELDS)."""
+    return {'image_width': im.width, 'image_height': im.height, 'image_placeholder': placeholders.color(im)}
+
+
+def render(source_name):
+    """
+    Дериватите на оригинала: {поле: име} + image_hash/image_encoder/image_variants
+    (и размерите/placeholder-а, ако при качването не са били изчислени).
+    Кодира само вариантите, които още не съществуват за това съдържание.
+    Върви в процес от пула – само storage, без база.
+    """
+    with default_storage.open(source_name) as fh:
+        data = fh.read()
+    source_hash = hashlib.sha256(data).hexdigest()
+    fingerprint = format_fingerprint()
+    im = Image.open(BytesIO(data))  # само заглавката; пикселите – при първото кодиране
+
+    def stored(name, make):
+        return name if default_storage.exists(name) else default_storage.save(name, ContentFile(make()))
+
+    fields = {'image_hash': source_hash, 'image_encoder': encoder_fingerprint(), 'image_variants': {},
+              **metadata(im)}
+    for fmt in formats():
+        full = stored(derivative_name(source_hash, fingerprint, fmt), lambda: encode(im, fmt))
+        fields[ENCODERS[fmt][0]] = full
+        # {ширина: име} – по-малките от оригинала + самият пълен размер
+        ladder = {str(im.width): full}
+        for width in widths():
+            if width < im.width:
+                ladder[str(width)] = stored(derivative_name(source_hash, fingerprint, fmt, width),
+                                            lambda: encode(resize(im, width), fmt))
+        fields['image_variants'][fmt] = ladder
+    return fields
+
+
+def enqueue(kind, object_id, source_name):
+    """Един чакащ job на обект – повторен save преди работника само сменя източника."""
+    if not ImageJob.objects.filter(kind=kind, object_id=object_id, status=ImageJob.Status.QUEUED).update(
+        source=source_name
+    ):
+        ImageJob.objects.create(kind=kind, object_id=object_id, source=source_name)
+
+
+def claim(batch_size):
+    """Взима до batch_size дължими job-а; условният UPDATE гарантира един работник на job."""
+    ids = (
+        ImageJob.objects.filter(status=ImageJob.Status.QUEUED, next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at', 'id').values_list('id', flat=True)
+    )
+    claimed = [
+        pk for pk in ids[:batch_size]
+        if ImageJob.objects.filter(id=pk, status=ImageJob.Status.QUEUED).update(
+            status=ImageJob.Status.PROCESSING, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+    ]
+    return list(ImageJob.objects.filter(id__in=claimed).order_by('id'))
+
+
+def finish(job, fields):
+    """Записва дериватите – само ако оригиналът не е сменен междувременно (тогава има по-нов job)."""
+    model = MODELS[job.kind]
+    # файловете са споделени по съдържание – не се трият, дори ако тук не потрябват
+    if model.objects.filter(id=job.object_id, image=job.source).update(**fields):
+        product_id = job.object_id if model is Product else (
+            ProductImage.objects.filter(id=job.object_id).values_list('product_id', flat=True).first()
+        )
+        versioning.touch_products([product_id])
+    job.status, job.error, job.finished_at = ImageJob.Status.DONE, '', timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+
+def fail(job, error, max_attempts):
+    """Грешката остава в job-а; нов опит след нарастваща пауза (напр. временно недостъпен S3)."""
+    job.error = str(error)[:255] or error.__class__.__name__
+    job.finished_at = timezone.now()
+    if job.attempts >= max_attempts:
+        job.status = ImageJob.Status.FAILED
+    else:
+        job.status = ImageJob.Status.QUEUED
+        job.next_attempt_at = job.finished_at + timedelta(seconds=RETRY_SECONDS * 2 ** (job.attempts - 1))
+    job.save(update_fields=['status', 'error', 'finished_at', 'next_attempt_at'])
+
+
+def process_batch(batch_size=20, executor=None, max_attempts=3):
+    """Обработва една партида; executor=None – в текущия процес. Връща (готови, неуспешни)."""
+    jobs = claim(batch_size)
+    if executor is None:
+        results = []
+        for job in jobs:
+            try:
+                results.append((job, render(job.source), None))
+            except Exception as exc:
+                results.append((job, None, exc))
+    else:
+        futures = {executor.submit(render, job.source): job for job in jobs}
+        results = []
+        for future in as_completed(futures):
+            exc = future.exception()
+            results.append((futures[future], None if exc else future.result(), exc))
+
+    done = failed = 0
+    for job, names, exc in results:
+        if exc is None:
+            finish(job, names)
+            done += 1
+        else:
+            fail(job, exc, max_attempts)
+            failed += 1
+    return done, failed
+
+
+def requeue_stale(seconds=600):
+    """PROCESSING job-ове от паднал работник → обратно в опашката."""
+    return ImageJob.objects.filter(
+        status=ImageJob.Status.PROCESSING, started_at__lt=timezone.now() - timedelta(seconds=seconds)
+    ).update(status=ImageJob.Status.QUEUED)
+
+
+def enqueue_outdated():
+    """Job-ове за снимките, чиито деривати са от други настройки на енкодера (или ги няма)."""
+    fingerprint = encoder_fingerprint()
+    queued = 0
+    for kind, model in MODELS.items():
+        rows = (
+            model.objects.exclude(Q(image='') | Q(image__isnull=True))
+            .exclude(image_encoder=fingerprint).values_list('id', 'image').iterator()
+        )
+        for pk, source in rows:
+            enqueue(kind, pk, source)
+            queued += 1
+    return queued
+
+
+def backfill_metadata():
+    """Размери и placeholder за снимките отпреди INGEST_FIELDS. Връща (попълнени, неуспешни)."""
+    done = failed = 0
+    product_ids = set()
+    for model in MODELS.values():
+        rows = list(
+            model.objects.exclude(Q(image='') | Q(image__isnull=True))
+            .filter(Q(image_width__isnull=True) | Q(image_height__isnull=True) | Q(image_placeholder=''))
+            .values_list('id', 'image', 'id' if model is Product else 'product_id')
+        )
+        for pk, name, product_id in rows:
+            try:
+                with default_storage.open(name) as fh, Image.open(fh) as im:
+                    fields = metadata(im)
+            except (OSError, Image.DecompressionBombError):
+                failed += 1  # липсващ/повреден оригинал – размерите остават празни
+                continue
+            # без save() – не нулира дериватите и не пуска нов ImageJob
+            if model.objects.filter(id=pk, image=name).update(**fields):
+                product_ids.add(product_id)
+                done += 1
+    if product_ids:
+        versioning.touch_products(product_ids)
+    return done, failed
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog import images
+
+
+class Command(BaseCommand):
+    help = "Попълва размерите и placeholder-а на вече качените снимки (Product/ProductImage)."
+
+    def handle(self, *args, **options):
+        done, failed = images.backfill_metadata()
+        self.stdout.write(self.style.SUCCESS(f"Попълнени снимки: {done}, неуспешни: {failed}"))
@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog import images
+
+
+def _init_worker():
+    # процесите от пула само кодират и пишат в storage-а – без база
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Генерира webp/avif дериватите на качените снимки (ImageJob) в пул от процеси."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="процеси за кодиране (по подразбиране – по един на ядро; 1 = без пул)")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--max-attempts', type=int, default=3)
+        parser.add_argument('--loop', action='store_true', help="не излизай; чакай нови снимки")
+        parser.add_argument('--sleep', type=float, default=5.0, help="пауза при празна опашка (сек.)")
+        parser.add_argument('--outdated', action='store_true',
+                            help="първо добави job-ове за снимките с деривати от стари настройки на енкодера")
+
+    def handle(self, *args, **options):
+        if options['outdated']:
+            self.stdout.write(f"За прекодиране: {images.enqueue_outdated()}")
+        if options['workers'] <= 1:
+            done, failed = self.work(None, options)
+        else:
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                done, failed = self.work(pool, options)
+        self.stdout.write(self.style.SUCCESS(f"Готови снимки: {done}, неуспешни: {failed}"))
+
+    def work(self, pool, options):
+        total_done = total_failed = 0
+        images.requeue_stale()
+        while True:
+            done, failed = images.process_batch(options['batch_size'], pool, options['max_attempts'])
+            total_done += done
+            total_failed += failed
+            if not (done or failed):
+                if not options['loop']:
+                    return total_done, total_failed
+                time.sleep(options['sleep'])
+                images.requeue_stale()
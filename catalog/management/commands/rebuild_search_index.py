@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from catalog import search
+from catalog.models import Product
+
+
+class Command(BaseCommand):
+    help = "Преизгражда пълнотекстовия индекс на продуктите (след bulk import/update)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            search.index_products(ids)
+            total += len(ids)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"Индексирани продукти: {total}"))
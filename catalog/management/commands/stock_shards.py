@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import stock, versioning
+from catalog.models import ProductVariant
+
+
+class Command(BaseCommand):
+    help = "Разделя/изравнява/слива наличността на горещ вариант (флаш разпродажба)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('sku')
+        action = parser.add_mutually_exclusive_group(required=True)
+        action.add_argument('--split', type=int, metavar='N', help="раздели наличността на N шарда")
+        action.add_argument('--rebalance', action='store_true', help="изравни бройките между шардовете")
+        action.add_argument('--merge', action='store_true', help="върни всичко в ProductVariant.stock")
+
+    def handle(self, *args, **options):
+        try:
+            variant = ProductVariant.objects.get(sku=options['sku'])
+        except ProductVariant.DoesNotExist:
+            raise CommandError(f"Няма вариант със SKU {options['sku']}.")
+
+        if options['split']:
+            total = stock.split(variant.id, options['split'])
+            msg = f"{variant.sku}: {total} бр. в {options['split']} шарда"
+        elif options['rebalance']:
+            if not variant.sharded:
+                raise CommandError(f"{variant.sku} не е разделен.")
+            total = stock.rebalance(variant.id)
+            msg = f"{variant.sku}: {total} бр. изравнени"
+        else:
+            total = stock.merge(variant.id)
+            msg = f"{variant.sku}: {total} бр. обратно в един ред"
+
+        versioning.touch_products([variant.product_id])
+        self.stdout.write(self.style.SUCCESS(msg))
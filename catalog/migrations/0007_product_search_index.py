@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from catalog import search
+
+
+def create_index(apps, schema_editor):
+    search.create_index(schema_editor)
+
+    Product = apps.get_model('catalog', 'Product')
+    ProductVariant = apps.get_model('catalog', 'ProductVariant')
+    db = schema_editor.connection.alias
+    skus = {}
+    for product_id, sku in ProductVariant.objects.using(db).values_list('product_id', 'sku'):
+        skus.setdefault(product_id, []).append(sku)
+    rows = [
+        (pk, search.build_document(name, description, skus.get(pk, ())))
+        for pk, name, description in Product.objects.using(db).values_list('id', 'name', 'description')
+    ]
+    search.write_documents(rows, using=db)
+
+
+def drop_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_product_description'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
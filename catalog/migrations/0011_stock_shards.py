@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='sharded',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('stock', models.PositiveIntegerField(default=0)),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='catalog.productvariant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('variant', 'index'), name='stock_shard_unique_index')],
+            },
+        ),
+    ]
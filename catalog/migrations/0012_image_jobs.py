@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'Product.image'), ('product_image', 'ProductImage.image')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('source', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('QUEUED', 'В опашката'), ('PROCESSING', 'Обработва се'), ('DONE', 'Готово'), ('FAILED', 'Неуспешно')], default='QUEUED', max_length=12)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='imagejob_due_idx'), models.Index(fields=['kind', 'object_id'], name='imagejob_object_idx')],
+            },
+        ),
+    ]
@@ -2,19 +2,43 @@ from django.db import models
 from django.urls import reverse
 from decimal import Decimal, ROUND_HALF_UP
 from django.core.exceptions import ValidationError
-from django.utils.text import slugify
-from io import BytesIO
-from PIL import Image
-import os
+from django.utils import timezone
 
-BGN_PER_EUR = Decimal('1.95583')
+from . import placeholders
 
-# опитай да заредиш AVIF плъгина; ако го няма, просто няма да правим avif
-try:
-    import pillow_avif  # noqa: F401
-    HAS_AVIF = True
-except Exception:
-    HAS_AVIF = False
+BGN_PER_EUR = Decimal('1.95583')
+# полетата, които се нулират при нов оригинал и попълват от process_image_jobs
+DERIVATIVE_FIELDS = ('image_webp', 'image_avif', 'image_hash', 'image_encoder', 'image_variants')
+# размерите (width_field/height_field на ImageField) и placeholder-ът – попълват се при качване
+INGEST_FIELDS = ('image_width', 'image_height', 'image_placeholder')
+
+
+def image_changed(instance) -> bool:
+    """Нов, сменен или премахнат оригинал в instance.image спрямо заредения от базата."""
+    if 'image' in instance.get_deferred_fields():
+        return False
+    loaded = getattr(instance, '_loaded_values', None)
+    if instance._state.adding or loaded is None:
+        return bool(instance.image)
+    if instance.image and not instance.image._committed:
+        return True
+    return (loaded.get('image') or '') != (instance.image.name or '')
+
+
+class SizedImageField(models.ImageField):
+    """
+    ImageField, който попълва width_field/height_field само от нов файл (качване
+    или смяна), не и при зареждане от базата: стандартният post_init отваря файла
+    от storage-а (S3 GET) за всеки ред с празни размери. Старите редове попълва
+    `manage.py backfill_image_metadata`.
+    """
+
+    def update_dimension_fields(self, instance, force=False, *args, **kwargs):
+        if not force and self.attname in instance.__dict__:
+            file = getattr(instance, self.attname)
+            if file and file._committed:
+                return
+        super().update_dimension_fields(instance, force, *args, **kwargs)
 
 class Category(models.Model):
     name = models.CharField(max_length=80, unique=True)
@@ -35,63 +59,72 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     old_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     stock = models.PositiveIntegerField(default=0)
-    image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image = SizedImageField(upload_to='products/', blank=True, null=True,
+                            width_field='image_width', height_field='image_height')
+    image_width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    # '#rrggbb' (catalog.placeholders) – фон на <img>, докато снимката се зарежда
+    image_placeholder = models.CharField(max_length=7, blank=True, editable=False)
     active = models.BooleanField(default=True)
 
     # нови полета (деривати)
     image_webp = models.ImageField(upload_to='products/', blank=True, null=True, editable=False)
     image_avif = models.ImageField(upload_to='products/', blank=True, null=True, editable=False)
+    # sha256 на оригинала и отпечатък на енкодера, от които са дериватите (catalog.images)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_encoder = models.CharField(max_length=12, blank=True, editable=False)
+    # {формат: {ширина: име}} – стълбата за srcset (catalog_images), без достъп до storage
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # расте при всяка промяна – част от ключа на кешираната карта (catalog.cards) и от ETag-а
+    cache_version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # частични индекси за product_list: WHERE active [AND category] ORDER BY <sort>, id
+        # (id е tiebreaker-ът и на keyset страницирането; DESC сортовете ползват същия индекс наобратно).
+        # Частични, защото Django филтрира булевото поле като "WHERE active", а не "active = 1".
+        indexes = [
+            models.Index(fields=['name', 'id'], condition=models.Q(active=True), name='product_active_name_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(active=True), name='product_active_price_idx'),
+            models.Index(fields=['stock', 'id'], condition=models.Q(active=True), name='product_active_stock_idx'),
+            models.Index(fields=['category', 'name', 'id'], condition=models.Q(active=True), name='product_cat_name_idx'),
+            models.Index(fields=['category', 'price', 'id'], condition=models.Q(active=True), name='product_cat_price_idx'),
+            models.Index(fields=['category', 'stock', 'id'], condition=models.Q(active=True), name='product_cat_stock_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # помним стойностите от базата – сигналите гледат какво реално се е сменило
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def get_absolute_url(self):
         return reverse('product_detail', args=[self.slug])
 
-    # --- helper-и за деривати ---
-    def _save_derivative(self, source_field_name: str, fmt: str, target_field_name: str, quality: int = 85):
-        src_field = getattr(self, source_field_name)
-        if not src_field:
-            return
-        src_field.open()
-        im = Image.open(src_field)
-        im.load()
-
-        out = BytesIO()
-        base, _ext = os.path.splitext(os.path.basename(src_field.name))
-        fname = f"products/main/{slugify(base)}.{fmt}"
-
-        opts = {}
-        if fmt == "webp":
-            opts = {"quality": quality, "method": 6}  # method 6 = по-добра компресия
-        elif fmt == "avif":
-            opts = {"quality": quality}               # 0-100
-
-        im.save(out, format=fmt.upper(), **opts)
-        out.seek(0)
-
-        # сетни във временния FileField на модела (без save на целия модел)
-        target_field = getattr(self, target_field_name)
-        target_field.save(fname, out, save=False)
-
     def save(self, *args, **kwargs):
-        # първо запази, за да имаме път към оригинала
+        # всяка промяна инвалидира кешираната карта в листинга
+        self.cache_version = (self.cache_version or 0) + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'cache_version', 'updated_at'}
+
+        # нов оригинал – старите деривати не важат; новите прави process_image_jobs (catalog.images)
+        self._image_changed = image_changed(self)
+        if self._image_changed:
+            self.image_webp = self.image_avif = None
+            self.image_hash = self.image_encoder = ''
+            self.image_variants = {}
+            # размерите вече са от качения файл (ImageField); цветът – също, докато е в паметта
+            self.image_placeholder = placeholders.from_upload(self.image)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *DERIVATIVE_FIELDS, *INGEST_FIELDS}
         super().save(*args, **kwargs)
-
-        # ако има главна снимка, генерирай деривати
-        if self.image:
-            try:
-                self._save_derivative("image", "webp", "image_webp", quality=85)
-            except Exception:
-                pass
-            if HAS_AVIF:
-                try:
-                    self._save_derivative("image", "avif", "image_avif", quality=50)
-                except Exception:
-                    pass
-
-            # запази само дериватните полета
-            super().save(update_fields=["image_webp", "image_avif"])
+        if self._image_changed:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), 'image': self.image.name}
 
     # Автоматично изчисляване в евро (само за показване)
     @property
@@ -114,18 +147,40 @@ class Product(models.Model):
             return pct.quantize(Decimal('1'), rounding=ROUND_HALF_UP)
         return None
 
+class CatalogVersion(models.Model):
+    """
+    Брояч на промените в каталога за conditional GET (ETag/Last-Modified).
+    scope: 'global', 'categories' (сайдбарът) или 'category:<id>'.
+    """
+    scope = models.CharField(max_length=40, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
 class ProductImage(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/extra/')
+    image = SizedImageField(upload_to='products/extra/', width_field='image_width', height_field='image_height')
+    image_width = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_height = models.PositiveIntegerField(blank=True, null=True, editable=False)
+    image_placeholder = models.CharField(max_length=7, blank=True, editable=False)
     # нови полета за деривати:
     image_webp = models.ImageField(upload_to='products/extra/', blank=True, null=True, editable=False)
     image_avif = models.ImageField(upload_to='products/extra/', blank=True, null=True, editable=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_encoder = models.CharField(max_length=12, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=120, blank=True)
     sort_order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['sort_order', 'id']
+        indexes = [
+            # prefetch на галерията: WHERE product_id IN (...) ORDER BY sort_order, id
+            models.Index(fields=['product', 'sort_order', 'id'], name='productimage_order_idx'),
+        ]
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -137,60 +192,71 @@ class ProductImage(models.Model):
             if count >= 5:
                 raise ValidationError("Може да качите най-много 5 допълнителни снимки за продукт.")
 
-    # ---- helper-и за конвертиране ----
-    def _save_derivative(self, fmt: str, quality: int = 85):
-        """Създай webp/avif вариант и го запиши в съответното поле."""
-        if not self.image:
-            return
-
-        # отваряме оригинала
-        self.image.open()
-        im = Image.open(self.image)
-        im.load()
-
-        # правим без загуба на EXIF ориентация (по желание може да нормализираш)
-        out = BytesIO()
-
-        base, _ext = os.path.splitext(os.path.basename(self.image.name))
-        fname = f"products/extra/{slugify(base)}.{fmt}"
-
-        opts = {}
-        if fmt == "webp":
-            # lossless можеш да пуснеш с: opts = {"lossless": True}
-            opts = {"quality": quality, "method": 6}
-        elif fmt == "avif":
-            # pillow-avif-plugin: quality 0-100
-            opts = {"quality": quality}
-
-        im.save(out, format=fmt.upper(), **opts)
-        out.seek(0)
-
-        django_file = models.FileField().to_python(fname)
-        # избираме правилното поле
-        if fmt == "webp":
-            self.image_webp.save(fname, out, save=False)
-        elif fmt == "avif":
-            self.image_avif.save(fname, out, save=False)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
-        """При запис — създаваме/обновяваме webp (+ avif ако има плъгин)."""
-        super().save(*args, **kwargs)  # първо запиши оригинала (за да има self.image.path/url)
-
-        # Генерирай WEBP винаги
-        try:
-            self._save_derivative("webp", quality=85)
-        except Exception:
-            pass
-
-        # Генерирай AVIF, ако имаме плъгин
-        if HAS_AVIF:
-            try:
-                self._save_derivative("avif", quality=50)  # avif често дава отличен размер и на по-ниско качество
-            except Exception:
-                pass
-
-        # запази отново, за да запишем и дериватите
-        super().save(update_fields=['image_webp', 'image_avif'])
-        
+        """Дериватите (webp/avif) се правят от process_image_jobs – тук само се нулират при нов оригинал."""
+        self._image_changed = image_changed(self)
+        if self._image_changed:
+            self.image_webp = self.image_avif = None
+            self.image_hash = self.image_encoder = ''
+            self.image_variants = {}
+            # размерите вече са от качения файл (ImageField); цветът – също, докато е в паметта
+            self.image_placeholder = placeholders.from_upload(self.image)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *DERIVATIVE_FIELDS, *INGEST_FIELDS}
+        super().save(*args, **kwargs)
+        if self._image_changed:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), 'image': self.image.name}
+
+
+class ImageJob(models.Model):
+    """Чакащи деривати на снимка (catalog.images); обработва ги `manage.py process_image_jobs`."""
+    class Kind(models.TextChoices):
+        PRODUCT = 'product', 'Product.image'
+        PRODUCT_IMAGE = 'product_image', 'ProductImage.image'
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', 'В опашката'
+        PROCESSING = 'PROCESSING', 'Обработва се'
+        DONE = 'DONE', 'Готово'
+        FAILED = 'FAILED', 'Неуспешно'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.PositiveBigIntegerField()
+    source = models.CharField(max_length=255)  # името на оригинала при записа
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # пауза след неуспешен опит
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='imagejob_due_idx'),
+            models.Index(fields=['kind', 'object_id'], name='imagejob_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}#{self.object_id} ({self.get_status_display()})"
+
+
+class ProductVariantQuerySet(models.QuerySet):
+    def with_stock(self):
+        """Анотира shard_stock (сумата на StockShard-овете) – за горещите варианти, в същата заявка."""
+        total = (
+            StockShard.objects.filter(variant=models.OuterRef('pk'))
+            .values('variant').annotate(total=models.Sum('stock')).values('total')
+        )
+        return self.annotate(shard_stock=models.Subquery(total))
+
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
     sku = models.CharField(max_length=64, unique=True)
@@ -198,7 +264,41 @@ class ProductVariant(models.Model):
     color = models.CharField(max_length=32, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
+    # „горещ“ вариант: наличността е разделена в StockShard редове (catalog.stock), stock е 0
+    sharded = models.BooleanField(default=False, editable=False)
+
+    objects = ProductVariantQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # product_detail подрежда вариантите по размер/цвят (за regroup)
+            models.Index(fields=['product', 'size', 'color', 'id'], name='variant_product_attrs_idx'),
+        ]
 
     def __str__(self):
         attrs = ", ".join(a for a in [self.size, self.color] if a)
-        return f"{self.product.name} [{attrs or self.sku}]"
\ No newline at end of file
+        return f"{self.product.name} [{attrs or self.sku}]"
+
+    @property
+    def available_stock(self) -> int:
+        """Реалната наличност – stock или сумата на шардовете (от with_stock(), ако е анотирана)."""
+        if not self.sharded:
+            return self.stock
+        if hasattr(self, 'shard_stock'):
+            return self.shard_stock or 0
+        return self.shards.aggregate(total=models.Sum('stock'))['total'] or 0
+
+
+class StockShard(models.Model):
+    """Една от N части на наличността на горещ вариант – поръчките се разпределят по различни редове."""
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['variant', 'index'], name='stock_shard_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.variant_id}#{self.index}: {self.stock}"
@@ -0,0 +1,89 @@
+"""
+Keyset (cursor) странициране за продуктовия списък.
+
+Вместо OFFSET + COUNT(*) пазим последния видян (sort_key, id) в непрозрачен
+подписан токен (?after=...). Следващата страница е range заявка по индекса,
+така че цената е една и съща на всяка дълбочина.
+"""
+import hashlib
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+CURSOR_SALT = 'catalog.cursor'
+COUNT_CACHE_SECONDS = getattr(settings, 'CATALOG_COUNT_CACHE_SECONDS', 300)
+
+# как да върнем стойността от JSON-а в правилния тип
+SORT_FIELDS = {
+    'name': str,
+    'price': Decimal,
+    'stock': int,
+}
+
+
+@dataclass(frozen=True)
+class KeysetPage:
+    object_list: list
+    has_next: bool
+    next_token: str
+    is_first: bool
+
+
+def ordering_for(sort: str):
+    """order_by(...) с id като tiebreaker в същата посока (за стабилен ключ)."""
+    return (sort, '-id') if sort.startswith('-') else (sort, 'id')
+
+
+def encode_cursor(sort: str, obj) -> str:
+    field = sort.lstrip('-')
+    return signing.dumps([sort, str(getattr(obj, field)), obj.pk], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token: str, sort: str):
+    """(value, pk) или None, ако токенът е невалиден/за друго сортиране."""
+    try:
+        token_sort, value, pk = signing.loads(token, salt=CURSOR_SALT)
+        if token_sort != sort:
+            return None
+        return SORT_FIELDS[sort.lstrip('-')](value), int(pk)
+    except Exception:
+        return None
+
+
+def keyset_page(qs, sort: str, after: str = None, per_page: int = 20) -> KeysetPage:
+    field = sort.lstrip('-')
+    qs = qs.order_by(*ordering_for(sort))
+
+    cursor = decode_cursor(after, sort) if after else None
+    if cursor is not None:
+        value, pk = cursor
+        if sort.startswith('-'):
+            # >=/<= дава начало на range scan-а, OR-ът решава само равните стойности
+            qs = qs.filter(Q(**{f'{field}__lte': value}), Q(**{f'{field}__lt': value}) | Q(id__lt=pk))
+        else:
+            qs = qs.filter(Q(**{f'{field}__gte': value}), Q(**{f'{field}__gt': value}) | Q(id__gt=pk))
+
+    rows = list(qs[:per_page + 1])
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    return KeysetPage(
+        object_list=rows,
+        has_next=has_next,
+        next_token=encode_cursor(sort, rows[-1]) if has_next else '',
+        is_first=cursor is None,
+    )
+
+
+def cached_count(qs, *key_parts, timeout: int = COUNT_CACHE_SECONDS) -> int:
+    """Приблизителен брой: COUNT(*) веднъж на `timeout` секунди за даден филтър."""
+    digest = hashlib.md5(repr(key_parts).encode('utf-8')).hexdigest()
+    key = f'catalog:count:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = qs.order_by().count()
+        cache.set(key, count, timeout)
+    return count
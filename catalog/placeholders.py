@@ -0,0 +1,32 @@
+"""
+Placeholder на продуктовите снимки – средният цвят ('#rrggbb').
+
+Изчислява се веднъж при качване (Product/ProductImage.save() от файла в паметта)
+или от process_image_jobs / backfill_image_metadata, и се пази в image_placeholder
+заедно с размерите (image_width/image_height) – шаблоните ги изписват inline, без
+достъп до storage-а.
+"""
+from PIL import Image
+
+
+def color(im) -> str:
+    """Средният цвят; прозрачните части се смесват с бял фон."""
+    r, g, b, a = im.convert('RGBA').resize((1, 1), Image.BOX).getpixel((0, 0))
+    r, g, b = (round((c * a + 255 * (255 - a)) / 255) for c in (r, g, b))
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def from_upload(fieldfile) -> str:
+    """Placeholder от току-що качен (още незаписан) файл; '' ако файлът не е в паметта или не се чете."""
+    if not fieldfile or fieldfile._committed:
+        return ''
+    fh = fieldfile.file
+    pos = fh.tell()
+    try:
+        fh.seek(0)
+        with Image.open(fh) as im:
+            return color(im)
+    except (OSError, Image.DecompressionBombError):
+        return ''
+    finally:
+        fh.seek(pos)
@@ -0,0 +1,174 @@
+"""
+Пълнотекстово търсене по продукти.
+
+Индексът е отделна таблица `catalog_product_fts`:
+- SQLite  → FTS5 виртуална таблица (rowid = product.id)
+- Postgres → tsvector колона с GIN индекс
+
+Текстът се нормализира в Python (малки букви, кирилица → латиница,
+просто премахване на окончания), така че „тениски“, „тениската“ и
+„teniski“ дават един и същ токен и в двете бази.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'catalog_product_fts'
+
+# Обтекаема система (официалната българска транслитерация) + руски букви за всеки случай
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sht', 'ъ': 'a', 'ь': 'y', 'ю': 'yu', 'я': 'ya',
+    'ё': 'yo', 'ы': 'y', 'э': 'e',
+}
+
+# Окончания (вече транслитерирани), най-дългите първи:
+# членувани форми, множествено число, прилагателни.
+SUFFIXES = (
+    'ovete', 'evete', 'yata', 'ishta',
+    'ite', 'ata', 'ota', 'oto', 'ove', 'eve', 'iya', 'yat',
+    'ta', 'te', 'to', 'ti', 'at', 'ia', 'ya', 'ni', 'na', 'no',
+    'a', 'e', 'i', 'o', 'u', 'y',
+)
+MIN_STEM = 3
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+
+def transliterate(text: str) -> str:
+    text = text.casefold()
+    text = ''.join(TRANSLIT.get(ch, ch) for ch in text)
+    # махни диакритики (é → e и т.н.)
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def stem(token: str) -> str:
+    if token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> list:
+    """Нормализирани токени за индекс и за заявка (един и същ pipeline)."""
+    if not text:
+        return []
+    return [stem(t) for t in _TOKEN_RE.findall(transliterate(text))]
+
+
+def build_document(name: str, description: str = '', skus=()) -> str:
+    tokens = tokenize(name) + tokenize(description)
+    for sku in skus:
+        tokens += tokenize(sku)
+        # и слепен вариант: "TS-001-RED" → "ts001red"
+        tokens.append(''.join(_TOKEN_RE.findall(transliterate(sku))))
+    return ' '.join(t for t in tokens if t)
+
+
+def build_query(text: str):
+    """Връща (sql, params) за подзаявка с product id-та или None при празна заявка."""
+    tokens = list(dict.fromkeys(tokenize(text)))[:8]
+    if not tokens:
+        return None
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        return f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]
+    if connection.vendor == 'postgresql':
+        match = ' & '.join(f'{t}:*' for t in tokens)
+        return (
+            f"SELECT product_id FROM {FTS_TABLE} WHERE document @@ to_tsquery('simple', %s)",
+            [match],
+        )
+    return None
+
+
+def search_products(qs, text: str):
+    """Филтрира queryset от Product по търсения текст."""
+    query = build_query(text)
+    if query is not None:
+        return qs.filter(id__in=RawSQL(*query))
+
+    # бази без индекс (напр. MySQL) – бавен, но коректен резервен вариант
+    from django.db.models import Q
+    cond = Q()
+    for word in text.split():
+        cond &= Q(name__icontains=word) | Q(description__icontains=word) | Q(variants__sku__icontains=word)
+    return qs.filter(cond).distinct() if cond else qs
+
+
+# --- поддръжка на индекса ---
+
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(document, tokenize='unicode61')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {FTS_TABLE} ("
+            "product_id bigint PRIMARY KEY REFERENCES catalog_product(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {FTS_TABLE}_document_gin ON {FTS_TABLE} USING GIN (document)"
+        )
+
+
+def drop_index(schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def write_documents(rows, using='default'):
+    """rows: итерируемо от (product_id, document). Upsert в индекса."""
+    from django.db import connections
+    conn = connections[using]
+    rows = list(rows)
+    if not rows:
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk, _ in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)', rows)
+        elif conn.vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (product_id, document) VALUES (%s, to_tsvector('simple', %s)) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+
+
+def delete_documents(product_ids, using='default'):
+    from django.db import connections
+    conn = connections[using]
+    ids = [(pk,) for pk in product_ids]
+    if not ids or conn.vendor not in ('sqlite', 'postgresql'):
+        return
+    column = 'rowid' if conn.vendor == 'sqlite' else 'product_id'
+    with conn.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE {column} = %s', ids)
+
+
+def documents_for(product_qs):
+    """(id, document) за всички продукти в queryset-а; SKU-тата с една заявка."""
+    from .models import ProductVariant
+    products = list(product_qs.values_list('id', 'name', 'description'))
+    skus = {}
+    for product_id, sku in ProductVariant.objects.filter(
+        product_id__in=[p[0] for p in products]
+    ).values_list('product_id', 'sku'):
+        skus.setdefault(product_id, []).append(sku)
+    return [(pk, build_document(name, description, skus.get(pk, ()))) for pk, name, description in products]
+
+
+def index_products(product_ids, using='default'):
+    from .models import Product
+    write_documents(documents_for(Product.objects.using(using).filter(id__in=product_ids)), using=using)
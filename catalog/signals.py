@@ -0,0 +1,58 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import images, search, versioning
+from .models import Category, ImageJob, Product, ProductImage, ProductVariant
+
+# индексът се обновява само при запис на някое от тези полета (или на целия ред);
+# запис на stock, price, изображения и т.н. не сменя текста за търсене
+SEARCH_FIELDS = {'name', 'description', 'category', 'category_id', 'active'}
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    # при преместване в друга категория се сменят и двата листинга
+    old_category_id = getattr(instance, '_loaded_values', {}).get('category_id')
+    versioning.bump_categories(instance.category_id, old_category_id, using=using)
+    if getattr(instance, '_image_changed', False) and instance.image:
+        # в същата транзакция – job-ът съществува точно когато и новият оригинал
+        images.enqueue(ImageJob.Kind.PRODUCT, instance.pk, instance.image.name)
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_products([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, using='default', **kwargs):
+    search.delete_documents([instance.pk], using=using)
+    versioning.bump_categories(instance.category_id, using=using)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    # SKU-тата са част от документа на продукта, а вариантите – от детайла
+    search.index_products([instance.product_id], using=using)
+    versioning.touch_products([instance.product_id], using=using)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    if kwargs.get('signal') is post_save and getattr(instance, '_image_changed', False) and instance.image:
+        images.enqueue(ImageJob.Kind.PRODUCT_IMAGE, instance.pk, instance.image.name)
+    versioning.touch_products([instance.product_id], using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, raw=False, using='default', **kwargs):
+    if raw:
+        return
+    versioning.bump(versioning.CATEGORIES, versioning.category_scope(instance.pk), using=using)
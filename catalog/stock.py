@@ -0,0 +1,112 @@
+"""
+Разделена наличност за „горещи“ варианти (флаш разпродажби).
+
+При sharded=True наличността на варианта стои в N реда StockShard, а
+ProductVariant.stock е 0. Всяка поръчка намалява случаен шард с достатъчно
+бройки, така че едновременните поръчки заключват различни редове вместо
+един и същ. Четенето сумира шардовете (ProductVariant.objects.with_stock()).
+
+Шардовете винаги се заключват по index – в един и същ ред навсякъде, без deadlock.
+Версиите на каталога (картите/ETag-овете) не се вдигат при всяка продажба от
+шард – само когато вариантът се изчерпа или отново има наличност (checkout.services).
+
+    manage.py stock_shards SKU --split 8     # раздели на 8 шарда
+    manage.py stock_shards SKU --rebalance   # изравни бройките между шардовете
+    manage.py stock_shards SKU --merge       # върни всичко в ProductVariant.stock
+"""
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import ProductVariant, StockShard
+
+
+def _spread(total: int, shards: int) -> list:
+    base, extra = divmod(total, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def total(variant_id) -> int:
+    return StockShard.objects.filter(variant_id=variant_id).aggregate(total=Sum('stock'))['total'] or 0
+
+
+@transaction.atomic
+def split(variant_id, shards: int):
+    """Премества наличността на варианта в `shards` реда (или преразпределя вече разделената)."""
+    if shards < 1:
+        raise ValueError("Броят шардове трябва да е поне 1.")
+    variant = ProductVariant.objects.select_for_update().get(id=variant_id)
+    existing = list(StockShard.objects.select_for_update().filter(variant=variant).order_by('index'))
+    stock = variant.stock + sum(s.stock for s in existing)
+
+    StockShard.objects.filter(variant=variant).delete()
+    StockShard.objects.bulk_create(
+        StockShard(variant=variant, index=i, stock=qty) for i, qty in enumerate(_spread(stock, shards))
+    )
+    ProductVariant.objects.filter(id=variant.id).update(sharded=True, stock=0)
+    return stock
+
+
+@transaction.atomic
+def rebalance(variant_id):
+    """Изравнява бройките между шардовете (напр. когато част от тях са изпразнени)."""
+    shards = list(StockShard.objects.select_for_update().filter(variant_id=variant_id).order_by('index'))
+    if not shards:
+        return 0
+    for shard, qty in zip(shards, _spread(sum(s.stock for s in shards), len(shards))):
+        shard.stock = qty
+    StockShard.objects.bulk_update(shards, ['stock'])
+    return sum(s.stock for s in shards)
+
+
+@transaction.atomic
+def merge(variant_id):
+    """Край на разпродажбата: сумата отива обратно в ProductVariant.stock, шардовете се трият."""
+    variant = ProductVariant.objects.select_for_update().get(id=variant_id)
+    shards = list(StockShard.objects.select_for_update().filter(variant=variant).order_by('index'))
+    stock = variant.stock + sum(s.stock for s in shards)
+    StockShard.objects.filter(variant=variant).delete()
+    ProductVariant.objects.filter(id=variant.id).update(sharded=False, stock=stock)
+    return stock
+
+
+def take(variant_id, qty: int) -> bool:
+    """
+    Намалява наличността с qty (извиква се в транзакцията на поръчката).
+    Първо опитва шардове с достатъчно бройки в случаен ред – един условен UPDATE
+    на успешен опит; ако нито един не стига сам, събира от няколко.
+    False = общо няма толкова (транзакцията трябва да се върне).
+    """
+    candidates = list(
+        StockShard.objects.filter(variant_id=variant_id, stock__gte=qty).values_list('id', flat=True)
+    )
+    random.shuffle(candidates)
+    for shard_id in candidates:
+        if StockShard.objects.filter(id=shard_id, stock__gte=qty).update(stock=F('stock') - qty):
+            return True
+
+    # никой шард не стига сам – вземи от няколко, под заключване (по index, като навсякъде)
+    shards = list(
+        StockShard.objects.select_for_update().filter(variant_id=variant_id, stock__gt=0).order_by('index')
+    )
+    if sum(s.stock for s in shards) < qty:
+        return False
+    left = qty
+    for shard in shards:
+        part = min(left, shard.stock)
+        if not StockShard.objects.filter(id=shard.id, stock__gte=part).update(stock=F('stock') - part):
+            return False
+        left -= part
+        if not left:
+            break
+    return True
+
+
+def give(variant_id, qty: int):
+    """Връща бройки (отказана поръчка) в случаен шард."""
+    shard_ids = list(StockShard.objects.filter(variant_id=variant_id).values_list('id', flat=True))
+    if shard_ids:
+        StockShard.objects.filter(id=random.choice(shard_ids)).update(stock=F('stock') + qty)
+        return True
+    return False
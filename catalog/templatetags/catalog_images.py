@@ -0,0 +1,77 @@
+"""
+srcset/sizes за продуктовите снимки от записаната стълба (image_variants).
+
+    {% load catalog_images %}
+    <picture>
+      {% picture_sources p "(max-width: 600px) 50vw, 280px" %}
+      <img src="{{ p.image.url }}" ...>
+    </picture>
+
+URL-ите се строят от имената в базата (storage.url) – без заявки към storage-а.
+Докато дериватите ги няма, остава само оригиналът в <img>. Миниатюрите
+взимат src от най-малката ширина: <img src="{{ img|thumb_url }}" ...>.
+
+За снимки без деривати – пресет от /img/ (shop.image_proxy):
+
+    <img src="{{ img.image|preset_url:'square' }}" width="96" height="96">
+"""
+import posixpath
+
+from django import template
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from shop.image_proxy import SOURCE_EXTENSIONS
+
+register = template.Library()
+
+# по реда на предпочитание на браузъра – първият поддържан <source> печели
+SOURCE_FORMATS = (('avif', 'image_avif'), ('webp', 'image_webp'))
+
+
+@register.filter
+def srcset(obj, fmt):
+    """"url 240w, url 480w, ..." за формата или "" (няма стълба)."""
+    ladder = (getattr(obj, 'image_variants', None) or {}).get(fmt) or {}
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for width, name in sorted(ladder.items(), key=lambda item: int(item[0]))
+    )
+
+
+@register.filter
+def thumb_url(obj):
+    """Най-малката ширина от WebP стълбата (за src на миниатюри); иначе оригиналът."""
+    ladder = (getattr(obj, 'image_variants', None) or {}).get('webp') or {}
+    if ladder:
+        return default_storage.url(ladder[min(ladder, key=int)])
+    return obj.image.url if obj.image else ''
+
+
+@register.filter
+def preset_url(fieldfile, preset):
+    """/img/<preset>/<име>; оригиналът, ако форматът/папката не се поддържат (напр. SVG)."""
+    name = getattr(fieldfile, 'name', '') or ''
+    if not name:
+        return ''
+    if (preset not in settings.IMAGE_PRESETS
+            or posixpath.splitext(name)[1].lower() not in SOURCE_EXTENSIONS
+            or not name.startswith(tuple(settings.IMAGE_PROXY_PREFIXES))):
+        return fieldfile.url
+    return reverse('image_proxy', args=[preset, name])
+
+
+@register.simple_tag
+def picture_sources(obj, sizes='100vw'):
+    """<source> за AVIF и WebP: стълбата с sizes, ако я има, иначе пълният дериват."""
+    sources = []
+    for fmt, field in SOURCE_FORMATS:
+        candidates = srcset(obj, fmt)
+        if candidates:
+            sources.append(format_html('<source type="image/{}" srcset="{}" sizes="{}">', fmt, candidates, sizes))
+        elif getattr(obj, field, None):
+            sources.append(format_html('<source type="image/{}" srcset="{}">', fmt, getattr(obj, field).url))
+    return mark_safe(''.join(sources))
@@ -0,0 +1,53 @@
+import pytest
+from decimal import Decimal
+from django.core.cache import cache
+from catalog.models import Category, Product, ProductImage
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+@pytest.mark.django_db
+def test_cards_are_cached_until_product_changes(client):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='Стара', slug='a', price=Decimal('10'))
+
+    assert 'Стара' in client.get('/').content.decode()
+    # промяна покрай save() не бумпва версията → картата идва от кеша
+    Product.objects.filter(pk=p.pk).update(name='Скрита')
+    assert 'Стара' in client.get('/').content.decode()
+
+    p.refresh_from_db()
+    p.name = 'Нова'
+    p.save()
+    html = client.get('/').content.decode()
+    assert 'Нова' in html and 'Стара' not in html
+    # CSRF токенът не се пече в кешираната карта – попълва се от cart_state
+    assert 'name="csrfmiddlewaretoken" value=""' in html
+
+
+@pytest.mark.django_db
+def test_new_salt_rerenders_cached_cards(client, settings):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='Стара', slug='a', price=Decimal('10'))
+    assert 'Стара' in client.get('/').content.decode()
+
+    # деплой с нов шаблон на картата – версията на продукта не се е сменила
+    Product.objects.filter(pk=p.pk).update(name='Нова')
+    settings.CATALOG_ETAG_SALT = 'deploy-2'
+    assert 'Нова' in client.get('/').content.decode()
+
+
+@pytest.mark.django_db
+def test_product_image_change_bumps_card_version():
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'))
+    version = Product.objects.get(pk=p.pk).cache_version
+    img = ProductImage(product=p, image='products/extra/missing.jpg')
+    img.save()
+    assert Product.objects.get(pk=p.pk).cache_version > version
+    version = Product.objects.get(pk=p.pk).cache_version
+    img.delete()
+    assert Product.objects.get(pk=p.pk).cache_version > version
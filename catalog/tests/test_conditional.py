@@ -0,0 +1,62 @@
+import pytest
+from decimal import Decimal
+from branding.models import SiteBranding
+from catalog.models import Category, Product, ProductVariant
+
+
+@pytest.fixture
+def product(db):
+    SiteBranding.get_current()  # създава се при първия рендер и би сменил ETag-а
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'))
+
+
+@pytest.mark.django_db
+def test_list_revalidation_is_cheap_and_tracks_changes(client, product, django_assert_max_num_queries):
+    r = client.get('/')
+    etag = r['ETag']
+    assert r.status_code == 200 and r.has_header('Last-Modified')
+
+    with django_assert_max_num_queries(3):
+        r = client.get('/', HTTP_IF_NONE_MATCH=etag)
+    assert r.status_code == 304
+
+    product.price = Decimal('9')
+    product.save()
+    r = client.get('/', HTTP_IF_NONE_MATCH=etag)
+    assert r.status_code == 200 and r['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_category_listing_ignores_other_categories(client, product):
+    other = Category.objects.create(name='Y', slug='y')
+    etag = client.get('/', {'cat': 'x'})['ETag']
+    Product.objects.create(category=other, name='B', slug='b', price=Decimal('1'))
+    assert client.get('/', {'cat': 'x'}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+
+@pytest.mark.django_db
+def test_detail_changes_with_variants(client, product):
+    etag = client.get('/p/a/')['ETag']
+    assert client.get('/p/a/', HTTP_IF_NONE_MATCH=etag).status_code == 304
+    ProductVariant.objects.create(product=product, sku='A-1', price=Decimal('10'), stock=1)
+    assert client.get('/p/a/', HTTP_IF_NONE_MATCH=etag).status_code == 200
+    assert client.get('/p/missing/').status_code == 404
+
+
+@pytest.mark.django_db
+def test_catalog_pages_are_shared_cacheable(client, product):
+    for url in ('/', '/p/a/'):
+        r = client.get(url)
+        assert 'public' in r['Cache-Control'] and 's-maxage' in r['Cache-Control']
+        assert 'Cookie' not in r.get('Vary', '')
+        assert not r.cookies
+
+    # състоянието на посетителя идва от отделен, некешируем endpoint
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    product.stock = 5
+    product.save()
+    client.post(f'/cart/add/{product.id}/', {'qty': 2})
+    state = client.get('/cart/state/').json()
+    assert state['count'] == 2 and state['csrf_token']
+    assert 'no-store' in client.get('/cart/state/')['Cache-Control']
@@ -0,0 +1,181 @@
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from PIL import Image
+
+from catalog.models import Category, ImageJob, Product, ProductImage
+
+
+def png(name='photo.png', color=(200, 30, 30)):
+    out = BytesIO()
+    Image.new('RGB', (64, 48), color).save(out, format='PNG')
+    return SimpleUploadedFile(name, out.getvalue(), content_type='image/png')
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.fixture
+def product(db):
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), image=png())
+
+
+def run(*args):
+    call_command('process_image_jobs', '--workers', '1', *args, stdout=StringIO())
+
+
+def test_save_only_queues_a_job(product):
+    job = ImageJob.objects.get()
+    assert (job.kind, job.object_id, job.source) == (ImageJob.Kind.PRODUCT, product.id, product.image.name)
+    assert not product.image_webp
+
+    # цена/наличност не пипат снимката – нов job няма
+    product.price = Decimal('12')
+    product.save()
+    assert ImageJob.objects.count() == 1
+
+
+def test_worker_writes_derivatives_and_bumps_card_version(product):
+    version = Product.objects.get().cache_version
+    run()
+
+    fresh = Product.objects.get()
+    assert fresh.image_webp.name.endswith('.webp')
+    assert Image.open(fresh.image_webp).format == 'WEBP'
+    assert fresh.cache_version > version
+    assert ImageJob.objects.get().status == ImageJob.Status.DONE
+
+
+def test_new_original_clears_stale_derivatives(product):
+    run()
+    product = Product.objects.get()
+    product.image = png('other.png', color=(0, 0, 255))
+    product.save()
+
+    assert not Product.objects.get().image_webp  # шаблоните показват оригинала до новия job
+    job = ImageJob.objects.filter(status=ImageJob.Status.QUEUED).get()
+    assert job.source == product.image.name
+
+
+def test_gallery_images_are_queued_too(product):
+    img = ProductImage.objects.create(product=product, image=png('g.png'))
+    assert ImageJob.objects.filter(kind=ImageJob.Kind.PRODUCT_IMAGE, object_id=img.id).exists()
+    run()
+    assert ProductImage.objects.get().image_webp.name.endswith('.webp')
+
+
+def test_failures_are_recorded_on_the_job(product, settings):
+    (settings.MEDIA_ROOT / product.image.name).write_bytes(b'not an image')
+    run('--max-attempts', '2')
+    job = ImageJob.objects.get()
+    assert job.status == ImageJob.Status.QUEUED and job.error  # ще се опита отново, след пауза
+    run('--max-attempts', '2')
+    assert ImageJob.objects.get().attempts == 1
+
+    ImageJob.objects.update(next_attempt_at=job.created_at)
+    run('--max-attempts', '2')
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (ImageJob.Status.FAILED, 2)
+    assert 'cannot identify image' in job.error
+
+
+def test_process_pool(product):
+    ProductImage.objects.create(product=product, image=png('g.png'))
+    call_command('process_image_jobs', '--workers', '2', stdout=StringIO())
+    assert set(ImageJob.objects.values_list('status', flat=True)) == {ImageJob.Status.DONE}
+    assert Product.objects.get().image_webp and ProductImage.objects.get().image_webp
+
+
+def test_price_and_stock_updates_do_no_image_work(product, monkeypatch):
+    from django.core.files.storage import default_storage
+    run()
+    monkeypatch.setattr(default_storage, 'open', lambda *a, **k: pytest.fail("storage read"))
+
+    product = Product.objects.get()
+    product.price, product.stock = Decimal('11'), 3
+    product.save()
+    run()
+    assert ImageJob.objects.filter(status=ImageJob.Status.QUEUED).count() == 0
+
+
+def test_identical_originals_share_one_derivative(product, monkeypatch):
+    from catalog import images
+    encoded = []
+    real_encode = images.encode
+    monkeypatch.setattr(images, 'encode', lambda im, fmt: encoded.append(fmt) or real_encode(im, fmt))
+
+    other = Product.objects.create(category=product.category, name='B', slug='b', price=Decimal('10'), image=png())
+    run()
+
+    a, b = Product.objects.get(id=product.id), Product.objects.get(id=other.id)
+    assert a.image.name != b.image.name
+    assert a.image_webp.name == b.image_webp.name
+    assert a.image_hash == b.image_hash and len(a.image_hash) == 64
+    assert len(encoded) == len(images.formats())  # кодирано веднъж за двата
+
+
+def test_encoder_change_requeues_outdated(product, monkeypatch):
+    from catalog import images
+    run()
+    before = Product.objects.get().image_webp.name
+
+    monkeypatch.setitem(images.ENCODERS, 'webp', ('image_webp', {'quality': 70, 'method': 4}))
+    run('--outdated')
+    after = Product.objects.get()
+    assert after.image_webp.name != before
+    assert after.image_encoder == images.encoder_fingerprint()
+
+
+def test_width_ladder_in_every_format(db, settings):
+    settings.IMAGE_WIDTHS = [16, 32, 128]  # 128 > оригинала (64) – без увеличаване
+    from catalog import images
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), image=png())
+    run()
+
+    variants = Product.objects.get(id=p.id).image_variants
+    assert set(variants) == set(images.formats())
+    assert sorted(variants['webp'], key=int) == ['16', '32', '64']
+    with Image.open(settings.MEDIA_ROOT / variants['webp']['32']) as im:
+        assert im.size == (32, 24)
+
+
+def test_srcset_helpers_render_without_storage(product, monkeypatch):
+    from django.core.files.storage import default_storage
+    from django.template import Context, Template
+    run()
+    product = Product.objects.get()
+    monkeypatch.setattr(default_storage, 'exists', lambda *a: pytest.fail("storage exists"))
+    monkeypatch.setattr(default_storage, 'open', lambda *a, **k: pytest.fail("storage read"))
+
+    html = Template(
+        '{% load catalog_images %}{% picture_sources p "50vw" %}|{{ p|srcset:"webp" }}'
+    ).render(Context({'p': product}))
+    sources, srcset = html.split('|')
+    assert 'type="image/webp"' in sources and 'sizes="50vw"' in sources
+    assert srcset.count('w, ') == len(product.image_variants['webp']) - 1
+    assert srcset.startswith('/media/derivatives/') and '-240w' not in srcset  # 64px оригинал
+
+
+def test_thumb_src_is_the_smallest_derivative(product, settings):
+    from django.template import Context, Template
+    settings.IMAGE_WIDTHS = [16, 32]
+    template = Template('{% load catalog_images %}{{ p|thumb_url }}')
+    assert template.render(Context({'p': product})) == product.image.url
+
+    run()
+    product = Product.objects.get()
+    smallest = product.image_variants['webp']['16']
+    assert template.render(Context({'p': product})) == f'/media/{smallest}'
+
+
+def test_picture_falls_back_to_original_until_ready(product):
+    from django.template import Context, Template
+    html = Template('{% load catalog_images %}{% picture_sources p "50vw" %}').render(Context({'p': product}))
+    assert html == ''
@@ -0,0 +1,107 @@
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from PIL import Image
+
+from catalog import placeholders
+from catalog.models import Category, ImageJob, Product, ProductImage
+
+
+def png_bytes(color=(200, 30, 30), size=(64, 48), mode='RGB'):
+    out = BytesIO()
+    Image.new(mode, size, color).save(out, format='PNG')
+    return out.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.fixture
+def category(db):
+    return Category.objects.create(name='X', slug='x')
+
+
+@pytest.fixture
+def no_storage_reads(monkeypatch):
+    def fail(*args, **kwargs):
+        pytest.fail("storage read")
+    monkeypatch.setattr(FileSystemStorage, '_open', fail)
+
+
+def legacy(product):
+    """Ред отпреди INGEST_FIELDS – размери и цвят няма."""
+    Product.objects.filter(id=product.id).update(image_width=None, image_height=None, image_placeholder='')
+
+
+def test_upload_stores_dimensions_and_placeholder(category):
+    p = Product.objects.create(category=category, name='A', slug='a', price=Decimal('10'),
+                               image=SimpleUploadedFile('a.png', png_bytes(), content_type='image/png'))
+    ProductImage.objects.create(product=p, image=SimpleUploadedFile('b.png', png_bytes((0, 0, 255), (30, 40))))
+
+    p = Product.objects.get()
+    assert (p.image_width, p.image_height, p.image_placeholder) == (64, 48, '#c81e1e')
+    extra = ProductImage.objects.get()
+    assert (extra.image_width, extra.image_height, extra.image_placeholder) == (30, 40, '#0000ff')
+
+
+def test_transparent_pixels_blend_with_white():
+    assert placeholders.color(Image.new('RGBA', (4, 4), (0, 0, 0, 0))) == '#ffffff'
+
+
+def test_pages_render_dimensions_without_storage_reads(category, no_storage_reads):
+    cache.clear()  # кешираните карти от други тестове
+    Product.objects.create(category=category, name='A', slug='a', price=Decimal('10'), stock=1,
+                           image=SimpleUploadedFile('a.png', png_bytes()))
+    client = Client()
+    detail = client.get(reverse('product_detail', args=['a'])).content.decode()
+    assert 'width="64" height="48"' in detail and 'background-color:#c81e1e' in detail
+    assert 'background-color:#c81e1e' in client.get(reverse('product_list')).content.decode()
+
+
+def test_legacy_rows_do_not_read_storage_on_load(category, no_storage_reads):
+    p = Product.objects.create(category=category, name='A', slug='a', price=Decimal('10'),
+                               image=SimpleUploadedFile('a.png', png_bytes()))
+    legacy(p)
+    assert Product.objects.get().image_width is None
+
+
+def test_backfill_fills_legacy_rows(category):
+    ok = Product.objects.create(category=category, name='A', slug='a', price=Decimal('10'),
+                                image=SimpleUploadedFile('a.png', png_bytes()))
+    gone = Product.objects.create(category=category, name='B', slug='b', price=Decimal('10'),
+                                  image=SimpleUploadedFile('b.png', png_bytes()))
+    legacy(ok)
+    legacy(gone)
+    default_storage.delete(Product.objects.get(id=gone.id).image.name)
+    version = Product.objects.get(id=ok.id).cache_version
+    jobs = ImageJob.objects.count()
+
+    out = StringIO()
+    call_command('backfill_image_metadata', stdout=out)
+    assert 'Попълнени снимки: 1, неуспешни: 1' in out.getvalue()
+
+    ok = Product.objects.get(id=ok.id)
+    assert (ok.image_width, ok.image_height, ok.image_placeholder) == (64, 48, '#c81e1e')
+    assert ok.cache_version > version
+    assert ImageJob.objects.count() == jobs  # без save() – без нови job-ове
+    assert Product.objects.get(id=gone.id).image_width is None
+
+
+def test_image_job_fills_metadata_for_files_assigned_by_name(category):
+    name = default_storage.save('products/by-name.png', ContentFile(png_bytes((10, 200, 10))))
+    p = Product.objects.create(category=category, name='A', slug='a', price=Decimal('10'), image=name)
+    assert (p.image_width, p.image_placeholder) == (None, '')
+
+    call_command('process_image_jobs', '--workers', '1', stdout=StringIO())
+    p = Product.objects.get()
+    assert (p.image_width, p.image_height, p.image_placeholder) == (64, 48, '#0ac80a')
@@ -0,0 +1,41 @@
+import pytest
+from decimal import Decimal
+from django.test import override_settings
+from catalog.models import Category, Product
+
+
+@pytest.mark.django_db
+@override_settings(CATALOG_CURSOR_PAGINATION=True)
+@pytest.mark.parametrize('sort', ['name', '-name', 'price', '-price', 'stock', '-stock'])
+def test_cursor_walk_matches_full_ordering(client, sort):
+    c = Category.objects.create(name='X', slug='x')
+    # повтарящи се стойности, за да се провери tiebreaker-а по id
+    for i in range(45):
+        Product.objects.create(category=c, name=f'P{i % 7}', slug=f'p{i}',
+                               price=Decimal(i % 5), stock=i % 3)
+    field = sort.lstrip('-')
+    expected = list(Product.objects.order_by(sort, '-id' if sort.startswith('-') else 'id')
+                    .values_list('id', flat=True))
+
+    seen, after = [], None
+    while True:
+        params = {'sort': sort}
+        if after:
+            params['after'] = after
+        r = client.get('/', params)
+        page = r.context['cursor_page']
+        seen += [p.id for p in page.object_list]
+        assert r.context['approx_total'] == 45
+        if not page.has_next:
+            break
+        after = page.next_token
+    assert seen == expected, field
+
+
+@pytest.mark.django_db
+def test_invalid_cursor_falls_back_to_first_page(client):
+    c = Category.objects.create(name='X', slug='x')
+    Product.objects.create(category=c, name='A', slug='a', price=Decimal('1'))
+    r = client.get('/', {'after': 'garbage'})
+    assert r.status_code == 200
+    assert r.context['cursor_page'].is_first
@@ -0,0 +1,115 @@
+"""
+Регресия на плановете на горещите заявки в каталога.
+
+Сийдва голям каталог (QUERY_PLAN_PRODUCTS, по подразбиране 100k), минава през
+product_list / product_detail / количката, хваща реалните SELECT-и и пуска
+EXPLAIN върху тях (SQLite: EXPLAIN QUERY PLAN, Postgres: EXPLAIN). Пада, ако
+някоя заявка мине на пълно сканиране на таблица или на временен sort.
+"""
+import os
+import re
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from catalog.models import Category, Product, ProductImage, ProductVariant
+from catalog.pagination import encode_cursor
+
+N_PRODUCTS = int(os.getenv('QUERY_PLAN_PRODUCTS', '100000'))
+N_CATEGORIES = 50
+SORTS = ['name', '-name', 'price', '-price', 'stock', '-stock']
+
+
+def seed_catalog():
+    cats = Category.objects.bulk_create(
+        [Category(name=f'Категория {i}', slug=f'cat-{i}') for i in range(N_CATEGORIES)]
+    )
+    Product.objects.bulk_create(
+        (
+            Product(
+                category=cats[i % N_CATEGORIES], name=f'Продукт {i:06d}', slug=f'p-{i}',
+                price=Decimal(i % 997) + Decimal('0.99'), stock=i % 50, active=i % 10 != 0,
+            )
+            for i in range(N_PRODUCTS)
+        ),
+        batch_size=5000,
+    )
+    ids = list(Product.objects.order_by('id').values_list('id', flat=True)[::20])
+    ProductVariant.objects.bulk_create(
+        (ProductVariant(product_id=pk, sku=f'SKU-{pk}-{s}', size=s, price=Decimal('9.99'), stock=5)
+         for pk in ids for s in ('S', 'M', 'L')),
+        batch_size=5000,
+    )
+    ProductImage.objects.bulk_create(
+        (ProductImage(product_id=pk, image=f'products/extra/{pk}.jpg', sort_order=1) for pk in ids),
+        batch_size=5000,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    """Редовете от плана, които значат пълно сканиране или sort във временна структура."""
+    if connection.vendor == 'postgresql':
+        scans = [line for line in plan if 'Scan' in line]
+        point_lookup = scans and all('_pkey' in line for line in scans)
+        return [
+            line for line in plan
+            if 'Seq Scan' in line or (re.search(r'\bSort\b', line) and not point_lookup)
+        ]
+    searches = [line for line in plan if line.startswith(('SEARCH', 'SCAN'))]
+    # .first() по първичен ключ добавя ORDER BY id над един ред – това не е проблем
+    # (външната таблица е първа; подзаявки като shard_stock идват след нея)
+    point_lookup = searches and searches[0].endswith('(rowid=?)')
+    return [
+        line for line in plan
+        # "SCAN t" без "USING ... INDEX" е пълно сканиране на таблицата
+        if re.fullmatch(r'SCAN \w+', line.strip()) or ('USE TEMP B-TREE' in line and not point_lookup)
+    ]
+
+
+def hot_requests(client, deep_cursor, variant, product):
+    for sort in SORTS:
+        yield client.get('/', {'sort': sort})
+        yield client.get('/', {'cat': 'cat-7', 'sort': sort})
+        # дълбока страница в cursor режим: токен от средата на категорията
+        yield client.get('/', {'cat': 'cat-7', 'sort': sort, 'after': encode_cursor(sort, deep_cursor)})
+
+    yield client.get('/p/p-4321/')
+    client.post(f'/cart/add/{variant.product_id}/', {'qty': 1, 'variant_id': variant.id})
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    yield client.get('/cart/')
+
+
+@pytest.mark.django_db
+def test_catalog_hot_queries_use_indexes(client):
+    seed_catalog()
+    deep_cursor = Product.objects.filter(category__slug='cat-7', active=True).order_by('id')[500]
+    variant = ProductVariant.objects.order_by('id')[10]
+    product = Product.objects.get(slug='p-77')
+
+    with CaptureQueriesContext(connection) as ctx:
+        for response in hot_requests(client, deep_cursor, variant, product):
+            assert response.status_code == 200
+
+    failures = {}
+    for query in ctx.captured_queries:
+        sql = query['sql']
+        # COUNT(*) по дефиниция чете всичко; в cursor режим е кеширан (вж. catalog.pagination)
+        if not sql.lstrip().upper().startswith('SELECT') or 'COUNT(*)' in sql:
+            continue
+        plan = explain(sql)
+        if plan_problems(plan):
+            failures[sql] = plan
+    assert not failures, '\n\n'.join(f'{sql}\n  ' + '\n  '.join(plan) for sql, plan in failures.items())
@@ -0,0 +1,55 @@
+import pytest
+from decimal import Decimal
+from catalog import search
+from catalog.models import Category, Product, ProductVariant
+
+
+def test_tokenize_bulgarian_forms_and_latin():
+    assert search.tokenize('Тениски') == search.tokenize('тениската') == search.tokenize('teniski')
+
+
+@pytest.mark.django_db
+def test_search_by_name_description_and_sku(client):
+    c = Category.objects.create(name='Дрехи', slug='drehi')
+    shirt = Product.objects.create(category=c, name='Тениска Памук', slug='t', price=Decimal('10'))
+    mug = Product.objects.create(category=c, name='Чаша', slug='m', price=Decimal('5'), description='Керамична, бяла')
+    ProductVariant.objects.create(product=mug, sku='MUG-777', price=Decimal('5'))
+
+    def found(q):
+        return {p.id for p in search.search_products(Product.objects.all(), q)}
+
+    assert found('тениски') == {shirt.id}
+    assert found('teniska') == {shirt.id}
+    assert found('керамична') == {mug.id}
+    assert found('mug-777') == {mug.id}
+
+    # индексът следи промени и изтриване
+    shirt.name = 'Суитшърт'
+    shirt.save()
+    assert found('тениска') == set()
+    mug.variants.all().delete()
+    assert found('mug777') == set()
+    mug.delete()
+    assert found('чаша') == set()
+
+    r = client.get('/', {'q': 'суитшърт'})
+    assert list(r.context['products']) == [shirt]
+
+
+@pytest.mark.django_db
+def test_reindex_only_when_searchable_fields_change(monkeypatch):
+    c = Category.objects.create(name='Дрехи', slug='drehi')
+    p = Product.objects.create(category=c, name='Тениска', slug='t', price=Decimal('10'), stock=5)
+    indexed = []
+    monkeypatch.setattr(search, 'index_products', lambda ids, using='default': indexed.append(list(ids)))
+
+    p.stock = 4
+    p.save(update_fields=['stock'])
+    p.price = Decimal('12')
+    p.save(update_fields=['price'])
+    assert indexed == []
+
+    p.name = 'Суитшърт'
+    p.save(update_fields=['name', 'stock'])
+    p.save()
+    assert indexed == [[p.id], [p.id]]
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from cart.cart import CartSnapshot
+from catalog import stock, versioning
+from catalog.models import Category, Product, ProductVariant, StockShard
+from checkout.services import OutOfStock, cancel_order, place_order
+
+DATA = {'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София', 'phone': ''}
+
+
+@pytest.fixture
+def variant(db):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='Hot', slug='hot', price=Decimal('10'), stock=0)
+    return ProductVariant.objects.create(product=p, sku='HOT-M', size='M', price=Decimal('10'), stock=10)
+
+
+def order(variant, qty):
+    return place_order(DATA, CartSnapshot.build({f'v{variant.id}': {'type': 'variant', 'item_id': variant.id, 'qty': qty}}))
+
+
+def test_split_reads_sum_of_shards(variant):
+    call_command('stock_shards', 'HOT-M', split=4)
+
+    variant.refresh_from_db()
+    assert variant.sharded and variant.stock == 0
+    assert sorted(StockShard.objects.values_list('stock', flat=True)) == [2, 2, 3, 3]
+    assert variant.available_stock == 10
+    assert ProductVariant.objects.with_stock().get(id=variant.id).available_stock == 10
+
+
+def test_orders_take_from_shards_and_cancel_gives_back(variant):
+    stock.split(variant.id, 4)
+
+    placed = order(variant, 3)  # един шард стига сам
+    assert stock.total(variant.id) == 7
+    order(variant, 6)  # трябват няколко шарда
+    assert stock.total(variant.id) == 1
+    with pytest.raises(OutOfStock):
+        order(variant, 2)
+    assert stock.total(variant.id) == 1
+
+    assert cancel_order(placed.id)
+    assert stock.total(variant.id) == 4
+
+
+def test_rebalance_and_merge(variant):
+    stock.split(variant.id, 4)
+    order(variant, 3)
+    call_command('stock_shards', 'HOT-M', rebalance=True)
+    assert max(StockShard.objects.values_list('stock', flat=True)) - min(StockShard.objects.values_list('stock', flat=True)) <= 1
+
+    call_command('stock_shards', 'HOT-M', merge=True)
+    variant.refresh_from_db()
+    assert not variant.sharded and variant.stock == 7
+    assert not StockShard.objects.exists()
+
+
+def checkout(variant_id):
+    try:
+        variant = ProductVariant.objects.get(id=variant_id)
+        order(variant, 1)
+        return True
+    except (OutOfStock, OperationalError):
+        return False
+    finally:
+        connection.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sharded_hot_sku_is_never_oversold():
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='Hot', slug='hot', price=Decimal('10'), stock=0)
+    v = ProductVariant.objects.create(product=p, sku='HOT-M', size='M', price=Decimal('10'), stock=30)
+    stock.split(v.id, 8)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(checkout, [v.id] * 200))
+
+    sold = sum(v.orderitem_set.values_list('qty', flat=True))
+    assert 0 < sold <= 30
+    assert sold + stock.total(v.id) == 30
+
+
+def test_fallback_takes_shards_in_index_order(variant):
+    stock.split(variant.id, 3)
+    for index, qty in enumerate([1, 3, 2]):
+        StockShard.objects.filter(variant=variant, index=index).update(stock=qty)
+
+    assert stock.take(variant.id, 5)  # никой шард не стига сам
+    # по index (като split/rebalance/merge), не по бройки – един и същ ред на заключване
+    assert list(StockShard.objects.order_by('index').values_list('stock', flat=True)) == [0, 0, 1]
+
+
+def test_versions_change_only_when_availability_flips(variant, django_capture_on_commit_callbacks):
+    stock.split(variant.id, 4)
+    product = variant.product
+
+    def versions():
+        product.refresh_from_db()
+        return product.cache_version, versioning.state(versioning.GLOBAL)[0]
+
+    before = versions()
+    with django_capture_on_commit_callbacks(execute=True):
+        placed = order(variant, 3)
+    assert versions() == before  # продажба от шард не пипа реда на продукта и каталога
+
+    with django_capture_on_commit_callbacks(execute=True):
+        order(variant, 7)  # изчерпан
+    sold_out = versions()
+    assert sold_out[0] > before[0] and sold_out[1] > before[1]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        cancel_order(placed.id)  # отново има наличност
+    assert versions()[0] > sold_out[0]
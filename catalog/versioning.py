@@ -0,0 +1,70 @@
+"""
+Версии на каталога за conditional GET.
+
+Всяка промяна по продукт/категория вдига 'global' и версията на засегнатите
+категории. Листингът и детайлът сравняват ETag/Last-Modified срещу тези
+версии с една-две евтини заявки, преди да пипнат основния queryset.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CatalogVersion, Product
+
+GLOBAL = 'global'
+CATEGORIES = 'categories'
+SITE = 'site'  # общото за всички страници в base.html (брандинг)
+
+
+def category_scope(category_id) -> str:
+    return f'category:{category_id}'
+
+
+def bump(*scopes, using='default'):
+    """Вдига 'global' и scopes с един UPDATE; липсващите редове се създават (само първия път)."""
+    now = timezone.now()
+    scopes = {GLOBAL, *scopes}
+    versions = CatalogVersion.objects.using(using)
+    if versions.filter(scope__in=scopes).update(version=F('version') + 1, updated_at=now) == len(scopes):
+        return
+    for scope in scopes - set(versions.filter(scope__in=scopes).values_list('scope', flat=True)):
+        _, created = versions.get_or_create(scope=scope, defaults={'version': 1, 'updated_at': now})
+        if not created:  # някой друг го е създал междувременно
+            versions.filter(scope=scope).update(version=F('version') + 1, updated_at=now)
+
+
+def bump_categories(*category_ids, using='default'):
+    bump(*(category_scope(pk) for pk in category_ids if pk), using=using)
+
+
+def touch_products(product_ids, using='default'):
+    """Промяна по продукти, направена без Product.save() (queryset.update, варианти, снимки)."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    qs = Product.objects.using(using).filter(id__in=product_ids)
+    qs.update(cache_version=F('cache_version') + 1, updated_at=timezone.now())
+    bump_categories(*set(qs.values_list('category_id', flat=True)), using=using)
+
+
+def touch_products_on_commit(product_ids, using='default'):
+    """
+    touch_products след commit на текущата транзакция – за пътя на поръчката:
+    не държи заключванията на наличността, а грешка тук (напр. заключена база)
+    само се логва – поръчката вече е записана и не бива да изглежда неуспешна.
+    """
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: touch_products(product_ids, using=using), using=using, robust=True)
+
+
+def state(*scopes):
+    """(version-и по реда на scopes, последна промяна) с една заявка."""
+    rows = dict(
+        (scope, (version, updated_at))
+        for scope, version, updated_at in CatalogVersion.objects.filter(scope__in=scopes)
+        .values_list('scope', 'version', 'updated_at')
+    )
+    versions = tuple(rows.get(scope, (0, None))[0] for scope in scopes)
+    stamps = [updated_at for _, updated_at in rows.values() if updated_at]
+    return versions, (max(stamps) if stamps else None)
@@ -1,56 +1,167 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Prefetch
 from django.shortcuts import render, get_object_or_404
 from django.core.paginator import Paginator
-from .models import Product, Category
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
+from .models import Product, Category, ProductVariant
+from . import cards, search, pagination, versioning
+
+PER_PAGE = 20
+
+
+# --- споделено кеширане + conditional GET (ETag / Last-Modified → 304 без queryset и шаблон) ---
+# Страниците нямат нищо от посетителя (бадж, съобщения и CSRF идват от cart_state),
+# затова ETag-ът зависи само от версиите на каталога и от URL-а.
+
+def shared_cache(view):
+    """Cache-Control за CDN/proxy – public само ако view-ът наистина не е пипнал сесията/бисквитки."""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        per_visitor = (
+            request.session.accessed
+            or response.cookies
+            or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        )
+        if per_visitor:
+            patch_cache_control(response, private=True, max_age=0)
+        else:
+            patch_cache_control(
+                response, public=True,
+                max_age=settings.CATALOG_PAGE_MAX_AGE,
+                s_maxage=settings.CATALOG_PAGE_SHARED_MAX_AGE,
+            )
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    return wrapped
+
+
+def _etag(*parts):
+    raw = repr((settings.CATALOG_ETAG_SALT, parts))
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _list_state(request):
+    if not hasattr(request, '_catalog_state'):
+        cat_slug = request.GET.get('cat') or request.GET.get('c')
+        scopes = [versioning.SITE, versioning.GLOBAL]
+        if cat_slug:
+            cat_id = Category.objects.filter(slug=cat_slug).values_list('pk', flat=True).first()
+            scopes = [versioning.SITE, versioning.CATEGORIES, versioning.category_scope(cat_id)]
+        request._catalog_state = versioning.state(*scopes)
+    return request._catalog_state
+
+
+def list_etag(request):
+    versions, _ = _list_state(request)
+    return _etag(versions, request.get_full_path())
+
+
+def list_last_modified(request):
+    return _list_state(request)[1]
+
 
+def _detail_state(request, slug):
+    if not hasattr(request, '_catalog_state'):
+        row = Product.objects.filter(slug=slug, active=True).values_list('pk', 'cache_version', 'updated_at').first()
+        request._catalog_state = (row, versioning.state(versioning.SITE))
+    return request._catalog_state
 
+
+def detail_etag(request, slug):
+    row, (site_version, _) = _detail_state(request, slug)
+    if row is None:
+        return None  # 404 идва от самия view
+    return _etag(row[:2], site_version)
+
+
+def detail_last_modified(request, slug):
+    row, (_, site_changed) = _detail_state(request, slug)
+    if row is None:
+        return None
+    return max(stamp for stamp in (row[2], site_changed) if stamp)
+
+
+@shared_cache
+@condition(etag_func=list_etag, last_modified_func=list_last_modified)
 def product_list(request):
     # приемай и ?cat=... и ?c=...
     cat_slug = request.GET.get('cat') or request.GET.get('c')
     sort = request.GET.get('sort', 'name')  # name | -name | price | -price | stock | -stock
+    q = request.GET.get('q', '').strip()
+    after = request.GET.get('after')
 
-    # базов queryset + оптимизация
-    qs = (
-        Product.objects.filter(active=True)
-        .select_related('category')
-        .prefetch_related('images')
-    )
+    # базов queryset + оптимизация (картите ползват само главната снимка – без prefetch на галерията)
+    qs = Product.objects.filter(active=True).select_related('category')
 
     current_category = None
     if cat_slug:
         current_category = get_object_or_404(Category, slug=cat_slug)
         qs = qs.filter(category=current_category)
 
+    # търсене по име/описание/SKU през индекса (FTS5 / tsvector)
+    if q:
+        qs = search.search_products(qs, q)
+
     # безопасно сортиране
     allowed_sorts = {'name', '-name', 'price', '-price', 'stock', '-stock'}
     if sort not in allowed_sorts:
         sort = 'name'
-    qs = qs.order_by(sort)
 
     # категории за сайдбара
     categories = Category.objects.all().order_by('name')
 
-    # (по избор) странициране – 20 на страница
-    paginator = Paginator(qs, 20)
-    page_obj = paginator.get_page(request.GET.get('page'))
+    # параметри, които линковете на pager-а трябва да запазят
+    base_query = urlencode({k: v for k, v in (('cat', cat_slug), ('sort', sort), ('q', q)) if v})
 
-    return render(
-        request,
-        'catalog/product_list.html',
-        {
+    context = {
+        'categories': categories,
+        'current_category': current_category,
+        'current_sort': sort,
+        'current_cat_slug': cat_slug,
+        'q': q,
+        'base_query': base_query,
+    }
+
+    if after or getattr(settings, 'CATALOG_CURSOR_PAGINATION', False):
+        # cursor режим: без OFFSET и без COUNT(*) на всяка заявка
+        page = pagination.keyset_page(qs, sort, after, per_page=PER_PAGE)
+        context.update({
+            'products': page.object_list,
+            'cursor_page': page,
+            'approx_total': pagination.cached_count(qs, current_category and current_category.pk, q),
+        })
+    else:
+        # (по избор) странициране – 20 на страница
+        paginator = Paginator(qs.order_by(*pagination.ordering_for(sort)), PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        context.update({
             'products': page_obj.object_list,
             'page_obj': page_obj,
-            'categories': categories,
-            'current_category': current_category,
-            'current_sort': sort,
-            'current_cat_slug': cat_slug,
-        },
+            'is_paginated': page_obj.has_other_pages(),
+        })
+
+    # HTML на картите – от кеша, с един get_many за цялата страница
+    context['product_cards'] = cards.render_cards(list(context['products']))
+
+    return render(request, 'catalog/product_list.html', context)
+
+
+def detail_queryset():
+    # вариантите подредени по размер/цвят – {% regroup %} в шаблона разчита на това
+    return Product.objects.select_related('category').prefetch_related(
+        'images',
+        Prefetch('variants', queryset=ProductVariant.objects.with_stock().order_by('size', 'color', 'id')),
     )
 
 
+@shared_cache
+@condition(etag_func=detail_etag, last_modified_func=detail_last_modified)
 def product_detail(request, slug):
-    product = get_object_or_404(
-        Product.objects.select_related('category').prefetch_related('images'),
-        slug=slug,
-        active=True,
-    )
+    product = get_object_or_404(detail_queryset(), slug=slug, active=True)
     return render(request, 'catalog/product_detail.html', {'product': product})
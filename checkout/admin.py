@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Coupon
+from .models import Order, OrderItem, Coupon, EmailOutbox, PaymentEvent, PendingOrder
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -14,6 +14,25 @@ class OrderAdmin(admin.ModelAdmin):
 
 @admin.register(Coupon)
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ("code", "percent_off", "amount_off", "active", "valid_from", "valid_to", "used")
+    list_display = ("code", "percent_off", "amount_off", "active", "valid_from", "valid_to", "used", "max_uses")
     list_filter = ("active",)
-    search_fields = ("code",)
\ No newline at end of file
+    search_fields = ("code",)
+
+@admin.register(PendingOrder)
+class PendingOrderAdmin(admin.ModelAdmin):
+    list_display = ("token", "status", "order", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("token", "data", "items", "cart_key", "order", "payment_url", "error",
+                       "created_at", "started_at", "finished_at")
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("to", "subject", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("to", "subject")
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ("stripe_id", "type", "order_ref", "received_at", "processed_at", "attempts", "failed_at", "error")
+    list_filter = ("type", ("failed_at", admin.EmptyFieldListFilter))
+    search_fields = ("stripe_id", "order_ref")
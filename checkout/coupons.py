@@ -0,0 +1,99 @@
+"""
+Промокодове.
+
+Кодовете се пазят нормализирани (без интервали, главни букви), така че
+търсенето е точно по уникалния индекс на `code` – без `iexact`/UPPER(),
+колкото и хиляди еднократни кода да има.
+
+Валидирането на „горещи“ кампанийни кодове идва от кеша (COUPON_CACHE_SECONDS);
+броят използвания в кеша може да изостава, затова истинската проверка е
+при поръчката: claim() е един условен UPDATE
+`used = used + 1 WHERE used < max_uses`, а release() връща използването при
+отказана/изтекла поръчка.
+"""
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Coupon
+
+MISSING = 'missing'  # отрицателен резултат в кеша (несъществуващ код)
+ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # без 0/O и 1/I – кодовете се преписват на ръка
+
+
+class CouponUnavailable(Exception):
+    """Промокодът е изчерпан или вече не е валиден в момента на поръчката."""
+
+
+def normalize(code) -> str:
+    return (code or '').strip().upper()
+
+
+def cache_key(code) -> str:
+    return f'coupon:{normalize(code)}'
+
+
+def lookup(code):
+    """Купонът по код (или None) – от кеша, ако е наскоро проверяван."""
+    code = normalize(code)
+    if not code:
+        return None
+    timeout = getattr(settings, 'COUPON_CACHE_SECONDS', 60)
+    cached = cache.get(cache_key(code)) if timeout else None
+    if cached is None:
+        cached = Coupon.objects.filter(code=code).first() or MISSING
+        if timeout:
+            cache.set(cache_key(code), cached, timeout)
+    return None if cached == MISSING else cached
+
+
+def valid(code):
+    """Валиден купон по код или None (датите се проверяват при всяко извикване)."""
+    coupon = lookup(code)
+    return coupon if coupon is not None and coupon.is_valid() else None
+
+
+def forget(code):
+    cache.delete(cache_key(code))
+
+
+def claim(coupon) -> bool:
+    """Запазва едно използване (в транзакцията на поръчката); False = изчерпан/неактивен."""
+    claimed = Coupon.objects.filter(
+        Q(max_uses__isnull=True) | Q(max_uses=0) | Q(used__lt=F('max_uses')),
+        id=coupon.id, active=True,
+    ).update(used=F('used') + 1)
+    if not claimed:
+        # изчерпан – следващите валидирания да не го пускат от кеша
+        forget(coupon.code)
+    return bool(claimed)
+
+
+def release(coupon_id):
+    """Връща използване от отказана поръчка."""
+    if coupon_id and Coupon.objects.filter(id=coupon_id, used__gt=0).update(used=F('used') - 1):
+        code = Coupon.objects.filter(id=coupon_id).values_list('code', flat=True).first()
+        forget(code)
+
+
+def generate(count, prefix='', length=8, batch_size=1000, **fields):
+    """
+    Създава count нови случайни кода (PREFIX + length знака) с общите fields
+    (percent_off, amount_off, max_uses, valid_to, ...) – bulk_create на партиди.
+    Връща списъка с кодовете.
+    """
+    prefix = normalize(prefix)
+    if len(prefix) + length > Coupon._meta.get_field('code').max_length:
+        raise ValueError("Префиксът и дължината надхвърлят 40 знака.")
+    created = []
+    while len(created) < count:
+        want = min(batch_size, count - len(created))
+        batch = {prefix + ''.join(secrets.choice(ALPHABET) for _ in range(length)) for _ in range(want)}
+        batch -= set(Coupon.objects.filter(code__in=batch).values_list('code', flat=True))
+        with transaction.atomic():
+            Coupon.objects.bulk_create([Coupon(code=code, **fields) for code in batch], batch_size=batch_size)
+        created.extend(batch)
+    return created
@@ -0,0 +1,132 @@
+"""
+Прилагане на Stripe събитията, записани от webhook-а (PaymentEvent).
+
+Webhook-ът само проверява подписа и записва събитието (уникално по Stripe id,
+така че повторенията от Stripe не правят нищо) – отговорът е веднага.
+`manage.py process_payment_events` ги прилага по реда на Stripe (created, id);
+ако събитие за поръчка се провали, по-късните за същата поръчка чакат.
+
+Всяко събитие се маркира като приложено в същата транзакция, в която се
+прилага, с условен UPDATE – два процеса не могат да го приложат два пъти.
+След PAYMENT_EVENT_MAX_ATTEMPTS неуспеха събитието получава failed_at и излиза
+от опашката; по-късните събития за същата поръчка чакат, останалите продължават
+(`process_payment_events --retry-failed` го връща).
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import outbox
+from .coupons import normalize
+from .models import Coupon, Order, PaymentEvent
+from .services import OutOfStock, cancel_order, reserve_stock
+
+
+def record(event: dict):
+    """Записва събитието; False, ако вече го имаме (повторение от Stripe)."""
+    obj = event.get('data', {}).get('object', {}) or {}
+    order_ref = (obj.get('metadata') or {}).get('order_id')
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.create(
+                stripe_id=event['id'],
+                type=event['type'],
+                order_ref=int(order_ref) if str(order_ref or '').isdigit() else None,
+                created=int(event.get('created') or 0),
+                payload=event,
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def _session_completed(event):
+    order = Order.objects.filter(id=event.order_ref).first()
+    # само NEW/CANCELED → PAID; платена, изпълнена или възстановена – вече приложено (закъсняло/повторено)
+    if order is None or order.status not in (Order.Status.NEW, Order.Status.CANCELED):
+        return
+    if not Order.objects.filter(id=order.id, status=order.status).update(status=Order.Status.PAID, paid=True):
+        return  # статусът е сменен междувременно
+
+    coupon_code = (event.payload['data']['object'].get('metadata') or {}).get('coupon_code')
+    if coupon_code and order.coupon_id is None:
+        # сесия отпреди запазването на промокода при поръчката – броим го както преди
+        Coupon.objects.filter(code=normalize(coupon_code)).update(used=F('used') + 1)
+
+    if order.status == Order.Status.CANCELED:
+        # платено след изтекла сесия: наличността вече е върната – запази я отново
+        try:
+            # savepoint – при недостиг на някой ред и вече запазените се връщат
+            with transaction.atomic():
+                reserve_stock(list(order.items.select_related('variant')))
+        except OutOfStock:
+            event.error = "Платена, но без наличност – нужно е връщане на сумата."
+        # използването на промокода е върнато при отказа; платено е – брои се, дори над лимита
+        Coupon.objects.filter(id=order.coupon_id).update(used=F('used') + 1)
+
+    order.status, order.paid = Order.Status.PAID, True
+    outbox.queue_order_paid(order)
+
+
+def _session_expired(event):
+    if event.order_ref:
+        cancel_order(event.order_ref)
+
+
+HANDLERS = {
+    'checkout.session.completed': _session_completed,
+    'checkout.session.expired': _session_expired,
+}
+
+
+def apply(event: PaymentEvent):
+    """Прилага едно събитие точно веднъж; True = приложено (или вече приложено от друг)."""
+    try:
+        with transaction.atomic():
+            if not PaymentEvent.objects.filter(id=event.id, processed_at__isnull=True).update(
+                processed_at=timezone.now(), attempts=F('attempts') + 1
+            ):
+                return True
+            handler = HANDLERS.get(event.type)
+            if handler:
+                handler(event)
+            if event.error:
+                PaymentEvent.objects.filter(id=event.id).update(error=event.error[:255])
+    except Exception as exc:
+        event.attempts += 1
+        PaymentEvent.objects.filter(id=event.id).update(
+            attempts=F('attempts') + 1, error=str(exc)[:255],
+            failed_at=timezone.now() if event.attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS else None,
+        )
+        return False
+    return True
+
+
+def process_pending(batch_size=100):
+    """Прилага една партида неприложени събития; връща (приложени, неуспешни)."""
+    pending = PaymentEvent.objects.filter(processed_at__isnull=True)
+    # събитията на поръчка с изведено от опашката събитие чакат извън прозореца – не го запушват
+    dead = pending.filter(failed_at__isnull=False, order_ref__isnull=False).values('order_ref')
+    events = list(
+        pending.filter(failed_at__isnull=True).exclude(order_ref__in=dead).order_by('created', 'id')[:batch_size]
+    )
+    applied = failed = 0
+    blocked = set()  # поръчки с неуспешно по-ранно събитие в тази партида
+    for event in events:
+        if event.order_ref is not None and event.order_ref in blocked:
+            continue
+        if apply(event):
+            applied += 1
+        else:
+            failed += 1
+            if event.order_ref is not None:
+                blocked.add(event.order_ref)
+    return applied, failed
+
+
+def retry_failed():
+    """Връща изведените от опашката събития (след оправяне на причината)."""
+    return PaymentEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=False).update(
+        failed_at=None, attempts=0
+    )
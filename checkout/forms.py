@@ -1,5 +1,9 @@
+import uuid
+
 from django import forms
 
+from .coupons import normalize
+
 class CheckoutForm(forms.Form):
     PAYMENT_CHOICES = [
         ('cod', 'Наложен платеж (плащане при доставка)'),
@@ -12,3 +16,16 @@ class CheckoutForm(forms.Form):
     phone = forms.CharField(label='Телефон', max_length=32, required=False)
     coupon = forms.CharField(label='Промокод', max_length=40, required=False)
     payment_method = forms.ChoiceField(label='Метод на плащане', choices=PAYMENT_CHOICES, initial='cod')
+    # ново при всяко показване на формата; двойно натискане/повторение носи същото
+    idempotency_key = forms.UUIDField(widget=forms.HiddenInput, required=False, initial=uuid.uuid4)
+
+    def __init__(self, *args, card=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not card:
+            # няма шлюз или веригата е отворена (checkout.payments) – само наложен платеж
+            field = self.fields['payment_method']
+            field.choices = [c for c in self.PAYMENT_CHOICES if c[0] != 'card']
+            field.error_messages['invalid_choice'] = "Плащането с карта е временно недостъпно – изберете наложен платеж."
+
+    def clean_coupon(self):
+        return normalize(self.cleaned_data.get('coupon'))
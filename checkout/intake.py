@@ -0,0 +1,148 @@
+"""
+Опашка за поръчки при пикове (settings.CHECKOUT_INTAKE).
+
+POST-ът на checkout само валидира формата и записва PendingOrder (един INSERT);
+клиентът чака на страница, която се опреснява, докато работник от
+`manage.py process_checkout_queue` не превърне записа в поръчка (цени,
+промокод, наличност, имейл, Stripe) – с контролиран брой паралелни процеси.
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min
+from django.utils import timezone
+
+from cart.cart import CartSnapshot
+from cart.storage import decode_items, encode_items
+
+from .models import PendingOrder
+from .payments import PaymentError
+from .services import CouponUnavailable, DuplicateSubmission, OutOfStock, complete_checkout
+
+OUT_OF_STOCK = "Някои продукти вече нямат достатъчна наличност. Моля, прегледайте количката."
+COUPON_UNAVAILABLE = "Промокодът вече не е валиден. Моля, опитайте отново без него."
+CARD_UNAVAILABLE = "Плащането с карта е временно недостъпно. Моля, опитайте с наложен платеж."
+
+
+def enqueue(data, cart):
+    """
+    Записва поръчката за обработка; cart е cart.cart.Cart от заявката.
+    Повторно изпращане със същия idempotency_key връща вече записаната.
+    """
+    key = data.get('idempotency_key') or None
+    if key and (existing := PendingOrder.objects.filter(idempotency_key=key).first()):
+        return existing
+    try:
+        with transaction.atomic():
+            return PendingOrder.objects.create(
+                data={k: str(v) if isinstance(v, uuid.UUID) else v for k, v in data.items()
+                      if isinstance(v, (str, int, float, bool, uuid.UUID))},
+                items=encode_items(cart.cart),
+                cart_key=cart.storage.key or '',
+                idempotency_key=key,
+            )
+    except IntegrityError:
+        return PendingOrder.objects.get(idempotency_key=key)
+
+
+def claim(batch_size=10):
+    """Взима до batch_size QUEUED записа; условният UPDATE гарантира един работник на запис."""
+    claimed = []
+    ids = PendingOrder.objects.filter(status=PendingOrder.Status.QUEUED).order_by('id').values_list('id', flat=True)
+    for pk in ids[:batch_size]:
+        if PendingOrder.objects.filter(id=pk, status=PendingOrder.Status.QUEUED).update(
+            status=PendingOrder.Status.PROCESSING, started_at=timezone.now()
+        ):
+            claimed.append(pk)
+    return list(PendingOrder.objects.filter(id__in=claimed).order_by('id'))
+
+
+def process(pending):
+    """Създава поръчката за един PendingOrder и записва резултата в него."""
+    data = pending.data
+    snapshot = CartSnapshot.build(decode_items(pending.items), data.get('coupon', '').strip())
+    try:
+        if not snapshot.lines:
+            raise OutOfStock()
+        order, payment_url = complete_checkout(data, snapshot, cart_key=pending.cart_key or None)
+    except DuplicateSubmission as dup:
+        pending.status, pending.order, pending.payment_url = PendingOrder.Status.DONE, dup.order, dup.order.payment_url
+    except OutOfStock:
+        pending.status, pending.error = PendingOrder.Status.FAILED, OUT_OF_STOCK
+    except CouponUnavailable:
+        pending.status, pending.error = PendingOrder.Status.FAILED, COUPON_UNAVAILABLE
+    except PaymentError:
+        pending.status, pending.error = PendingOrder.Status.FAILED, CARD_UNAVAILABLE
+    except Exception as exc:
+        pending.status, pending.error = PendingOrder.Status.FAILED, str(exc)[:255]
+    else:
+        pending.status, pending.order, pending.payment_url = PendingOrder.Status.DONE, order, payment_url or ''
+    pending.finished_at = timezone.now()
+    pending.save(update_fields=['status', 'order', 'payment_url', 'error', 'finished_at'])
+    return pending
+
+
+def requeue_stale(seconds):
+    """Връща в опашката записи, заседнали в PROCESSING (паднал работник)."""
+    return PendingOrder.objects.filter(
+        status=PendingOrder.Status.PROCESSING, started_at__lt=timezone.now() - timedelta(seconds=seconds)
+    ).update(status=PendingOrder.Status.QUEUED, started_at=None)
+
+
+def metrics(window_seconds=300):
+    """Дълбочина на опашката и латентност (от приемане до резултат) за последните window_seconds."""
+    now = timezone.now()
+    depth = dict(
+        PendingOrder.objects.filter(status__in=[PendingOrder.Status.QUEUED, PendingOrder.Status.PROCESSING])
+        .values_list('status').annotate(n=Count('id')).order_by()
+    )
+    oldest = PendingOrder.objects.filter(status=PendingOrder.Status.QUEUED).aggregate(t=Min('created_at'))['t']
+    latency = ExpressionWrapper(F('finished_at') - F('created_at'), output_field=DurationField())
+    recent = (
+        PendingOrder.objects.filter(finished_at__gte=now - timedelta(seconds=window_seconds))
+        .values('status').annotate(n=Count('id'), avg=Avg(latency), max=Max(latency)).order_by()
+    )
+    return {
+        'queued': depth.get(PendingOrder.Status.QUEUED, 0),
+        'processing': depth.get(PendingOrder.Status.PROCESSING, 0),
+        'oldest_queued_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+        'recent': {
+            row['status']: {
+                'count': row['n'],
+                'avg_seconds': row['avg'].total_seconds() if row['avg'] else 0.0,
+                'max_seconds': row['max'].total_seconds() if row['max'] else 0.0,
+            }
+            for row in recent
+        },
+    }
+
+
+def render_metrics(window_seconds=300):
+    """Prometheus text format."""
+    m = metrics(window_seconds)
+    lines = [
+        '# HELP checkout_queue_depth Pending orders by status.',
+        '# TYPE checkout_queue_depth gauge',
+        f'checkout_queue_depth{{status="queued"}} {m["queued"]}',
+        f'checkout_queue_depth{{status="processing"}} {m["processing"]}',
+        '# HELP checkout_queue_oldest_seconds Age of the oldest queued order.',
+        '# TYPE checkout_queue_oldest_seconds gauge',
+        f'checkout_queue_oldest_seconds {m["oldest_queued_seconds"]:.3f}',
+        f'# HELP checkout_queue_processed Orders finished in the last {window_seconds}s.',
+        '# TYPE checkout_queue_processed gauge',
+    ]
+    for status in (PendingOrder.Status.DONE, PendingOrder.Status.FAILED):
+        lines.append(f'checkout_queue_processed{{status="{status.lower()}"}} {m["recent"].get(status, {}).get("count", 0)}')
+    lines += [
+        f'# HELP checkout_queue_latency_seconds Queue-to-result latency over the last {window_seconds}s.',
+        '# TYPE checkout_queue_latency_seconds gauge',
+    ]
+    for status in (PendingOrder.Status.DONE, PendingOrder.Status.FAILED):
+        stats = m['recent'].get(status, {})
+        for stat in ('avg', 'max'):
+            lines.append(
+                f'checkout_queue_latency_seconds{{status="{status.lower()}",stat="{stat}"}} '
+                f'{stats.get(f"{stat}_seconds", 0.0):.3f}'
+            )
+    return '\n'.join(lines) + '\n'
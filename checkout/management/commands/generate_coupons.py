@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from checkout import coupons
+
+
+class Command(BaseCommand):
+    help = "Генерира много случайни промокода наведнъж (напр. еднократни за кампания) и ги извежда по един на ред."
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int)
+        parser.add_argument('--prefix', default='', help="напр. SPRING-")
+        parser.add_argument('--length', type=int, default=8, help="случайни знаци след префикса")
+        discount = parser.add_mutually_exclusive_group(required=True)
+        discount.add_argument('--percent', type=int, help="отстъпка в %%")
+        discount.add_argument('--amount', type=Decimal, help="отстъпка в лв")
+        parser.add_argument('--max-uses', type=int, default=1, help="0 = без лимит")
+        parser.add_argument('--valid-to', help="ISO дата/час, напр. 2026-12-31T23:59")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--output', help="файл за кодовете (по подразбиране stdout)")
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("Броят трябва да е поне 1.")
+        if options['percent'] is not None and not 0 < options['percent'] <= 100:
+            raise CommandError("--percent трябва да е между 1 и 100.")
+        valid_to = None
+        if options['valid_to']:
+            valid_to = parse_datetime(options['valid_to'])
+            if valid_to is None:
+                raise CommandError(f"Невалидна дата: {options['valid_to']}")
+            if timezone.is_naive(valid_to):
+                valid_to = timezone.make_aware(valid_to)
+
+        try:
+            codes = coupons.generate(
+                options['count'], prefix=options['prefix'], length=options['length'],
+                batch_size=options['batch_size'],
+                percent_off=options['percent'], amount_off=options['amount'],
+                max_uses=options['max_uses'] or None, valid_to=valid_to,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write('\n'.join(codes) + '\n')
+            self.stderr.write(self.style.SUCCESS(f"{len(codes)} кода → {options['output']}"))
+        else:
+            self.stdout.write('\n'.join(codes))
@@ -0,0 +1,76 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from checkout import intake
+
+
+class Command(BaseCommand):
+    help = "Обработва опашката с поръчки (CHECKOUT_INTAKE) с N паралелни процеса."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="брой процеси (= паралелни поръчки към базата)")
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=1.0, help="пауза при празна опашка (сек.)")
+        parser.add_argument('--stale-seconds', type=int, default=300,
+                            help="след колко секунди PROCESSING запис се връща в опашката")
+        parser.add_argument('--once', action='store_true', help="изпразни опашката и излез")
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            done = self.work(options)
+            self.stdout.write(self.style.SUCCESS(f"Обработени поръчки: {done}"))
+            return
+
+        # връзките към базата не се споделят между процеси
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        procs = [self.spawn(ctx, options) for _ in range(options['workers'])]
+        failed = 0
+        try:
+            while procs:
+                wait([p.sentinel for p in procs])
+                for p in [p for p in procs if not p.is_alive()]:
+                    procs.remove(p)
+                    p.join()
+                    if options['once'] and p.exitcode == 0:
+                        continue
+                    # без --once работниците не спират сами – всеки спрял се заменя
+                    failed += p.exitcode != 0
+                    self.stderr.write(f"Работник {p.pid} спря с код {p.exitcode}.")
+                    if not options['once']:
+                        time.sleep(options['sleep'])
+                        procs.append(self.spawn(ctx, options))
+        except KeyboardInterrupt:
+            for p in procs:
+                p.terminate()
+        if failed:
+            raise CommandError(f"Неуспешни работници: {failed}.")
+        self.stdout.write(self.style.SUCCESS(f"Работниците ({options['workers']}) приключиха."))
+
+    def spawn(self, ctx, options):
+        p = ctx.Process(target=self.work_in_child, args=(options,), daemon=True)
+        p.start()
+        return p
+
+    def work(self, options):
+        done = 0
+        while True:
+            intake.requeue_stale(options['stale_seconds'])
+            batch = intake.claim(options['batch_size'])
+            for pending in batch:
+                intake.process(pending)
+            done += len(batch)
+            if not batch:
+                if options['once']:
+                    return done
+                time.sleep(options['sleep'])
+
+    def work_in_child(self, options):
+        try:
+            self.work(options)
+        finally:
+            connections.close_all()
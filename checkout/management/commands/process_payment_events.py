@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout import events
+
+
+class Command(BaseCommand):
+    help = "Прилага записаните Stripe събития (PaymentEvent) точно веднъж, по реда им."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="не излизай; чакай нови събития")
+        parser.add_argument('--sleep', type=float, default=2.0, help="пауза при празна опашка (сек.)")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="върни в опашката събитията, изведени след PAYMENT_EVENT_MAX_ATTEMPTS опита")
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f"Върнати в опашката: {events.retry_failed()}")
+        total_applied = total_failed = 0
+        while True:
+            applied, failed = events.process_pending(options['batch_size'])
+            total_applied += applied
+            total_failed += failed
+            if not applied:
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Приложени: {total_applied}, неуспешни опити: {total_failed}"))
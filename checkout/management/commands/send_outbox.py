@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout import outbox
+
+
+class Command(BaseCommand):
+    help = "Изпраща имейлите от опашката (EmailOutbox) – по една SMTP връзка на партида."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--loop', action='store_true', help="не излизай; чакай нови имейли")
+        parser.add_argument('--sleep', type=float, default=5.0, help="пауза при празна опашка (сек.)")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        outbox.requeue_stale()
+        while True:
+            sent, failed = outbox.send_batch(options['batch_size'], options['max_attempts'])
+            total_sent += sent
+            total_failed += failed
+            if not (sent or failed):
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+                outbox.requeue_stale()
+        self.stdout.write(self.style.SUCCESS(f"Изпратени: {total_sent}, неуспешни опити: {total_failed}"))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:36
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0006_orderitem_variant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('status', models.CharField(choices=[('QUEUED', 'В опашка'), ('PROCESSING', 'Обработва се'), ('DONE', 'Готова'), ('FAILED', 'Неуспешна')], default='QUEUED', max_length=20)),
+                ('data', models.JSONField()),
+                ('items', models.TextField()),
+                ('cart_key', models.CharField(blank=True, max_length=64)),
+                ('payment_url', models.URLField(blank=True, max_length=1000)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='checkout.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='pending_order_status_idx'), models.Index(fields=['finished_at'], name='pending_order_finished_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def normalize_codes(apps, schema_editor):
+    # кодовете се търсят точно (без iexact) – старите записи към същия вид
+    Coupon = apps.get_model('checkout', 'Coupon')
+    groups = {}
+    for pk, code in Coupon.objects.order_by('id').values_list('id', 'code'):
+        groups.setdefault(code.strip().upper(), []).append((pk, code))
+    collisions = {code: rows for code, rows in groups.items() if len(rows) > 1}
+    if collisions:
+        # ненормализиран код вече не би се намерил – по-добре спри, отколкото да изчезне тихо
+        listed = '; '.join(
+            f"{code}: " + ', '.join(f"#{pk} {old!r}" for pk, old in rows) for code, rows in sorted(collisions.items())
+        )
+        raise RuntimeError(
+            f"Промокодове, които се различават само по регистър/интервали: {listed}. "
+            "Преименувайте или изтрийте дубликатите и пуснете migrate отново."
+        )
+    for code, [(pk, old)] in groups.items():
+        if code != old:
+            Coupon.objects.filter(id=pk).update(code=code)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0010_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='coupon',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='checkout.coupon'),
+        ),
+        migrations.RunPython(normalize_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0011_coupon_claims'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentevent',
+            name='payment_event_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('processed_at__isnull', True)), fields=['created', 'id'], name='payment_event_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0012_payment_event_failed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='card_payment',
+            field=models.BooleanField(default=False),
+        ),
+    ]
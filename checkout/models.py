@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 from catalog.models import Product, ProductVariant
@@ -18,6 +20,12 @@ class Order(models.Model):
     paid = models.BooleanField(default=False)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.NEW)
+    # от скритото поле на CheckoutForm – повторно изпращане на формата връща същата поръчка
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    payment_url = models.URLField(max_length=1000, blank=True)  # Stripe сесията (за повторения)
+    card_payment = models.BooleanField(default=False)  # избрано плащане с карта (за повторения)
+    # купонът, чието използване е запазено с поръчката (връща се при отказ)
+    coupon = models.ForeignKey('Coupon', null=True, blank=True, on_delete=models.SET_NULL, related_name='orders')
 
     def __str__(self):
         return f"Order #{self.id} - {self.full_name} ({self.get_status_display()})"
@@ -44,7 +52,7 @@ class OrderItem(models.Model):
         return f"{self.product_name} x{self.qty}"
 
 class Coupon(models.Model):
-    code = models.CharField(max_length=40, unique=True)
+    code = models.CharField(max_length=40, unique=True)  # нормализиран: без интервали, главни букви
     percent_off = models.PositiveIntegerField(null=True, blank=True)  # 0-100
     amount_off = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # BGN
     active = models.BooleanField(default=True)
@@ -56,6 +64,19 @@ class Coupon(models.Model):
     def __str__(self):
         return self.code
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # кодът от базата – при преименуване сигналът чисти от кеша и стария
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # търсенето е точно по уникалния индекс (checkout.coupons.normalize)
+        self.code = (self.code or '').strip().upper()
+        super().save(*args, **kwargs)
+        self._loaded_values = {**getattr(self, '_loaded_values', {}), 'code': self.code}
+
     def apply(self, total):
         from decimal import Decimal
         res = Decimal(total)
@@ -76,3 +97,98 @@ class Coupon(models.Model):
         if self.max_uses and self.used >= self.max_uses:
             return False
         return True
+
+
+class PendingOrder(models.Model):
+    """
+    Поръчка, приета в режим на опашка (settings.CHECKOUT_INTAKE): само формата и
+    компактен запис на количката. Обработва се от `manage.py process_checkout_queue`.
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', 'В опашка'
+        PROCESSING = 'PROCESSING', 'Обработва се'
+        DONE = 'DONE', 'Готова'
+        FAILED = 'FAILED', 'Неуспешна'
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    idempotency_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.QUEUED)
+    data = models.JSONField()  # cleaned_data на CheckoutForm
+    items = models.TextField()  # "v12.3,p5.1" (cart.storage.encode_items)
+    cart_key = models.CharField(max_length=64, blank=True)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL)
+    payment_url = models.URLField(max_length=1000, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # работниците взимат най-старите QUEUED; метриките броят по статус
+            models.Index(fields=['status', 'id'], name='pending_order_status_idx'),
+            models.Index(fields=['finished_at'], name='pending_order_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} ({self.get_status_display()})"
+
+
+class EmailOutbox(models.Model):
+    """
+    Имейл, записан в транзакцията на поръчката/плащането. Изпраща се от
+    `manage.py send_outbox` – checkout-ът и webhook-ът не чакат SMTP сървъра.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Чака'
+        SENDING = 'SENDING', 'Изпраща се'
+        SENT = 'SENT', 'Изпратен'
+        FAILED = 'FAILED', 'Неуспешен'
+
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='emails')
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='email_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.to}: {self.subject} ({self.get_status_display()})"
+
+
+class PaymentEvent(models.Model):
+    """
+    Stripe събитие, записано от webhook-а (уникално по Stripe id – повторенията са no-op).
+    Прилага се веднъж от `manage.py process_payment_events`, по реда на създаване за всяка поръчка.
+    """
+    stripe_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    order_ref = models.PositiveBigIntegerField(null=True, blank=True)  # metadata.order_id
+    created = models.PositiveBigIntegerField()  # Stripe timestamp на събитието
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    # след PAYMENT_EVENT_MAX_ATTEMPTS неуспешни опита – извън опашката (по-късните за поръчката чакат)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # неприложените, по реда на Stripe
+            models.Index(fields=['created', 'id'], condition=models.Q(processed_at__isnull=True, failed_at__isnull=True),
+                         name='payment_event_pending_idx'),
+            models.Index(fields=['order_ref', 'created', 'id'], name='payment_event_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.stripe_id}"
@@ -0,0 +1,112 @@
+"""
+Опашка за транзакционни имейли.
+
+queue_email() се вика в транзакцията на поръчката/плащането – имейлът
+съществува точно когато и поръчката. `manage.py send_outbox` изпраща на
+партиди през една SMTP връзка на партида; неуспешните се пробват отново с
+експоненциално нарастваща пауза, докато не стигнат max_attempts.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+BACKOFF_SECONDS = 60
+MAX_BACKOFF_SECONDS = 6 * 60 * 60
+
+
+def queue_email(to, subject, body, order=None):
+    return EmailOutbox.objects.create(to=to, subject=subject[:255], body=body, order=order)
+
+
+def queue_order_received(order):
+    """„Получена поръчка“ за наложен платеж."""
+    body = (
+        f"Здравейте, {order.full_name}!\n\n"
+        f"Получихме вашата поръчка №{order.id}. Плащане: Наложен платеж.\n"
+        f"Сума: {order.total} лв\n"
+        "Ще се свържем при нужда.\n"
+    )
+    return queue_email(order.email, f"Получена поръчка №{order.id}", body, order=order)
+
+
+def queue_order_paid(order):
+    subject = render_to_string('email/order_paid_subject.txt', {'order': order}).strip()
+    body = render_to_string('email/order_paid.txt', {'order': order})
+    return queue_email(order.email, subject, body, order=order)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** max(0, attempts - 1)))
+
+
+def claim(batch_size):
+    """Взима до batch_size дължими имейла (условен UPDATE – без двойно изпращане от два процеса)."""
+    now = timezone.now()
+    ids = (
+        EmailOutbox.objects.filter(status=EmailOutbox.Status.PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+    )
+    claimed = [
+        pk for pk in ids
+        if EmailOutbox.objects.filter(id=pk, status=EmailOutbox.Status.PENDING).update(
+            status=EmailOutbox.Status.SENDING, next_attempt_at=now
+        )
+    ]
+    return list(EmailOutbox.objects.filter(id__in=claimed).order_by('id'))
+
+
+def _failed(email, error, max_attempts):
+    email.attempts += 1
+    email.last_error = str(error)[:255]
+    if email.attempts >= max_attempts:
+        email.status = EmailOutbox.Status.FAILED
+    else:
+        email.status = EmailOutbox.Status.PENDING
+        email.next_attempt_at = timezone.now() + backoff(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_batch(batch_size=50, max_attempts=5):
+    """Изпраща една партида през една връзка; връща (изпратени, неуспешни)."""
+    batch = claim(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:  # сървърът не отговаря – цялата партида по-късно
+        for email in batch:
+            _failed(email, exc, max_attempts)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for email in batch:
+            message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to],
+                                   connection=connection)
+            try:
+                message.send()
+            except Exception as exc:
+                _failed(email, exc, max_attempts)
+                failed += 1
+                continue
+            email.status, email.sent_at = EmailOutbox.Status.SENT, timezone.now()
+            email.attempts += 1
+            email.save(update_fields=['status', 'sent_at', 'attempts'])
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def requeue_stale(seconds=600):
+    """SENDING записи от паднал процес → обратно в опашката."""
+    return EmailOutbox.objects.filter(
+        status=EmailOutbox.Status.SENDING, next_attempt_at__lt=timezone.now() - timedelta(seconds=seconds)
+    ).update(status=EmailOutbox.Status.PENDING)
@@ -0,0 +1,299 @@
+"""
+Плащане с карта през сменяем шлюз (settings.PAYMENT_GATEWAY).
+
+- 'stripe' – Stripe Checkout със строги connect/read таймаути и ограничен
+  брой повторения (с idempotency ключ – повторението не прави втора сесия);
+- 'fake'   – локален шлюз без мрежа: страница „плати/откажи“, която подава
+  подписано събитие през същата webhook проверка, за натоварващи тестове.
+
+Създаването на сесия минава през CircuitBreaker (в кеша, общ за процесите):
+след PAYMENT_BREAKER_THRESHOLD поредни мрежови грешки шлюзът се смята за
+недостъпен за PAYMENT_BREAKER_COOLDOWN сек. – формата предлага само наложен
+платеж и уеб процесите не чакат таймаути. След паузата минава една пробна
+заявка; нов неуспех отваря веригата отново веднага.
+"""
+import functools
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+FAKE_SESSION_SALT = 'checkout.fake_pay'
+WEBHOOK_TOLERANCE = 300  # сек., като при Stripe
+
+
+class PaymentError(Exception):
+    """Сесията за плащане не може да бъде създадена – поръчката се отказва."""
+
+
+class GatewayUnavailable(PaymentError):
+    """Веригата е отворена – шлюзът не се вика изобщо."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, threshold=None, cooldown=None):
+        self.name = name
+        self.threshold = threshold or settings.PAYMENT_BREAKER_THRESHOLD
+        self.cooldown = cooldown or settings.PAYMENT_BREAKER_COOLDOWN
+
+    @property
+    def open_key(self):
+        return f'payments:breaker:{self.name}:open'
+
+    @property
+    def failures_key(self):
+        return f'payments:breaker:{self.name}:failures'
+
+    def allow(self) -> bool:
+        return not cache.get(self.open_key)
+
+    def record_success(self):
+        cache.delete(self.failures_key)
+
+    def record_failure(self):
+        timeout = self.cooldown * 4
+        cache.add(self.failures_key, 0, timeout)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:  # изтекъл между add и incr
+            cache.add(self.failures_key, 1, timeout)
+            failures = 1
+        if failures >= self.threshold:
+            cache.set(self.open_key, True, self.cooldown)
+            # след паузата – една пробна заявка; при неуспех веднага отново отворена
+            cache.set(self.failures_key, self.threshold - 1, timeout)
+
+    def call(self, fn, *args, transient=(Exception,), permanent=(), **kwargs):
+        """transient грешките се броят към прага; permanent (грешна заявка, ключ) – само PaymentError."""
+        if not self.allow():
+            raise GatewayUnavailable(self.name)
+        try:
+            result = fn(*args, **kwargs)
+        except transient as exc:
+            self.record_failure()
+            raise PaymentError(str(exc)) from exc
+        except permanent as exc:
+            raise PaymentError(str(exc)) from exc
+        self.record_success()
+        return result
+
+
+class Gateway:
+    name = ''
+    transient_errors = ()  # грешки, които се броят от CircuitBreaker
+    permanent_errors = ()  # останалите грешки на шлюза – отказ на поръчката, без да отварят веригата
+
+    def enabled(self) -> bool:
+        return True
+
+    def create_session(self, order, snapshot) -> str:
+        """Сесия за плащане на поръчката; връща URL-а, към който се пренасочва клиентът."""
+        raise NotImplementedError
+
+    def parse_webhook(self, payload: bytes, sig_header) -> dict:
+        """Проверява подписа и връща събитието; ValueError при невалиден подпис/съдържание."""
+        raise NotImplementedError
+
+
+def _metadata(order, snapshot):
+    metadata = {'order_id': str(order.id)}
+    if snapshot.coupon:
+        metadata['coupon_code'] = snapshot.coupon.code
+    return metadata
+
+
+@functools.lru_cache(maxsize=4)
+def _stripe_client(api_key, connect_timeout, read_timeout, max_retries):
+    """Един клиент (и пул от връзки) на процес за дадените настройки."""
+    import stripe
+    return stripe.StripeClient(
+        api_key,
+        http_client=stripe.RequestsClient(timeout=(connect_timeout, read_timeout)),
+        max_network_retries=max_retries,
+    )
+
+
+class StripeGateway(Gateway):
+    name = 'stripe'
+
+    @property
+    def transient_errors(self):
+        import stripe
+        # мрежа, таймаут, 429 и 5xx – не и грешки в самата заявка
+        return (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+    @property
+    def permanent_errors(self):
+        import stripe
+        return (stripe.StripeError,)
+
+    def enabled(self):
+        """Stripe е опционален: само при USE_STRIPE, зададен ключ и инсталиран пакет."""
+        if not getattr(settings, 'USE_STRIPE', False) or not settings.STRIPE_SECRET_KEY:
+            return False
+        try:
+            import stripe  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def create_session(self, order, snapshot):
+        client = _stripe_client(
+            settings.STRIPE_SECRET_KEY, settings.PAYMENT_CONNECT_TIMEOUT,
+            settings.PAYMENT_READ_TIMEOUT, settings.PAYMENT_MAX_RETRIES,
+        )
+        session = client.v1.checkout.sessions.create(
+            params={
+                'mode': 'payment',
+                'line_items': [{
+                    'price_data': {
+                        'currency': 'bgn',
+                        'product_data': {'name': line.name},
+                        'unit_amount': int(line.price * 100),
+                    },
+                    'quantity': line.qty,
+                } for line in snapshot.lines],
+                'success_url': f"{settings.SITE_URL}/checkout/success/",
+                'cancel_url': f"{settings.SITE_URL}/checkout/cancel/",
+                'metadata': _metadata(order, snapshot),
+                'customer_email': order.email,
+                # наличността е запазена – не я дръж 24 ч.; минимумът на Stripe е 30 мин.,
+                # минута отгоре покрива разминаване в часовника и повторенията на клиента
+                'expires_at': int(time.time()) + 31 * 60,
+            },
+            # повторенията на клиента (таймаут) не създават втора сесия
+            options={'idempotency_key': f'checkout-session-{order.id}'},
+        )
+        return session.url
+
+    def parse_webhook(self, payload, sig_header):
+        import stripe
+        try:
+            stripe.Webhook.construct_event(payload=payload, sig_header=sig_header,
+                                           secret=settings.STRIPE_WEBHOOK_SECRET)
+        except stripe.SignatureVerificationError as exc:
+            raise ValueError(str(exc)) from exc
+        return json.loads(payload)
+
+
+class FakeGatewayError(Exception):
+    """Симулирана мрежова грешка (PAYMENT_FAKE_FAILURE_RATE)."""
+
+
+class FakeGateway(Gateway):
+    """
+    Шлюз без мрежа за натоварващи тестове: „сесията“ е подписан токен към
+    /checkout/fake-pay/<session>/, а плащането/отказът там праща подписано
+    събитие по схемата на Stripe през същата обработка като истинския webhook.
+    Всеки посетител може да „плати“ сам – затова изисква PAYMENT_FAKE_ALLOWED и
+    собствен STRIPE_WEBHOOK_SECRET (get_gateway()).
+    """
+    name = 'fake'
+    transient_errors = (FakeGatewayError,)
+
+    @staticmethod
+    def secret():
+        return settings.STRIPE_WEBHOOK_SECRET
+
+    @staticmethod
+    def check_allowed():
+        if not getattr(settings, 'PAYMENT_FAKE_ALLOWED', False):
+            raise ImproperlyConfigured(
+                "PAYMENT_GATEWAY=fake позволява на всеки да маркира поръчката си като платена – "
+                "само за натоварващи тестове, с PAYMENT_FAKE_ALLOWED=1."
+            )
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise ImproperlyConfigured("PAYMENT_GATEWAY=fake изисква STRIPE_WEBHOOK_SECRET (подписва събитията).")
+
+    def create_session(self, order, snapshot):
+        if settings.PAYMENT_FAKE_LATENCY_MS:
+            time.sleep(settings.PAYMENT_FAKE_LATENCY_MS / 1000)
+        if random.random() < settings.PAYMENT_FAKE_FAILURE_RATE:
+            raise FakeGatewayError("fake gateway: simulated failure")
+        session = signing.dumps(_metadata(order, snapshot), salt=FAKE_SESSION_SALT)
+        return f"{settings.SITE_URL}{reverse('checkout_fake_pay', args=[session])}"
+
+    @staticmethod
+    def open_session(session, max_age=30 * 60):
+        """Метаданните на сесията или None (невалиден/изтекъл токен)."""
+        try:
+            return signing.loads(session, salt=FAKE_SESSION_SALT, max_age=max_age)
+        except signing.BadSignature:
+            return None
+
+    def sign(self, payload: str, timestamp=None):
+        t = int(timestamp or time.time())
+        v1 = hmac.new(self.secret().encode(), f'{t}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return f't={t},v1={v1}'
+
+    def event(self, event_type, metadata):
+        """Подписано събитие като от Stripe: (payload, sig_header)."""
+        payload = json.dumps({
+            'id': f'evt_fake_{uuid.uuid4().hex}',
+            'object': 'event',
+            'created': int(time.time()),
+            'type': event_type,
+            'data': {'object': {'id': f'cs_fake_{metadata["order_id"]}', 'object': 'checkout.session',
+                                'metadata': metadata}},
+        })
+        return payload, self.sign(payload)
+
+    def parse_webhook(self, payload, sig_header):
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        parts = dict(p.split('=', 1) for p in (sig_header or '').split(',') if '=' in p)
+        try:
+            t = int(parts.get('t', ''))
+        except ValueError:
+            raise ValueError("fake gateway: missing timestamp")
+        if abs(time.time() - t) > WEBHOOK_TOLERANCE:
+            raise ValueError("fake gateway: timestamp outside tolerance")
+        if not constant_time_compare(self.sign(payload, t), f"t={t},v1={parts.get('v1', '')}"):
+            raise ValueError("fake gateway: bad signature")
+        return json.loads(payload)
+
+
+GATEWAYS = {'stripe': StripeGateway, 'fake': FakeGateway}
+
+
+def get_gateway():
+    """Конфигурираният шлюз или None (само наложен платеж); ImproperlyConfigured за fake без разрешение."""
+    cls = GATEWAYS.get(getattr(settings, 'PAYMENT_GATEWAY', 'stripe'))
+    if cls is None:
+        return None
+    if cls is FakeGateway:
+        FakeGateway.check_allowed()
+    gateway = cls()
+    return gateway if gateway.enabled() else None
+
+
+def enabled() -> bool:
+    return get_gateway() is not None
+
+
+def breaker(gateway):
+    return CircuitBreaker(gateway.name)
+
+
+def available() -> bool:
+    """Картата се предлага само при конфигуриран шлюз и затворена верига."""
+    gateway = get_gateway()
+    return gateway is not None and breaker(gateway).allow()
+
+
+def create_session(order, snapshot) -> str:
+    """URL за плащане; PaymentError при грешка/таймаут или отворена верига."""
+    gateway = get_gateway()
+    if gateway is None:
+        raise GatewayUnavailable('none')
+    return breaker(gateway).call(gateway.create_session, order, snapshot,
+                                 transient=gateway.transient_errors, permanent=gateway.permanent_errors)
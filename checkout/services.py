@@ -0,0 +1,238 @@
+"""
+Създаване на поръчка от снимка на количката.
+
+Продуктите и вариантите идват от CartSnapshot (по една заявка на вид),
+така че в транзакцията остават само записите: поръчката, редовете с един
+bulk_create и по един условен UPDATE на наличностите – константен брой
+заявки, колкото и да е голяма количката.
+
+Наличността се запазва при създаването на поръчката (и за наложен платеж,
+и за карта) с `stock = stock - n WHERE stock >= n`; ако и един ред не
+стига, цялата транзакция се връща. Неплатена поръчка, чиято Stripe сесия
+изтече, се отказва с cancel_order() и наличността се връща.
+Същото важи за промокода: използването се запазва с условен UPDATE в
+транзакцията на поръчката (checkout.coupons.claim) и се връща при отказ.
+Горещите варианти (sharded) минават през catalog.stock – случаен шард вместо
+един общ ред.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from cart import holds
+from catalog import stock, versioning
+from catalog.models import Product, ProductVariant
+
+from . import coupons, outbox, payments
+from .coupons import CouponUnavailable
+from .models import Order, OrderItem
+
+
+class OutOfStock(Exception):
+    """Някой ред не може да бъде покрит от наличността – цялата поръчка се отказва."""
+
+
+class DuplicateSubmission(Exception):
+    """Формата с този idempotency_key вече е създала поръчка (двойно натискане/повторение)."""
+
+    def __init__(self, order):
+        super().__init__(order.pk)
+        self.order = order
+
+
+def _reserve(model, quantities, held=None):
+    """
+    Един условен UPDATE за всички id-та:
+    stock = stock - qty  WHERE (id = 1 AND stock >= 2) OR (id = 5 AND stock >= 1) ...
+    Ако засегнатите редове са по-малко от поисканите, някой ред не стига.
+    held: {id: бройки, задържани от други колички} – те също трябва да останат.
+    """
+    if not quantities:
+        return
+    held = held or {}
+    cond = Q()
+    for pk, qty in quantities.items():
+        cond |= Q(id=pk, stock__gte=qty + held.get(pk, 0))
+    updated = model.objects.filter(cond).update(stock=F('stock') - _by_id(quantities))
+    if updated != len(quantities):
+        raise OutOfStock(model._meta.verbose_name)
+
+
+def _release(model, quantities):
+    if quantities:
+        model.objects.filter(id__in=list(quantities)).update(stock=F('stock') + _by_id(quantities))
+
+
+def _reserve_sharded(quantities, held=None):
+    """
+    Горещи варианти (catalog.stock): всеки ред взима от случаен шард, не от реда на варианта.
+    Връща изчерпаните с тази поръчка – само при тях се сменя видимото в каталога.
+    """
+    held = held or {}
+    for pk, qty in quantities.items():
+        if held.get(pk) and stock.total(pk) < qty + held[pk]:
+            raise OutOfStock(ProductVariant._meta.verbose_name)
+        if not stock.take(pk, qty):
+            raise OutOfStock(ProductVariant._meta.verbose_name)
+    return {pk for pk in quantities if not stock.total(pk)}
+
+
+def _release_sharded(quantities):
+    """Връща бройките; резултатът – вариантите, които отново имат наличност."""
+    revived = {pk for pk in quantities if not stock.total(pk)}
+    plain = {pk: qty for pk, qty in quantities.items() if not stock.give(pk, qty)}
+    _release(ProductVariant, plain)  # междувременно слети обратно (stock_shards --merge)
+    return revived
+
+
+def _changed_products(items, sharded, flipped):
+    """
+    Продуктите за versioning.touch_products: горещите варианти се пропускат, освен
+    ако не са се изчерпали/върнали – иначе всяка продажба от шард би обновявала
+    един и същ ред на Product и CatalogVersion.
+    """
+    quiet = set(sharded) - set(flipped)
+    return {it.product_id for it in items if it.product_id and it.variant_id not in quiet}
+
+
+def _by_id(quantities):
+    return Case(
+        *(When(id=pk, then=Value(qty)) for pk, qty in quantities.items()),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _quantities(items):
+    """(варианти, горещи варианти, продукти без варианти) → {id: общо количество}."""
+    variants, sharded, products = {}, {}, {}
+    for it in items:
+        if it.variant_id:
+            target = sharded if it.variant.sharded else variants
+            target[it.variant_id] = target.get(it.variant_id, 0) + it.qty
+        elif it.product_id:
+            products[it.product_id] = products.get(it.product_id, 0) + it.qty
+    return variants, sharded, products
+
+
+def reserve_stock(items, cart_key=None):
+    """
+    Запазва наличност за редовете; при недостиг вдига OutOfStock (извиква се в транзакция).
+    При включени задържания бройките, задържани от други колички, не се продават,
+    а задържанията на тази количка се превръщат в поръчката (изтриват се).
+    Връща id-тата на продуктите, чиито карти/версии трябва да се обновят.
+    """
+    variants, sharded, products = _quantities(items)
+    if holds.enabled():
+        _reserve(ProductVariant, variants, holds.held_by_others('variant', variants, cart_key))
+        sold_out = _reserve_sharded(sharded, holds.held_by_others('variant', sharded, cart_key))
+        _reserve(Product, products, holds.held_by_others('product', products, cart_key))
+        holds.release(cart_key)
+    else:
+        _reserve(ProductVariant, variants)
+        sold_out = _reserve_sharded(sharded)
+        _reserve(Product, products)
+    return _changed_products(items, sharded, sold_out)
+
+
+def place_order(data, snapshot, cart_key=None):
+    """
+    Записва Order + OrderItem-и от снимката и запазва наличността в същата транзакция.
+    data са cleaned_data на CheckoutForm; cart_key е ключът на количката (за задържанията).
+    При недостиг – OutOfStock, при изчерпан промокод – CouponUnavailable; и в двата
+    случая нищо не остава записано.
+    """
+    with transaction.atomic():
+        if snapshot.coupon and not coupons.claim(snapshot.coupon):
+            raise CouponUnavailable(snapshot.coupon.code)
+        order = Order.objects.create(
+            email=data['email'],
+            full_name=data['full_name'],
+            address=data['address'],
+            phone=data.get('phone', ''),
+            total=snapshot.total,
+            status=Order.Status.NEW,
+            idempotency_key=data.get('idempotency_key') or None,
+            coupon=snapshot.coupon,
+            card_payment=not pay_on_delivery(data),
+        )
+        items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=line.product,
+                variant=line.variant,
+                product_name=line.name,
+                unit_price=line.price,
+                qty=line.qty,
+            )
+            for line in snapshot.lines
+        ])
+        changed = reserve_stock(items, cart_key)
+        if pay_on_delivery(data):
+            # имейлът „получена поръчка“ съществува точно когато и поръчката (send_outbox го праща)
+            outbox.queue_order_received(order)
+        # версиите на каталога – след commit, извън заключванията
+        versioning.touch_products_on_commit(changed)
+    return order
+
+
+def cancel_order(order_id):
+    """
+    Отказва неплатена поръчка и връща запазената наличност.
+    Условният UPDATE на статуса гарантира, че наличността се връща само веднъж.
+    """
+    with transaction.atomic():
+        canceled = Order.objects.filter(id=order_id, status=Order.Status.NEW).update(status=Order.Status.CANCELED)
+        if not canceled:
+            return False
+        coupons.release(Order.objects.filter(id=order_id).values_list('coupon_id', flat=True).first())
+        items = list(
+            OrderItem.objects.filter(order_id=order_id).select_related('variant')
+            .only('product_id', 'variant_id', 'qty', 'variant__sharded')
+        )
+        variants, sharded, products = _quantities(items)
+        _release(ProductVariant, variants)
+        revived = _release_sharded(sharded)
+        _release(Product, products)
+        versioning.touch_products_on_commit(_changed_products(items, sharded, revived))
+    return True
+
+
+def pay_on_delivery(data):
+    return data.get('payment_method', 'cod') == 'cod' or not payments.enabled()
+
+
+def start_payment(order, snapshot):
+    """Сесия за плащане през шлюза (checkout.payments); връща URL-а. При грешка поръчката се отказва."""
+    try:
+        url = payments.create_session(order, snapshot)
+    except Exception:
+        cancel_order(order.id)
+        raise
+    Order.objects.filter(id=order.id).update(payment_url=url)
+    return url
+
+
+def complete_checkout(data, snapshot, cart_key=None):
+    """
+    Цялото оформяне след валидна форма: поръчка + наличност (+ имейл в опашката за
+    наложен платеж), после сесия за плащане с карта. DuplicateSubmission при повторен ключ.
+    Връща (order, payment_url или None). OutOfStock и CouponUnavailable минават нагоре.
+    """
+    try:
+        order = place_order(data, snapshot, cart_key=cart_key)
+    except IntegrityError:
+        # същият ключ е записан междувременно от паралелна заявка
+        existing = find_submitted(data.get('idempotency_key'))
+        if existing is None:
+            raise
+        raise DuplicateSubmission(existing)
+    if pay_on_delivery(data):
+        return order, None
+    return order, start_payment(order, snapshot)
+
+
+def find_submitted(idempotency_key):
+    """Поръчката, вече създадена от формата с този ключ (или None)."""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(idempotency_key=idempotency_key).first()
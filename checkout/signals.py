@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import coupons
+from .models import Coupon
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def coupon_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # промяна от админа (активност, дати, лимит) – валидирането не чака кеша да изтече;
+    # при преименуване и старият код (post_save идва преди save() да запомни новия)
+    for code in {instance.code, getattr(instance, '_loaded_values', {}).get('code')}:
+        if code:
+            coupons.forget(code)
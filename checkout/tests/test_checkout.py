@@ -0,0 +1,38 @@
+import pytest
+from decimal import Decimal
+from catalog.models import Category, Product
+from checkout.models import Order
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.fixture
+def product(db):
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=3)
+
+
+@pytest.mark.django_db
+def test_cod_checkout_creates_order_from_snapshot(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 2})
+    r = client.post('/checkout/', FORM)
+    assert r.status_code == 302 and r['Location'].endswith('/checkout/success/')
+
+    order = Order.objects.get()
+    assert order.total == Decimal('20')
+    item = order.items.get()
+    assert (item.product_id, item.qty, item.unit_price) == (product.id, 2, Decimal('10'))
+    product.refresh_from_db()
+    assert product.stock == 1
+
+
+@pytest.mark.django_db
+def test_checkout_rejects_lines_over_stock(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 3})
+    Product.objects.filter(pk=product.pk).update(stock=1)
+    r = client.post('/checkout/', FORM)
+    assert r.status_code == 200 and r.context['error']
+    assert not Order.objects.exists()
@@ -0,0 +1,154 @@
+import importlib
+import threading
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection
+from django.test.utils import CaptureQueriesContext
+
+from cart.cart import CartSnapshot
+from catalog.models import Category, Product
+from checkout import coupons
+from checkout.models import Coupon, Order
+from checkout.services import CouponUnavailable, cancel_order, place_order
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def product(db):
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=50)
+
+
+def snapshot(product, code):
+    return CartSnapshot.build({f'p{product.id}': {'type': 'product', 'item_id': product.id, 'qty': 1}}, code)
+
+
+def test_codes_are_stored_and_matched_normalized(db):
+    Coupon.objects.create(code=' sale10 ', percent_off=10)
+    assert Coupon.objects.get().code == 'SALE10'
+    assert coupons.valid('  Sale10') is not None
+
+
+def test_lookup_uses_the_unique_index(db):
+    Coupon.objects.create(code='SALE10', percent_off=10)
+    with CaptureQueriesContext(connection) as ctx:
+        coupons.lookup('sale10')
+    sql = ctx.captured_queries[0]['sql']
+    assert 'LIKE' not in sql and 'UPPER' not in sql
+
+
+def test_validation_is_cached_until_coupon_changes(db, django_assert_num_queries):
+    coupon = Coupon.objects.create(code='HOT', percent_off=10)
+    coupons.valid('HOT')
+    with django_assert_num_queries(0):
+        assert coupons.valid('hot') is not None
+
+    coupon.active = False
+    coupon.save()
+    assert coupons.valid('HOT') is None
+
+
+def test_order_claims_a_use_and_cancel_returns_it(product):
+    Coupon.objects.create(code='ONCE', percent_off=10, max_uses=1)
+    order = place_order(FORM, snapshot(product, 'ONCE'))
+    assert order.coupon.code == 'ONCE'
+    assert order.total == Decimal('9.00')
+    assert Coupon.objects.get().used == 1
+
+    with pytest.raises(CouponUnavailable):
+        place_order(FORM, snapshot(product, 'ONCE'))
+    assert Order.objects.count() == 1
+    assert Product.objects.get().stock == 49
+
+    cancel_order(order.id)
+    assert Coupon.objects.get().used == 0
+    assert coupons.valid('ONCE') is not None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_single_use_code_is_claimed_once_under_concurrency(product):
+    Coupon.objects.create(code='RACE', percent_off=10, max_uses=1)
+    snap = snapshot(product, 'RACE')  # и двете заявки са валидирали кода преди поръчката
+    results = []
+
+    def buy():
+        try:
+            place_order(FORM, snap)
+            results.append(True)
+        except (CouponUnavailable, OperationalError):  # SQLite: заключена база при едновременен запис
+            results.append(False)
+        finally:
+            close_old_connections()
+
+    threads = [threading.Thread(target=buy) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert Coupon.objects.get().used == 1
+    assert Order.objects.filter(coupon__code='RACE').count() == 1
+
+
+def test_checkout_shows_error_when_code_runs_out(client, product):
+    coupon = Coupon.objects.create(code='LAST', percent_off=10, max_uses=1)
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    coupons.valid('LAST')  # кешът още казва „валиден“
+    Coupon.objects.filter(id=coupon.id).update(used=1)
+
+    resp = client.post('/checkout/', {**FORM, 'coupon': 'last'})
+    assert resp.status_code == 200
+    assert 'coupon' in resp.context['form'].errors
+    assert not Order.objects.exists()
+
+
+def test_generate_coupons_command(db):
+    out = StringIO()
+    call_command('generate_coupons', 2500, '--prefix', 'spring-', '--percent', '15', '--batch-size', '1000', stdout=out)
+    codes = out.getvalue().split()
+    assert len(codes) == len(set(codes)) == 2500
+    assert Coupon.objects.filter(code__startswith='SPRING-', max_uses=1, percent_off=15).count() == 2500
+
+
+def test_renamed_code_is_forgotten(db):
+    coupon = Coupon.objects.create(code='OLD', percent_off=10)
+    assert coupons.valid('OLD') is not None  # в кеша
+
+    coupon = Coupon.objects.get(id=coupon.id)
+    coupon.code = 'NEW'
+    coupon.save()
+    assert coupons.valid('OLD') is None
+    assert coupons.valid('NEW') is not None
+
+    coupon.code = 'NEWER'  # същата инстанция – помни вече NEW
+    coupon.save()
+    assert coupons.valid('NEW') is None
+
+
+def test_normalize_migration_refuses_case_duplicates(db):
+    from django.apps import apps
+    migration = importlib.import_module('checkout.migrations.0011_coupon_claims')
+
+    Coupon.objects.bulk_create([Coupon(code='summer'), Coupon(code='SUMMER'), Coupon(code=' winter')])
+    with pytest.raises(RuntimeError, match="SUMMER: #\\d+ 'summer', #\\d+ 'SUMMER'"):
+        migration.normalize_codes(apps, None)
+    assert Coupon.objects.filter(code=' winter').exists()  # нищо не е пипнато
+
+    Coupon.objects.filter(code='summer').delete()
+    migration.normalize_codes(apps, None)
+    assert set(Coupon.objects.values_list('code', flat=True)) == {'SUMMER', 'WINTER'}
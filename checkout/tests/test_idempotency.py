@@ -0,0 +1,109 @@
+import uuid
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from catalog.models import Category, Product
+from checkout.models import Order, PendingOrder
+from checkout.services import DuplicateSubmission, complete_checkout
+from cart.cart import CartSnapshot
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.fixture
+def product(db):
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=5)
+
+
+def test_form_carries_a_fresh_key(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    first = client.get('/checkout/').context['form']['idempotency_key'].value()
+    second = client.get('/checkout/').context['form']['idempotency_key'].value()
+    assert first and second and first != second
+
+
+def test_double_submit_creates_one_order(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 2})
+    form = {**FORM, 'idempotency_key': str(uuid.uuid4())}
+
+    first = client.post('/checkout/', form)
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})  # количката се е променила междувременно
+    second = client.post('/checkout/', form)
+
+    assert first['Location'] == second['Location'] == '/checkout/success/'
+    order = Order.objects.get()
+    assert order.items.get().qty == 2
+    product.refresh_from_db()
+    assert product.stock == 3
+
+
+
+@pytest.fixture
+def card_gateway(settings):
+    settings.PAYMENT_GATEWAY = 'fake'
+    settings.PAYMENT_FAKE_ALLOWED = True
+    settings.STRIPE_WEBHOOK_SECRET = 'whsec_test_secret'
+    settings.PAYMENT_FAKE_FAILURE_RATE = 0
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_replay_follows_stored_order_not_resubmitted_method(client, product, card_gateway):
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    key = str(uuid.uuid4())
+    client.post('/checkout/', {**FORM, 'idempotency_key': key})
+
+    # същият ключ, но с карта – наложеният платеж остава, без сесия за плащане
+    resp = client.post('/checkout/', {**FORM, 'payment_method': 'card', 'idempotency_key': key})
+
+    assert resp['Location'] == '/checkout/success/'
+    assert Order.objects.get().payment_url == ''
+
+
+def test_replay_of_card_order_still_starting_payment(client, product, card_gateway):
+    key = uuid.uuid4()
+    Order.objects.create(email='a@example.com', full_name='И', address='С', total=10,
+                         idempotency_key=key, card_payment=True)
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+
+    # повторението е с наложен платеж, но първата заявка още създава сесията
+    resp = client.post('/checkout/', {**FORM, 'idempotency_key': str(key)})
+
+    assert resp.status_code == 200
+    assert 'вече се обработва' in resp.context['error']
+    assert resp.wsgi_request.session.get('cart')
+
+def test_racing_submit_raises_duplicate(product):
+    key = uuid.uuid4()
+    data = {**FORM, 'idempotency_key': key}
+    snapshot = CartSnapshot.build({f'p{product.id}': {'type': 'product', 'item_id': product.id, 'qty': 1}})
+    order, _ = complete_checkout(data, snapshot)
+
+    # втората заявка е минала проверката преди първата да запише – уникалният ключ я спира
+    with pytest.raises(DuplicateSubmission) as exc:
+        complete_checkout(data, snapshot)
+    assert exc.value.order == order
+    product.refresh_from_db()
+    assert product.stock == 4
+
+
+def test_intake_replay_returns_same_pending(client, product, settings):
+    settings.CHECKOUT_INTAKE = True
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    form = {**FORM, 'idempotency_key': str(uuid.uuid4())}
+
+    first = client.post('/checkout/', form)
+    second = client.post('/checkout/', form)
+    assert first['Location'] == second['Location']
+    assert PendingOrder.objects.count() == 1
+
+    call_command('process_checkout_queue', once=True)
+    assert client.post('/checkout/', form)['Location'] == '/checkout/success/'
+    assert Order.objects.count() == 1
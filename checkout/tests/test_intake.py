@@ -0,0 +1,83 @@
+import os
+
+import pytest
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from catalog.models import Category, Product
+from checkout.management.commands.process_checkout_queue import Command
+from checkout.models import Order, PendingOrder
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.fixture
+def product(db, settings):
+    settings.CHECKOUT_INTAKE = True
+    settings.CHECKOUT_METRICS_TOKEN = 'secret'
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=3)
+
+
+def test_post_only_queues_and_worker_places_order(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 2})
+    r = client.post('/checkout/', FORM)
+    pending = PendingOrder.objects.get()
+    assert r['Location'] == f'/checkout/pending/{pending.token}/'
+    assert not Order.objects.exists()
+
+    r = client.get(r['Location'])
+    assert r.status_code == 200 and b'http-equiv="refresh"' in r.content
+
+    call_command('process_checkout_queue', once=True)
+    pending.refresh_from_db()
+    assert pending.status == PendingOrder.Status.DONE
+    assert pending.order.total == Decimal('20')
+    product.refresh_from_db()
+    assert product.stock == 1
+
+    r = client.get(f'/checkout/pending/{pending.token}/')
+    assert r['Location'] == '/checkout/success/'
+    assert client.get('/cart/state/').json()['count'] == 0
+
+
+def test_failed_order_keeps_cart(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 3})
+    client.post('/checkout/', FORM)
+    Product.objects.filter(pk=product.pk).update(stock=1)
+
+    call_command('process_checkout_queue', once=True)
+    pending = PendingOrder.objects.get()
+    assert pending.status == PendingOrder.Status.FAILED
+    r = client.get(f'/checkout/pending/{pending.token}/')
+    assert 'наличност' in r.content.decode() and b'refresh' not in r.content
+    assert client.get('/cart/state/').json()['count'] == 3
+
+
+def test_metrics(client, product):
+    client.post(f'/cart/add/{product.id}/', {'qty': 1})
+    client.post('/checkout/', FORM)
+    client.post('/checkout/', FORM)
+
+    assert client.get('/checkout/metrics/').status_code == 403
+    body = client.get('/checkout/metrics/', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+    assert 'checkout_queue_depth{status="queued"} 2' in body
+
+    call_command('process_checkout_queue', once=True)
+    client.force_login(User.objects.create_user('staff', is_staff=True))
+    body = client.get('/checkout/metrics/').content.decode()
+    assert 'checkout_queue_depth{status="queued"} 0' in body
+    assert 'checkout_queue_processed{status="done"} 2' in body
+    assert 'checkout_queue_latency_seconds{status="done",stat="avg"}' in body
+
+
+
+def test_dead_worker_fails_the_command(db, monkeypatch, capsys):
+    # работникът умира, без да върне управлението (OOM, сегфолт) – командата не бива да мине за успешна
+    monkeypatch.setattr(Command, 'work', lambda self, options: os._exit(3))
+    with pytest.raises(CommandError, match='Неуспешни работници: 2'):
+        call_command('process_checkout_queue', workers=2, once=True)
+    assert capsys.readouterr().err.count('спря с код 3') == 2
@@ -0,0 +1,65 @@
+import pytest
+from decimal import Decimal
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.utils import timezone
+from catalog.models import Category, Product
+from checkout import outbox
+from checkout.models import EmailOutbox
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'cod',
+}
+
+
+@pytest.mark.django_db
+def test_cod_checkout_queues_mail_instead_of_sending(client):
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=3)
+    client.post(f'/cart/add/{p.id}/', {'qty': 1})
+    client.post('/checkout/', FORM)
+
+    assert mail.outbox == []
+    email = EmailOutbox.objects.get()
+    assert email.order.email == email.to == 'a@example.com'
+
+    call_command('send_outbox')
+    assert [m.subject for m in mail.outbox] == [email.subject]
+    email.refresh_from_db()
+    assert email.status == EmailOutbox.Status.SENT and email.sent_at
+
+
+@pytest.mark.django_db
+def test_one_connection_per_batch(monkeypatch):
+    opened = []
+    monkeypatch.setattr(EmailBackend, 'open', lambda self: opened.append(self))
+    for i in range(5):
+        outbox.queue_email(f'u{i}@example.com', 'Тема', 'Текст')
+
+    assert outbox.send_batch(batch_size=3) == (3, 0)
+    assert outbox.send_batch(batch_size=3) == (2, 0)
+    assert len(opened) == 2
+    assert len(mail.outbox) == 5
+
+
+@pytest.mark.django_db
+def test_failures_back_off_then_give_up(monkeypatch):
+    def broken(self, messages):
+        raise OSError('SMTP недостъпен')
+    monkeypatch.setattr(EmailBackend, 'send_messages', broken)
+    email = outbox.queue_email('a@example.com', 'Тема', 'Текст')
+
+    assert outbox.send_batch() == (0, 1)
+    email.refresh_from_db()
+    assert email.status == EmailOutbox.Status.PENDING and email.attempts == 1
+    assert email.next_attempt_at > timezone.now()
+    assert outbox.send_batch() == (0, 0)  # още не е време
+
+    for attempt in range(2, 4):
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        outbox.send_batch(max_attempts=3)
+    email.refresh_from_db()
+    assert email.status == EmailOutbox.Status.FAILED and email.attempts == 3
+    assert 'SMTP' in email.last_error
@@ -0,0 +1,176 @@
+"""Записани Stripe събития, подписани локално (без мрежа), минават през webhook-а и работника."""
+import hashlib
+import hmac
+import json
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from django.core import mail
+from django.core.management import call_command
+from cart.cart import CartSnapshot
+from catalog.models import Category, Product, ProductVariant
+from checkout.models import EmailOutbox, Order, PaymentEvent
+from checkout.services import place_order
+
+EVENTS = Path(__file__).parent / 'stripe_events'
+SECRET = 'whsec_test_secret'
+
+
+def stripe_payload(name, order, **overrides):
+    event = json.loads((EVENTS / f'{name}.json').read_text().replace('__ORDER_ID__', str(order.id)))
+    event.update(overrides)
+    return json.dumps(event)
+
+
+def signature(payload, secret=SECRET):
+    t = int(time.time())
+    v1 = hmac.new(secret.encode(), f'{t}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={t},v1={v1}'
+
+
+def post(client, payload, secret=SECRET):
+    return client.post('/checkout/stripe/webhook/', payload, content_type='application/json',
+                       HTTP_STRIPE_SIGNATURE=signature(payload, secret))
+
+
+@pytest.fixture
+def order(db, settings):
+    settings.USE_STRIPE = True
+    settings.STRIPE_SECRET_KEY = 'sk_test_local'
+    settings.STRIPE_WEBHOOK_SECRET = SECRET
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=5)
+    data = {'email': 'a@example.com', 'full_name': 'Иван', 'address': 'София', 'payment_method': 'card'}
+    return place_order(data, CartSnapshot.build({f'p{p.id}': {'type': 'product', 'item_id': p.id, 'qty': 2}}))
+
+
+def test_webhook_only_records_and_acks(client, order, django_assert_max_num_queries):
+    payload = stripe_payload('checkout.session.completed', order)
+    with django_assert_max_num_queries(3):
+        assert post(client, payload).status_code == 200
+    # повторение от Stripe – същото id, пак 200, нищо ново
+    assert post(client, payload).status_code == 200
+
+    event = PaymentEvent.objects.get()
+    assert (event.order_ref, event.processed_at) == (order.id, None)
+    order.refresh_from_db()
+    assert order.status == Order.Status.NEW
+
+
+def test_bad_signature_is_rejected(client, order):
+    payload = stripe_payload('checkout.session.completed', order)
+    assert post(client, payload, secret='whsec_other').status_code == 400
+    assert not PaymentEvent.objects.exists()
+
+
+def test_worker_applies_each_event_once(client, order):
+    payload = stripe_payload('checkout.session.completed', order)
+    post(client, payload)
+    post(client, payload)
+
+    call_command('process_payment_events')
+    call_command('process_payment_events')
+
+    order.refresh_from_db()
+    assert order.status == Order.Status.PAID and order.paid
+    assert EmailOutbox.objects.filter(order=order).count() == 1
+    assert mail.outbox == []  # имейлът е в опашката, не е пратен от webhook-а
+    assert PaymentEvent.objects.get().processed_at
+
+
+def test_events_apply_in_stripe_order(client, order):
+    # expired пристига преди completed, но Stripe го е създал по-късно
+    post(client, stripe_payload('checkout.session.expired', order))
+    post(client, stripe_payload('checkout.session.completed', order))
+
+    call_command('process_payment_events')
+
+    order.refresh_from_db()
+    assert order.status == Order.Status.PAID
+    assert Product.objects.get().stock == 3
+
+
+def test_expired_session_cancels_and_releases(client, order):
+    post(client, stripe_payload('checkout.session.expired', order))
+    call_command('process_payment_events')
+
+    order.refresh_from_db()
+    assert order.status == Order.Status.CANCELED
+    assert Product.objects.get().stock == 5
+
+
+def test_paid_after_expiry_without_stock_keeps_nothing_reserved(client, order):
+    # втори ред (вариант) в поръчката – запазва се преди продукта
+    p = Product.objects.get()
+    v = ProductVariant.objects.create(product=p, sku='A-M', size='M', price=Decimal('10'), stock=5)
+    order.items.create(product=p, variant=v, product_name='A [M]', unit_price=Decimal('10'), qty=2)
+    ProductVariant.objects.filter(id=v.id).update(stock=3)
+
+    post(client, stripe_payload('checkout.session.expired', order))
+    call_command('process_payment_events')
+    assert (Product.objects.get().stock, ProductVariant.objects.get().stock) == (5, 5)
+
+    Product.objects.update(stock=1)  # продуктовият ред вече не стига
+    post(client, stripe_payload('checkout.session.completed', order, id='evt_paid_late', created=2_000_000_000))
+    call_command('process_payment_events')
+
+    order.refresh_from_db()
+    assert order.status == Order.Status.PAID
+    assert PaymentEvent.objects.get(stripe_id='evt_paid_late').error
+    assert (Product.objects.get().stock, ProductVariant.objects.get().stock) == (1, 5)
+
+
+def test_poison_event_is_parked_without_blocking_other_orders(client, order, settings, monkeypatch):
+    from checkout import events
+
+    settings.PAYMENT_EVENT_MAX_ATTEMPTS = 3
+    p = Product.objects.get()
+    other = place_order({'email': 'b@example.com', 'full_name': 'Мария', 'address': 'Варна', 'payment_method': 'card'},
+                        CartSnapshot.build({f'p{p.id}': {'type': 'product', 'item_id': p.id, 'qty': 1}}))
+    post(client, stripe_payload('checkout.session.completed', order, id='evt_poison', created=1))
+    post(client, stripe_payload('checkout.session.expired', order, id='evt_after_poison', created=2))
+    post(client, stripe_payload('checkout.session.completed', other, id='evt_other', created=3))
+
+    completed = events.HANDLERS['checkout.session.completed']
+
+    def poison(event):
+        if event.order_ref == order.id:
+            raise RuntimeError("boom")
+        completed(event)
+
+    monkeypatch.setitem(events.HANDLERS, 'checkout.session.completed', poison)
+    for _ in range(3):
+        events.process_pending(batch_size=1)  # отровното е начело на прозореца
+    poisoned = PaymentEvent.objects.get(stripe_id='evt_poison')
+    assert poisoned.attempts == 3 and poisoned.failed_at and poisoned.error == 'boom'
+
+    assert events.process_pending(batch_size=1) == (1, 0)  # другата поръчка минава
+    other.refresh_from_db()
+    assert other.status == Order.Status.PAID
+    # по-късното събитие на същата поръчка чака – не се прилага преди отровното
+    assert events.process_pending() == (0, 0)
+    assert not PaymentEvent.objects.get(stripe_id='evt_after_poison').processed_at
+
+    monkeypatch.setitem(events.HANDLERS, 'checkout.session.completed', completed)
+    call_command('process_payment_events', retry_failed=True)
+    order.refresh_from_db()
+    assert order.status == Order.Status.PAID  # completed, после expired (no-op за платена)
+    assert not PaymentEvent.objects.filter(processed_at__isnull=True).exists()
+
+
+@pytest.mark.parametrize('status', [Order.Status.FULFILLED, Order.Status.REFUNDED])
+def test_late_completed_event_does_not_reopen_order(client, order, status):
+    from checkout.models import Coupon
+
+    coupon = Coupon.objects.create(code='LATE', percent_off=10)
+    Order.objects.filter(id=order.id).update(status=status, paid=True, coupon=coupon)
+    post(client, stripe_payload('checkout.session.completed', order))
+    call_command('process_payment_events')
+
+    order.refresh_from_db()
+    assert order.status == status
+    assert Coupon.objects.get().used == 0
+    assert not EmailOutbox.objects.filter(order=order).exists()
+    assert PaymentEvent.objects.get().processed_at
@@ -0,0 +1,165 @@
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from catalog.models import Category, Product
+from checkout import payments
+from checkout.models import Order, PaymentEvent
+
+FORM = {
+    'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София',
+    'phone': '', 'coupon': '', 'payment_method': 'card',
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_gateway(settings):
+    settings.PAYMENT_GATEWAY = 'fake'
+    settings.PAYMENT_FAKE_ALLOWED = True
+    settings.STRIPE_WEBHOOK_SECRET = 'whsec_test_secret'
+    settings.PAYMENT_FAKE_FAILURE_RATE = 0
+    settings.PAYMENT_BREAKER_THRESHOLD = 3
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def product(db):
+    c = Category.objects.create(name='X', slug='x')
+    return Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=5)
+
+
+def checkout(client, product, **form):
+    client.post(f'/cart/add/{product.id}/', {'qty': 2})
+    return client.post('/checkout/', {**FORM, **form})
+
+
+def test_breaker_opens_after_threshold_and_probes_after_cooldown():
+    breaker = payments.CircuitBreaker('test', threshold=3, cooldown=30)
+    calls = []
+
+    def boom():
+        calls.append(1)
+        raise TimeoutError
+
+    for _ in range(3):
+        with pytest.raises(payments.PaymentError):
+            breaker.call(boom, transient=(TimeoutError,))
+    with pytest.raises(payments.GatewayUnavailable):
+        breaker.call(boom, transient=(TimeoutError,))
+    assert len(calls) == 3
+
+    cache.delete(breaker.open_key)  # паузата изтече
+    with pytest.raises(payments.PaymentError):
+        breaker.call(boom, transient=(TimeoutError,))
+    assert not breaker.allow()  # пробата не успя – веднага отново отворена
+
+    cache.delete(breaker.open_key)
+    assert breaker.call(lambda: 'ok', transient=(TimeoutError,)) == 'ok'
+    assert breaker.allow()
+
+
+def test_fake_gateway_pays_through_signed_webhook(client, product):
+    resp = checkout(client, product)
+    pay_url = urlparse(resp['Location']).path
+    assert pay_url.startswith('/checkout/fake-pay/')
+    assert client.get(pay_url).status_code == 200
+
+    assert client.post(pay_url, {'action': 'pay'})['Location'] == '/checkout/success/'
+    assert PaymentEvent.objects.get().type == 'checkout.session.completed'
+
+    call_command('process_payment_events')
+    order = Order.objects.get()
+    assert order.status == Order.Status.PAID
+    product.refresh_from_db()
+    assert product.stock == 3
+
+
+def test_fake_gateway_cancel_expires_the_session(client, product):
+    pay_url = urlparse(checkout(client, product)['Location']).path
+    assert client.post(pay_url, {'action': 'cancel'})['Location'] == '/checkout/cancel/'
+
+    call_command('process_payment_events')
+    assert Order.objects.get().status == Order.Status.CANCELED
+    product.refresh_from_db()
+    assert product.stock == 5
+
+
+def test_fake_webhook_rejects_bad_signature(client, product):
+    payload, _ = payments.FakeGateway().event('checkout.session.completed', {'order_id': '1'})
+    resp = client.post('/checkout/stripe/webhook/', payload, content_type='application/json',
+                       HTTP_STRIPE_SIGNATURE='t=1,v1=bad')
+    assert resp.status_code == 400
+    assert not PaymentEvent.objects.exists()
+
+
+def test_tampered_session_is_404(client, product):
+    assert client.get('/checkout/fake-pay/not-a-session/').status_code == 404
+
+
+def test_gateway_failure_falls_back_to_cash_on_delivery(client, product, settings):
+    settings.PAYMENT_FAKE_FAILURE_RATE = 1
+
+    resp = checkout(client, product)
+    assert resp.status_code == 200
+    assert resp.context['form']['payment_method'].value() == 'cod'
+    assert Order.objects.get().status == Order.Status.CANCELED
+    product.refresh_from_db()
+    assert product.stock == 5
+
+    for _ in range(2):
+        checkout(client, product, idempotency_key='')
+    # веригата е отворена: картата не се предлага и шлюзът не се вика
+    assert not payments.available()
+    page = client.get('/checkout/')
+    assert 'card' not in dict(page.context['form'].fields['payment_method'].choices)
+
+    resp = client.post('/checkout/', {**FORM, 'payment_method': 'cod'})
+    assert resp['Location'] == '/checkout/success/'
+
+
+def test_stripe_request_errors_cancel_without_opening_breaker(client, product, settings, monkeypatch):
+    import stripe
+
+    settings.PAYMENT_GATEWAY = 'stripe'
+    settings.USE_STRIPE = True
+    settings.STRIPE_SECRET_KEY = 'sk_test_local'
+    sessions = []
+
+    class Sessions:
+        def create(self, params, options):
+            sessions.append(params)
+            raise stripe.InvalidRequestError("expires_at must be at least 30 minutes", 'expires_at')
+
+    stub = SimpleNamespace(v1=SimpleNamespace(checkout=SimpleNamespace(sessions=Sessions())))
+    monkeypatch.setattr(payments, '_stripe_client', lambda *args: stub)
+
+    for _ in range(settings.PAYMENT_BREAKER_THRESHOLD + 1):
+        resp = checkout(client, product, idempotency_key='')
+        assert resp.status_code == 200  # формата отново, не 500
+    assert set(Order.objects.values_list('status', flat=True)) == {Order.Status.CANCELED}
+    assert payments.available()  # грешка в заявката не значи недостъпен шлюз
+    assert sessions[0]['expires_at'] - time.time() > 30 * 60 + 30
+
+
+@pytest.mark.parametrize('allowed, secret', [(False, 'whsec_test_secret'), (True, '')])
+def test_fake_gateway_needs_explicit_opt_in_and_secret(settings, allowed, secret):
+    from django.core.exceptions import ImproperlyConfigured
+
+    settings.PAYMENT_FAKE_ALLOWED = allowed
+    settings.STRIPE_WEBHOOK_SECRET = secret
+    with pytest.raises(ImproperlyConfigured):
+        payments.get_gateway()
+
+
+def test_fake_pay_page_is_404_with_another_gateway(client, product, settings):
+    pay_url = urlparse(checkout(client, product)['Location']).path
+    settings.PAYMENT_GATEWAY = 'stripe'
+    assert client.get(pay_url).status_code == 404
+    assert client.post(pay_url, {'action': 'pay'}).status_code == 404
+    assert not PaymentEvent.objects.exists()
@@ -0,0 +1,98 @@
+import pytest
+from decimal import Decimal
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from cart.cart import CartSnapshot
+from catalog import versioning
+from catalog.models import Category, Product, ProductVariant
+from checkout.models import Order
+from checkout.services import OutOfStock, cancel_order, place_order
+
+DATA = {'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София', 'phone': ''}
+
+
+def make_cart(lines):
+    """Половината редове са продукти, половината – варианти; в до 5 категории."""
+    cart = {}
+    for i in range(lines):
+        c, _ = Category.objects.get_or_create(name=f'X{i % 5}', slug=f'x{i % 5}')
+        p = Product.objects.create(category=c, name=f'P{i}', slug=f'p-{lines}-{i}', price=Decimal('5'), stock=10)
+        if i % 2:
+            v = ProductVariant.objects.create(product=p, sku=f'S-{lines}-{i}', size='M', price=Decimal('7'), stock=10)
+            cart[f'v{v.id}'] = {'type': 'variant', 'item_id': v.id, 'qty': 2}
+        else:
+            cart[f'p{p.id}'] = {'type': 'product', 'item_id': p.id, 'qty': 3}
+    return CartSnapshot.build(cart)
+
+
+def count_queries(snapshot, capture):
+    with CaptureQueriesContext(connection) as ctx, capture(execute=True):
+        place_order(DATA, snapshot)
+    return len(ctx.captured_queries)
+
+
+@pytest.mark.django_db
+def test_query_count_does_not_grow_with_cart(django_assert_num_queries, django_capture_on_commit_callbacks):
+    small, big = make_cart(2), make_cart(50)
+    count_queries(make_cart(5), django_capture_on_commit_callbacks)  # създава редовете на версиите
+
+    # SAVEPOINT, INSERT order, bulk INSERT редове, UPDATE варианти, UPDATE продукти,
+    # INSERT имейл в опашката, RELEASE, после (on_commit) версиите на каталога:
+    # UPDATE продукти, SELECT категории, един UPDATE за global + всичките 5 категории
+    with django_assert_num_queries(10), django_capture_on_commit_callbacks(execute=True):
+        place_order(DATA, big)
+    assert count_queries(small, django_capture_on_commit_callbacks) == count_queries(
+        big, django_capture_on_commit_callbacks)
+
+
+@pytest.mark.django_db
+def test_catalog_version_failure_does_not_fail_checkout(monkeypatch, django_capture_on_commit_callbacks):
+    snapshot = make_cart(2)
+    before = versioning.state(versioning.GLOBAL)[0]
+
+    def locked(*args, **kwargs):
+        raise OperationalError("database is locked")
+
+    monkeypatch.setattr(versioning, 'touch_products', locked)
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        order = place_order(DATA, snapshot)
+    assert len(callbacks) == 1
+    assert Order.objects.get() == order
+    assert versioning.state(versioning.GLOBAL)[0] == before
+
+
+@pytest.mark.django_db
+def test_place_order_writes_items_and_reserves_stock():
+    snapshot = make_cart(50)
+    order = place_order(DATA, snapshot)
+
+    assert order.items.count() == 50
+    assert order.total == Decimal('25') * 3 * 5 + Decimal('25') * 2 * 7
+    assert set(Product.objects.filter(variants__isnull=True).values_list('stock', flat=True)) == {7}
+    assert set(ProductVariant.objects.values_list('stock', flat=True)) == {8}
+    assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_short_line_rejects_whole_order():
+    snapshot = make_cart(4)
+    ProductVariant.objects.filter(id=snapshot.lines[-1].variant_id).update(stock=1)
+
+    with pytest.raises(OutOfStock):
+        place_order(DATA, snapshot)
+
+    assert not Order.objects.exists()
+    assert set(Product.objects.filter(variants__isnull=True).values_list('stock', flat=True)) == {10}
+
+
+@pytest.mark.django_db
+def test_cancel_order_releases_stock_once():
+    snapshot = make_cart(2)
+    order = place_order(DATA, snapshot)
+
+    assert cancel_order(order.id)
+    assert not cancel_order(order.id)
+    assert set(ProductVariant.objects.values_list('stock', flat=True)) == {10}
+    assert set(Product.objects.values_list('stock', flat=True)) == {10}
+    order.refresh_from_db()
+    assert order.status == Order.Status.CANCELED
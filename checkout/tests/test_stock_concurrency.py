@@ -0,0 +1,54 @@
+"""Много едновременни поръчки за един „горещ“ SKU не продават повече от наличното."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from django.db import OperationalError, connection
+from cart.cart import CartSnapshot
+from catalog.models import Category, Product, ProductVariant
+from checkout.models import Order
+from checkout.services import OutOfStock, place_order
+
+STOCK = 40
+CHECKOUTS = 300
+DATA = {'email': 'a@example.com', 'full_name': 'Иван Иванов', 'address': 'София', 'phone': ''}
+
+
+def checkout(cart):
+    """True = продадено, False = няма наличност. Заключена база не е отказ – опитва отново."""
+    try:
+        for _ in range(500):
+            try:
+                place_order(DATA, CartSnapshot.build(cart))
+                return True
+            except OutOfStock:
+                return False
+            except OperationalError:
+                # тестовата SQLite база (shared cache) заключва цели таблици и не чака –
+                # транзакцията е върната изцяло, така че повторението е безопасно
+                time.sleep(0.001)
+        raise AssertionError("базата остана заключена")
+    finally:
+        connection.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_hot_sku_is_never_oversold():
+    c = Category.objects.create(name='X', slug='x')
+    p = Product.objects.create(category=c, name='Hot', slug='hot', price=Decimal('10'), stock=0)
+    v = ProductVariant.objects.create(product=p, sku='HOT-M', size='M', price=Decimal('10'), stock=STOCK)
+    carts = [{f'v{v.id}': {'type': 'variant', 'item_id': v.id, 'qty': 1 + i % 2}} for i in range(CHECKOUTS)]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(checkout, carts))
+
+    v.refresh_from_db()
+    orders = Order.objects.filter(items__variant=v).distinct()
+    sold = sum(item.qty for order in orders for item in order.items.all())
+
+    assert v.stock >= 0
+    assert sold + v.stock == STOCK
+    # всяка приета поръчка е записана и всяка записана е приета
+    assert sum(results) == orders.count()
+    assert 0 < sold <= STOCK
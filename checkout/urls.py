@@ -3,7 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.checkout_view, name='checkout_view'),
+    path('pending/<uuid:token>/', views.checkout_pending, name='checkout_pending'),
+    path('metrics/', views.checkout_metrics, name='checkout_metrics'),
     path('success/', views.checkout_success, name='checkout_success'),
     path('cancel/', views.checkout_cancel, name='checkout_cancel'),
     path('stripe/webhook/', views.stripe_webhook, name='stripe_webhook'),
+    path('fake-pay/<str:session>/', views.fake_pay, name='checkout_fake_pay'),
 ]
\ No newline at end of file
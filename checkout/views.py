@@ -1,155 +1,139 @@
-from decimal import Decimal
-from django.shortcuts import render, redirect
-from django.db import transaction
-from django.http import HttpResponse
+import uuid
+
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 
-from .models import Order, OrderItem, Coupon
+from . import events, intake, payments
+from .models import Order, PendingOrder
+from .services import (
+    CouponUnavailable, DuplicateSubmission, OutOfStock, complete_checkout, find_submitted,
+)
 from .forms import CheckoutForm
 from cart.cart import Cart
-from catalog.models import Product, ProductVariant
-
-# Stripe е опционален
-try:
-    import stripe
-except Exception:
-    stripe = None
 
-if getattr(settings, 'USE_STRIPE', False) and stripe and settings.STRIPE_SECRET_KEY:
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-else:
-    # деактивирай Stripe ако няма ключове/флаг
-    setattr(settings, 'USE_STRIPE', False)
+OUT_OF_STOCK = "Някои продукти вече нямат достатъчна наличност. Моля, прегледайте количката."
+CARD_UNAVAILABLE = "Плащането с карта е временно недостъпно. Можете да поръчате с наложен платеж."
 
 
 def checkout_view(request):
     cart = Cart(request)
 
     if request.method == 'POST':
-        form = CheckoutForm(request.POST)
+        form = CheckoutForm(request.POST, card=payments.available())
         if form.is_valid():
-            cart_total = cart.total()
-
-            # Промокод
-            code = form.cleaned_data.get('coupon', '').strip()
-            applied_coupon = None
-            if code:
-                try:
-                    c = Coupon.objects.get(code__iexact=code)
-                    if c.is_valid():
-                        cart_total = c.apply(cart_total)
-                        applied_coupon = c
-                except Coupon.DoesNotExist:
-                    applied_coupon = None
-
-            payment_method = form.cleaned_data.get('payment_method', 'cod')
-
-            # Създаване на поръчката и редовете
-            with transaction.atomic():
-                order = Order.objects.create(
-                    email=form.cleaned_data['email'],
-                    full_name=form.cleaned_data['full_name'],
-                    address=form.cleaned_data['address'],
-                    phone=form.cleaned_data['phone'],
-                    total=cart_total,
-                    status=Order.Status.NEW,
-                )
-                line_items = []
-                for i in cart:
-                    product_obj = Product.objects.filter(id=i['id']).first()
-                    variant_obj = None
-                    
-                    # Handle variant items
-                    if i.get('type') == 'variant' and i.get('variant_id'):
-                        variant_obj = ProductVariant.objects.filter(id=i['variant_id']).first()
-                    
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product_obj,
-                        variant=variant_obj,
-                        product_name=i['name'],
-                        unit_price=i['price'],
-                        qty=i['qty'],
-                    )
-                    line_items.append({
-                        'name': i['name'],
-                        'amount': int(Decimal(i['price']) * 100),
-                        'qty': int(i['qty']),
-                    })
-
-
-            # Ако е наложен платеж → без Stripe
-            if payment_method == 'cod' or not settings.USE_STRIPE:
-                # намаляване на наличности
-                for it in order.items.select_related('product', 'variant'):
-                    if it.variant:
-                        # Reduce variant stock
-                        it.variant.stock = max(0, int(it.variant.stock) - int(it.qty))
-                        it.variant.save(update_fields=['stock'])
-                    elif it.product:
-                        # Reduce product stock (for items without variants)
-                        it.product.stock = max(0, int(it.product.stock) - int(it.qty))
-                        it.product.save(update_fields=['stock'])
-
-                # (по желание) изпрати имейл „получена поръчка“
-                try:
-                    subject = f"Получена поръчка №{order.id}"
-                    message = (
-                        f"Здравейте, {order.full_name}!\n\n"
-                        f"Получихме вашата поръчка №{order.id}. Плащане: Наложен платеж.\n"
-                        f"Сума: {order.total} лв\n"
-                        "Ще се свържем при нужда.\n"
-                    )
-                    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [order.email], fail_silently=True)
-                except Exception:
-                    pass
-
-                # Изчисти количката и прати към success
+            # повторно изпращане на същата форма → резултатът от първото, без нова работа
+            existing = find_submitted(form.cleaned_data.get('idempotency_key'))
+            if existing is not None:
+                return _replay(request, cart, form, existing)
+
+            if getattr(settings, 'CHECKOUT_INTAKE', False):
+                # режим на опашка: само запис; поръчката прави process_checkout_queue
+                if cart.is_empty():
+                    return redirect('cart_detail')
+                pending = intake.enqueue(form.cleaned_data, cart)
+                return redirect('checkout_pending', token=pending.token)
+
+            # една оценена снимка: редове, цени, промокод, наличност
+            code = form.cleaned_data.get('coupon', '')
+            snapshot = cart.snapshot(coupon_code=code)
+
+            if not snapshot.lines:
+                return redirect('cart_detail')
+            if not snapshot.all_in_stock:
+                return _form_page(request, form, snapshot.subtotal, OUT_OF_STOCK)
+
+            # Поръчка + редове + запазване на наличността в една транзакция;
+            # ако някой ред не стига, нищо не се записва
+            try:
+                order, payment_url = complete_checkout(form.cleaned_data, snapshot, cart_key=cart.storage.key)
+            except DuplicateSubmission as dup:
+                return _replay(request, cart, form, dup.order)
+            except OutOfStock:
+                return _form_page(request, form, snapshot.subtotal, OUT_OF_STOCK)
+            except CouponUnavailable:
+                # изчерпан между валидирането и поръчката (еднократен код, използван паралелно)
+                form.add_error('coupon', "Промокодът вече не е валиден.")
+                return _form_page(request, form, snapshot.subtotal)
+            except payments.PaymentError:
+                # шлюзът не отговори навреме – поръчката е отказана, наличността върната
+                return _form_page(request, _retry_form(request), snapshot.subtotal, CARD_UNAVAILABLE)
+
+            # Наложен платеж → изчисти количката и към success; карта → към плащането
+            if payment_url is None:
                 cart.clear()
                 return redirect('checkout_success')
-
-            # Иначе – Stripe Checkout (само ако USE_STRIPE == True)
-            # Заб: тук НЯМА да стигнем ако няма ключове.
-            import stripe as _stripe  # локален alias за сигурност
-            success_url = f"{settings.SITE_URL}/checkout/success/"
-            cancel_url = f"{settings.SITE_URL}/checkout/cancel/"
-
-            # Преобразуване на line_items към Stripe формат
-            stripe_line_items = [{
-                'price_data': {
-                    'currency': 'bgn',
-                    'product_data': {'name': it['name']},
-                    'unit_amount': it['amount'],
-                },
-                'quantity': it['qty'],
-            } for it in line_items]
-
-            metadata = {'order_id': str(order.id)}
-            if applied_coupon:
-                metadata['coupon_code'] = applied_coupon.code
-
-            session = _stripe.checkout.Session.create(
-                mode='payment',
-                line_items=stripe_line_items,
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata=metadata,
-                customer_email=order.email,
-            )
-            return redirect(session.url)
+            return redirect(payment_url)
     else:
-        form = CheckoutForm()
+        form = CheckoutForm(card=payments.available())
+
+    return _form_page(request, form, cart.snapshot().subtotal)
 
+
+def _form_page(request, form, total, error=None):
     return render(request, 'checkout/checkout.html', {
         'form': form,
-        'cart_total': cart.total(),
-        'stripe_pk': settings.STRIPE_PUBLISHABLE_KEY if getattr(settings, 'USE_STRIPE', False) else '',
+        'cart_total': total,
+        'error': error,
+        'card_available': payments.available(),
+    })
+
+
+def _retry_form(request):
+    """Същите данни с нов idempotency_key и наложен платеж – за нов опит след неуспешно плащане."""
+    data = request.POST.copy()
+    data['idempotency_key'] = str(uuid.uuid4())
+    data['payment_method'] = 'cod'
+    return CheckoutForm(data, card=payments.available())
+
+
+def _replay(request, cart, form, order):
+    """
+    Отговорът на вече обработено изпращане – според записаната поръчка, не според
+    повторената форма: същото плащане, същата success страница или „обработва се“.
+    """
+    if order.card_payment and order.status == Order.Status.NEW:
+        if order.payment_url:
+            return redirect(order.payment_url)
+        # първата заявка още създава сесията за плащане
+        return _form_page(request, form, order.total, "Поръчката вече се обработва. Моля, изчакайте и опреснете страницата.")
+    if order.card_payment and order.status == Order.Status.CANCELED:
+        # първият опит е спрял при шлюза
+        return _form_page(request, _retry_form(request), order.total, CARD_UNAVAILABLE)
+    cart.clear()
+    return redirect('checkout_success')
+
+
+@never_cache
+def checkout_pending(request, token):
+    """Страницата „обработва се“ – опреснява се, докато работникът не приключи."""
+    pending = get_object_or_404(PendingOrder, token=token)
+
+    if pending.status == PendingOrder.Status.DONE:
+        cart = Cart(request)
+        if cart.storage.key == (pending.cart_key or None):
+            cart.clear()
+        return redirect(pending.payment_url or 'checkout_success')
+
+    return render(request, 'checkout/pending.html', {
+        'pending': pending,
+        'refresh_seconds': settings.CHECKOUT_INTAKE_POLL_SECONDS,
     })
 
 
+@never_cache
+def checkout_metrics(request):
+    """Метрики на опашката в Prometheus формат (за staff или с CHECKOUT_METRICS_TOKEN)."""
+    token = settings.CHECKOUT_METRICS_TOKEN
+    auth = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(auth, f'Bearer {token}'))):
+        return HttpResponse(status=403)
+    return HttpResponse(intake.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def checkout_success(request):
     # Ако плащането е било COD, количката вече е изчистена в checkout_view.
     # Ако Stripe – изчистването може да е тук или в webhook по избор.
@@ -162,52 +146,47 @@ def checkout_cancel(request):
 
 @csrf_exempt
 def stripe_webhook(request):
-    # Ако Stripe е изключен – просто приеми 200
-    if not getattr(settings, 'USE_STRIPE', False):
+    """
+    Само проверка на подписа + запис на събитието (PaymentEvent) и веднага 200.
+    Прилагането е в `manage.py process_payment_events` (checkout.events).
+    """
+    gateway = payments.get_gateway()
+    # Ако плащането с карта е изключено – просто приеми 200
+    if gateway is None:
         return HttpResponse(status=200)
+    return _receive_event(gateway, request.body, request.META.get('HTTP_STRIPE_SIGNATURE'))
 
-    import stripe as _stripe
-    payload = request.body
-    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
-    endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 
+def _receive_event(gateway, payload, sig_header):
     try:
-        event = _stripe.Webhook.construct_event(
-            payload=payload, sig_header=sig_header, secret=endpoint_secret
-        )
-    except Exception:
+        event = gateway.parse_webhook(payload, sig_header)
+    except ValueError:
         return HttpResponse(status=400)
 
-    if event['type'] == 'checkout.session.completed':
-        data = event['data']['object']
-        order_id = data.get('metadata', {}).get('order_id')
-        coupon_code = data.get('metadata', {}).get('coupon_code')
-
-        if order_id:
-            for it in order.items.select_related('product', 'variant'):
-                if it.variant:
-                    # Reduce variant stock
-                    it.variant.stock = max(0, int(it.variant.stock) - int(it.qty))
-                    it.variant.save(update_fields=['stock'])
-                elif it.product:
-                    # Reduce product stock (for items without variants)
-                    it.product.stock = max(0, int(it.product.stock) - int(it.qty))
-                    it.product.save(update_fields=['stock'])
-            try:
-                order = Order.objects.get(id=order_id)
-                order.set_status(Order.Status.PAID)
-                if coupon_code:
-                    try:
-                        c = Coupon.objects.get(code__iexact=coupon_code)
-                        c.used = (c.used or 0) + 1
-                        c.save(update_fields=['used'])
-                    except Coupon.DoesNotExist:
-                        pass
-                # Имейл за платена поръчка
-                subject = render_to_string('email/order_paid_subject.txt', {'order': order}).strip()
-                message = render_to_string('email/order_paid.txt', {'order': order})
-                send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [order.email], fail_silently=True)
-            except Order.DoesNotExist:
-                pass
-
+    # повторенията от Stripe (същото id) просто се потвърждават
+    events.record(event)
     return HttpResponse(status=200)
+
+
+def fake_pay(request, session):
+    """
+    Страницата за плащане на локалния шлюз (PAYMENT_GATEWAY=fake): „Плати“/„Откажи“
+    подават подписано събитие през същата проверка като истинския webhook.
+    """
+    if settings.PAYMENT_GATEWAY != 'fake':
+        raise Http404
+    gateway = payments.get_gateway()
+    metadata = payments.FakeGateway.open_session(session) if isinstance(gateway, payments.FakeGateway) else None
+    if metadata is None:
+        raise Http404
+    order = get_object_or_404(Order, id=metadata['order_id'])
+
+    if request.method == 'POST':
+        paid = request.POST.get('action') == 'pay'
+        event_type = 'checkout.session.completed' if paid else 'checkout.session.expired'
+        response = _receive_event(gateway, *gateway.event(event_type, metadata))
+        if response.status_code != 200:
+            return response
+        return redirect('checkout_success' if paid else 'checkout_cancel')
+
+    return render(request, 'checkout/fake_pay.html', {'order': order})
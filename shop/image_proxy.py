@@ -0,0 +1,221 @@
+"""
+Снимки с размер при поискване: /img/<preset>/<път в media>.
+
+Алтернатива на предварително генерираните деривати (catalog.images): при
+първа заявка оригиналът се чете от storage-а (MEDIA_ROOT или S3 при USE_S3),
+смалява се по именован пресет (IMAGE_PRESETS – други размери няма, така че
+адресът не може да се ползва за произволно кодиране) и се кодира в най-добрия
+формат от Accept: AVIF → WebP → JPEG.
+
+Резултатът стои в локален дисков кеш (IMAGE_PROXY_CACHE_DIR) с бюджет в байтове
+(IMAGE_PROXY_CACHE_BYTES): при превишаване се трият най-отдавна ползваните файлове
+(mtime се опреснява при попадение). Обхождането за бюджета е най-много веднъж на
+IMAGE_PROXY_EVICT_SECONDS (отбелязва се с mtime на .evicted), не при всеки пропуск.
+
+Едновременните заявки за един и същ вариант чакат един-единствен енкодер: flock на
+.lock в подпапката на ключа (256 ивици – общи и между процесите). Lock файловете
+не се трият никога, така че всички чакащи заключват един и същ inode.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from PIL import Image, ImageOps
+
+try:
+    import fcntl
+except ImportError:  # Windows – само в рамките на процеса
+    fcntl = None
+
+try:
+    import pillow_avif  # noqa: F401
+    HAS_AVIF = True
+except Exception:
+    HAS_AVIF = False
+
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif'}
+ENCODERS = {
+    'avif': {'quality': 50},
+    'webp': {'quality': 82, 'method': 4},  # method 6 е твърде бавен за кодиране в заявката
+    'jpeg': {'quality': 85, 'progressive': True, 'optimize': True},
+}
+TOUCH_SECONDS = 3600  # mtime (за LRU) се опреснява най-много веднъж на час
+
+# flock не пази между нишките на един процес при всички платформи – и lock на нишките за всяка ивица
+_thread_locks = [threading.Lock() for _ in range(256)]
+
+
+def accepted_types(accept: str) -> dict:
+    """{медиен тип: q} от Accept хедъра; q=0 (или невалидно q) значи „не“."""
+    types = {}
+    for part in (accept or '').split(','):
+        media, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        types[media.strip().lower()] = q
+    return types
+
+
+def negotiate(accept: str) -> str:
+    # само изрично изброените формати – */* изпращат и браузъри без AVIF/WebP
+    types = accepted_types(accept)
+    if HAS_AVIF and types.get('image/avif', 0) > 0:
+        return 'avif'
+    if types.get('image/webp', 0) > 0:
+        return 'webp'
+    return 'jpeg'
+
+
+def clean_path(path: str):
+    """Нормализиран път в media или None (излиза извън разрешените папки/разширения)."""
+    path = posixpath.normpath(path)
+    if path.startswith(('/', '..')) or '\\' in path:
+        return None
+    if posixpath.splitext(path)[1].lower() not in SOURCE_EXTENSIONS:
+        return None
+    if not any(path.startswith(prefix) for prefix in settings.IMAGE_PROXY_PREFIXES):
+        return None
+    return path
+
+
+def cache_path(preset, path, fmt) -> Path:
+    spec = settings.IMAGE_PRESETS[preset]
+    key = hashlib.sha256(f"{sorted(spec.items())}:{ENCODERS[fmt]}:{path}".encode()).hexdigest()
+    return Path(settings.IMAGE_PROXY_CACHE_DIR) / key[:2] / f"{key}.{fmt}"
+
+
+def render(path, spec, fmt) -> bytes:
+    with default_storage.open(path) as fh:
+        im = Image.open(fh)
+        im = ImageOps.exif_transpose(im)
+        width, height = spec.get('width'), spec.get('height')
+        if spec.get('crop') and width and height:
+            im = ImageOps.fit(im, (width, height), Image.LANCZOS)
+        else:
+            # без увеличаване; вписва се в width × height (което е зададено)
+            im.thumbnail((width or im.width, height or im.height), Image.LANCZOS)
+    if fmt == 'jpeg' and im.mode != 'RGB':
+        im = im.convert('RGB')
+    elif im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA')
+    out = BytesIO()
+    im.save(out, format=fmt.upper(), **ENCODERS[fmt])
+    return out.getvalue()
+
+
+class single_flight:
+    """Един енкодер на вариант: flock между процесите + lock между нишките на процеса."""
+
+    def __init__(self, target: Path):
+        self.lock_path = target.parent / '.lock'
+        self.thread_lock = _thread_locks[int(target.stem[:2], 16)]
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.fh = None
+        if fcntl is not None:
+            self.fh = open(self.lock_path, 'a')
+            fcntl.flock(self.fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fh is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+            self.fh.close()
+        self.thread_lock.release()
+
+
+def evict(root: Path, budget: int, keep=None):
+    """LRU: трие най-отдавна ползваните файлове (без keep), докато кешът не слезе под 90% от бюджета."""
+    entries, total = [], 0
+    for sub in os.scandir(root):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            if entry.name.startswith('.') or entry.name.endswith('.tmp'):  # .lock и недописани
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    if total <= budget:
+        return 0
+    removed = 0
+    for _mtime, size, path in sorted(entries):
+        if total <= budget * 0.9:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # изтрит от друг процес
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def maybe_evict(keep=None):
+    """evict(), ако последното обхождане (на който и да е процес) е по-старо от IMAGE_PROXY_EVICT_SECONDS."""
+    root = Path(settings.IMAGE_PROXY_CACHE_DIR)
+    stamp = root / '.evicted'
+    try:
+        if time.time() - stamp.stat().st_mtime < settings.IMAGE_PROXY_EVICT_SECONDS:
+            return None
+    except FileNotFoundError:
+        pass
+    stamp.touch()  # преди обхождането – останалите процеси не тръгват едновременно
+    return evict(root, settings.IMAGE_PROXY_CACHE_BYTES, keep=keep)
+
+
+def ensure(preset, path, fmt) -> Path:
+    """Пътят на готовия вариант в кеша – кодира го (веднъж), ако го няма."""
+    target = cache_path(preset, path, fmt)
+    if target.exists():
+        if time.time() - target.stat().st_mtime > TOUCH_SECONDS:
+            os.utime(target)
+        return target
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with single_flight(target):
+        if target.exists():  # друг го е направил, докато сме чакали
+            return target
+        data = render(path, settings.IMAGE_PRESETS[preset], fmt)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, target)
+    maybe_evict(keep=str(target))
+    return target
+
+
+def serve(request, preset, path):
+    if preset not in settings.IMAGE_PRESETS:
+        raise Http404
+    path = clean_path(path)
+    if path is None:
+        raise Http404
+    fmt = negotiate(request.headers.get('Accept', ''))
+    try:
+        fh = open(ensure(preset, path, fmt), 'rb')
+    except (OSError, Image.DecompressionBombError):
+        # липсващ или повреден оригинал (Pillow вдига OSError/UnidentifiedImageError)
+        raise Http404
+    response = FileResponse(fh, content_type=f'image/{fmt}')
+    patch_vary_headers(response, ['Accept'])
+    patch_cache_control(response, public=True, max_age=settings.IMAGE_PROXY_MAX_AGE)
+    return response
@@ -24,9 +24,11 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'cart.middleware.CartCookieMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.waiting_room.WaitingRoomMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -59,6 +61,12 @@ DATABASES = {
     }
 }
 
+# Postgres (и др.) през DATABASE_URL, напр. postgres://shop:shop@db:5432/shop
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+if DATABASE_URL:
+    import dj_database_url
+    DATABASES = {'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600, ssl_require=False)}
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'bg-bg'
@@ -93,6 +101,75 @@ if USE_S3:
     STATIC_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/static/"
     MEDIA_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/media/"
 
+# --- Cache ---
+# Локално LocMem; в прод всеки Redis-съвместим сървър (нужен е пакетът `redis`)
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# --- Catalog ---
+# Cursor (keyset) странициране вместо OFFSET/COUNT; включва се и само от ?after=...
+CATALOG_CURSOR_PAGINATION = os.getenv('CATALOG_CURSOR_PAGINATION', '0') == '1'
+CATALOG_COUNT_CACHE_SECONDS = int(os.getenv('CATALOG_COUNT_CACHE_SECONDS', '300'))
+CATALOG_CARD_CACHE_SECONDS = int(os.getenv('CATALOG_CARD_CACHE_SECONDS', str(60 * 60 * 24)))
+# Cache-Control на каталожните страници: браузърът винаги ревалидира (евтин 304),
+# споделените кешове (CDN/proxy) държат страницата до s-maxage
+CATALOG_PAGE_MAX_AGE = int(os.getenv('CATALOG_PAGE_MAX_AGE', '0'))
+CATALOG_PAGE_SHARED_MAX_AGE = int(os.getenv('CATALOG_PAGE_SHARED_MAX_AGE', '60'))
+# влиза в ETag-а на каталожните страници и в ключа на кешираните карти;
+# смени го при деплой с промени по шаблоните
+CATALOG_ETAG_SALT = os.getenv('CATALOG_ETAG_SALT', '')
+# ширини на дериватите за srcset (catalog.images); смяна → process_image_jobs --outdated
+IMAGE_WIDTHS = [int(w) for w in os.getenv('IMAGE_WIDTHS', '240,480,960,1600').split(',') if w.strip()]
+
+# --- Images on demand ---
+# /img/<preset>/<път в media> (shop.image_proxy) – само тези пресети и папки
+IMAGE_PRESETS = {
+    'thumb': {'width': 240},
+    'card': {'width': 480},
+    'detail': {'width': 960},
+    'zoom': {'width': 1600},
+    'square': {'width': 96, 'height': 96, 'crop': True},
+}
+IMAGE_PROXY_PREFIXES = ['products/', 'branding/']
+IMAGE_PROXY_CACHE_DIR = os.getenv('IMAGE_PROXY_CACHE_DIR', str(BASE_DIR / 'var' / 'image-cache'))
+IMAGE_PROXY_CACHE_BYTES = int(os.getenv('IMAGE_PROXY_CACHE_BYTES', str(512 * 1024 * 1024)))
+IMAGE_PROXY_EVICT_SECONDS = 60  # обхождането на кеша за бюджета – най-много веднъж на толкова сек.
+IMAGE_PROXY_MAX_AGE = 60 * 60 * 24 * 30
+
+# --- Cart ---
+# cart.storage.SessionCartStorage | cart.storage.SignedCookieCartStorage | cart.storage.CacheCartStorage
+CART_STORAGE = os.getenv('CART_STORAGE', 'cart.storage.SessionCartStorage')
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+CART_CACHE_ALIAS = 'default'
+# задържане на наличност при добавяне в количката (cart.holds); изтеклите – release_expired_holds
+CART_STOCK_HOLDS = os.getenv('CART_STOCK_HOLDS', '0') == '1'
+CART_HOLD_MINUTES = int(os.getenv('CART_HOLD_MINUTES', '15'))
+
+# --- Checkout ---
+# опашка при пикове: POST-ът само записва PendingOrder, поръчките прави process_checkout_queue
+CHECKOUT_INTAKE = os.getenv('CHECKOUT_INTAKE', '0') == '1'
+CHECKOUT_INTAKE_POLL_SECONDS = 2
+# /checkout/metrics/ – за staff или с "Authorization: Bearer <token>"
+CHECKOUT_METRICS_TOKEN = os.getenv('CHECKOUT_METRICS_TOKEN', '')
+# валидиране на промокодове от кеша (0 = винаги от базата); лимитът се пази при поръчката
+COUPON_CACHE_SECONDS = int(os.getenv('COUPON_CACHE_SECONDS', '60'))
+
+# --- Waiting room ---
+# чакалня за разпродажби (shop.waiting_room): най-много CAPACITY активни купувачи
+WAITING_ROOM = os.getenv('WAITING_ROOM', '0') == '1'
+WAITING_ROOM_CAPACITY = int(os.getenv('WAITING_ROOM_CAPACITY', '200'))
+WAITING_ROOM_IDLE_SECONDS = 120  # неактивен по-дълго = отново през входа
+WAITING_ROOM_RETRY_SECONDS = 5
+# празно = целият сайт; напр. "/cart/,/checkout/" остава каталога отворен
+WAITING_ROOM_PATHS = [p for p in os.getenv('WAITING_ROOM_PATHS', '').split(',') if p]
+# /cart/state/ се вика от base.html на всяка страница – иначе разглеждащите каталога заемат места
+WAITING_ROOM_EXEMPT_PATHS = [STATIC_URL, MEDIA_URL, '/admin/', '/cart/state/', '/checkout/stripe/', '/checkout/metrics/']
+WAITING_ROOM_CACHE_ALIAS = 'default'
+
 # --- Stripe ---
 USE_STRIPE = os.getenv('USE_STRIPE', '0') == '1'  # по подразбиране ИЗКЛЮЧЕН
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
@@ -100,6 +177,23 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 SITE_URL = os.getenv('SITE_URL', 'http://127.0.0.1:8000')
 
+# --- Payments ---
+# шлюз за карти (checkout.payments): 'stripe' (при USE_STRIPE и ключове) | 'fake' (локален, без мрежа)
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'stripe')
+PAYMENT_CONNECT_TIMEOUT = float(os.getenv('PAYMENT_CONNECT_TIMEOUT', '3'))
+PAYMENT_READ_TIMEOUT = float(os.getenv('PAYMENT_READ_TIMEOUT', '10'))
+PAYMENT_MAX_RETRIES = int(os.getenv('PAYMENT_MAX_RETRIES', '1'))
+# след толкова поредни мрежови грешки – само наложен платеж за COOLDOWN сек.
+PAYMENT_BREAKER_THRESHOLD = int(os.getenv('PAYMENT_BREAKER_THRESHOLD', '5'))
+PAYMENT_BREAKER_COOLDOWN = int(os.getenv('PAYMENT_BREAKER_COOLDOWN', '30'))
+# локалният шлюз: всеки може да „плати“ сам – изисква изрично разрешение и STRIPE_WEBHOOK_SECRET
+PAYMENT_FAKE_ALLOWED = os.getenv('PAYMENT_FAKE_ALLOWED', '0') == '1'
+# изкуствено забавяне и дял неуспешни сесии (натоварващи тестове)
+PAYMENT_FAKE_LATENCY_MS = int(os.getenv('PAYMENT_FAKE_LATENCY_MS', '0'))
+PAYMENT_FAKE_FAILURE_RATE = float(os.getenv('PAYMENT_FAKE_FAILURE_RATE', '0'))
+# Stripe събитие, неуспяло толкова пъти, се маркира failed_at и излиза от опашката
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_EVENT_MAX_ATTEMPTS', '5'))
+
 # --- Email ---
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = os.getenv('EMAIL_HOST', '')
@@ -0,0 +1,127 @@
+import threading
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+from django.test import Client
+from PIL import Image
+
+from shop import image_proxy
+
+WEBP = 'image/webp,image/*,*/*;q=0.8'
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path / 'media'
+    settings.IMAGE_PROXY_CACHE_DIR = tmp_path / 'cache'
+    settings.IMAGE_PROXY_CACHE_BYTES = 10 * 1024 * 1024
+    settings.IMAGE_PROXY_EVICT_SECONDS = 0
+    buf = BytesIO()
+    Image.new('RGB', (600, 400), 'red').save(buf, format='PNG')
+    default_storage.save('products/a.png', ContentFile(buf.getvalue()))
+    return settings
+
+
+def fetch(path, accept=WEBP):
+    response = Client().get(path, HTTP_ACCEPT=accept)
+    body = b''.join(response.streaming_content) if response.status_code == 200 else b''
+    return response, body
+
+
+def test_negotiated_format_and_preset_size(media):
+    r, body = fetch('/img/thumb/products/a.png')
+    assert r.status_code == 200 and r['Content-Type'] == 'image/webp'
+    assert 'Accept' in r['Vary'] and 'public' in r['Cache-Control']
+    assert Image.open(BytesIO(body)).size == (240, 160)
+
+    r, body = fetch('/img/square/products/a.png', accept='image/*')
+    assert r['Content-Type'] == 'image/jpeg'
+    assert Image.open(BytesIO(body)).size == (96, 96)
+
+
+@pytest.mark.parametrize('accept, fmt', [
+    ('image/avif,image/webp,*/*;q=0.8', 'avif'),
+    ('image/avif;q=0,image/webp,*/*', 'webp'),
+    ('image/webp;q=0, image/*', 'jpeg'),
+    ('image/webp; q=0.0', 'jpeg'),
+    ('image/webp;q=abc', 'jpeg'),
+    ('*/*', 'jpeg'),
+    ('', 'jpeg'),
+])
+def test_negotiate_honours_q_values(monkeypatch, accept, fmt):
+    monkeypatch.setattr(image_proxy, 'HAS_AVIF', True)
+    assert image_proxy.negotiate(accept) == fmt
+
+
+@pytest.mark.parametrize('path', [
+    '/img/huge/products/a.png',          # няма такъв пресет
+    '/img/thumb/products/missing.png',
+    '/img/thumb/products/../../settings.py',
+    '/img/thumb/derivatives/a.png',      # извън IMAGE_PROXY_PREFIXES
+    '/img/thumb/products/a.txt',
+])
+def test_rejects_unknown_presets_and_paths(media, path):
+    assert fetch(path)[0].status_code == 404
+
+
+def test_cache_hit_skips_storage(media, monkeypatch):
+    first = fetch('/img/card/products/a.png')[1]
+    monkeypatch.setattr(image_proxy, 'render', lambda *a: pytest.fail("re-encoded"))
+    assert fetch('/img/card/products/a.png')[1] == first
+
+
+def test_lru_eviction_keeps_budget(media):
+    fetch('/img/thumb/products/a.png')
+    size = image_proxy.cache_path('thumb', 'products/a.png', 'webp').stat().st_size
+    media.IMAGE_PROXY_CACHE_BYTES = size + 1
+    fetch('/img/card/products/a.png')
+
+    root = Path(media.IMAGE_PROXY_CACHE_DIR)
+    assert not image_proxy.cache_path('thumb', 'products/a.png', 'webp').exists()
+    assert image_proxy.cache_path('card', 'products/a.png', 'webp').exists()
+    assert not list(root.rglob('*.tmp'))
+    # lock файловете остават – следващият енкодер заключва същия inode
+    assert list(root.rglob('.lock'))
+
+
+def test_eviction_scan_is_rate_limited(media, monkeypatch):
+    media.IMAGE_PROXY_EVICT_SECONDS = 60
+    scans = []
+    monkeypatch.setattr(image_proxy, 'evict', lambda *args, **kwargs: scans.append(args))
+    for preset in ('thumb', 'card', 'detail'):
+        fetch(f'/img/{preset}/products/a.png')
+    assert len(scans) == 1
+
+
+def test_concurrent_requests_encode_once(media, monkeypatch):
+    calls, render = [], image_proxy.render
+
+    def slow_render(*args):
+        calls.append(args)
+        threading.Event().wait(0.1)
+        return render(*args)
+
+    monkeypatch.setattr(image_proxy, 'render', slow_render)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetch('/img/detail/products/a.png')[0].status_code))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [200] * 5
+    assert len(calls) == 1
+
+
+def test_preset_url_filter(media):
+    png = SimpleNamespace(name='products/a.png', url='/media/products/a.png')
+    svg = SimpleNamespace(name='branding/l.svg', url='/media/branding/l.svg')
+    html = Template("{% load catalog_images %}{{ png|preset_url:'thumb' }}|{{ svg|preset_url:'thumb' }}").render(
+        Context({'png': png, 'svg': svg})
+    )
+    assert html == '/img/thumb/products/a.png|/media/branding/l.svg'
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from decimal import Decimal
+from django.core.cache import cache
+from django.test import Client
+from catalog.models import Category, Product
+
+
+@pytest.fixture
+def room(db, settings, monkeypatch):
+    # начало на прозорец – иначе тест на границата на прозорците вижда празен брояч
+    start = (time.time() // 60 + 1) * 60
+    monkeypatch.setattr(time, 'time', lambda: start)
+    settings.WAITING_ROOM = True
+    settings.WAITING_ROOM_CAPACITY = 2
+    settings.WAITING_ROOM_IDLE_SECONDS = 60
+    cache.clear()
+    c = Category.objects.create(name='X', slug='x')
+    Product.objects.create(category=c, name='A', slug='a', price=Decimal('10'), stock=3)
+    yield settings
+    cache.clear()
+
+
+def later(monkeypatch, seconds):
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + seconds)
+
+
+def test_capacity_then_fifo(room, monkeypatch, django_assert_num_queries):
+    a, b, c, d = Client(), Client(), Client(), Client()
+    assert a.get('/cart/').status_code == 200
+    assert b.get('/cart/').status_code == 200
+
+    with django_assert_num_queries(0):
+        r = c.get('/cart/')
+    assert r.status_code == 503 and r['Retry-After'] == '5'
+    assert 'no-store' in r['Cache-Control']
+    assert d.get('/').status_code == 503
+
+    # пуснатите продължават да пазаруват
+    assert a.get('/checkout/').status_code == 200
+
+    # c и d чакат (страницата се опреснява), a и b стават неактивни →
+    # местата се освобождават по реда на пристигане
+    later(monkeypatch, 30)
+    assert c.get('/').status_code == 503
+    assert d.get('/').status_code == 503
+    later(monkeypatch, 100)
+    assert d.get('/').status_code == 503  # c е преди d
+    assert c.get('/').status_code == 200
+    assert d.get('/').status_code == 200
+    assert Client().get('/').status_code == 503
+
+
+def test_abandoned_ticket_is_skipped_without_taking_a_place(room, monkeypatch):
+    for client in (Client(), Client()):
+        assert client.get('/').status_code == 200
+    gone, d = Client(), Client()
+    assert gone.get('/').status_code == 503
+    assert d.get('/').status_code == 503
+
+    # gone затваря страницата; d продължава да чака
+    later(monkeypatch, 30)
+    assert d.get('/').status_code == 503
+    later(monkeypatch, 105)
+    assert d.get('/').status_code == 200
+    assert Client().get('/').status_code == 200  # прескоченият номер не зае място
+    assert Client().get('/').status_code == 503
+
+    # върналият се gone е прескочен – застава на края на опашката
+    assert gone.get('/').status_code == 503
+
+
+def test_catalog_can_stay_open(room):
+    room.WAITING_ROOM_PATHS = ['/cart/', '/checkout/']
+    for client in (Client(), Client()):
+        assert client.get('/cart/').status_code == 200
+    late = Client()
+    r = late.get('/')
+    assert r.status_code == 200 and 'wr' not in r.cookies
+    # всяка страница на каталога вика /cart/state/ – разглеждането не заема място и не чака
+    r = late.get('/cart/state/', HTTP_ACCEPT='application/json')
+    assert r.status_code == 200 and 'wr' not in r.cookies
+    assert late.get('/checkout/').status_code == 503
+
+
+def test_tampered_ticket_rejoins(room):
+    for client in (Client(), Client()):
+        client.get('/')
+    forged = Client()
+    forged.cookies['wr'] = '1:1:999999999'
+    assert forged.get('/').status_code == 503
@@ -3,11 +3,14 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from . import image_proxy
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('catalog.urls')),
     path('cart/', include('cart.urls')),
     path('checkout/', include('checkout.urls')),
+    path('img/<slug:preset>/<path:path>', image_proxy.serve, name='image_proxy'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,186 @@
+"""
+Виртуална чакалня за разпродажби (settings.WAITING_ROOM).
+
+Най-много WAITING_ROOM_CAPACITY активни купувачи минават през защитените
+пътища; останалите получават лека статична страница (503 + Retry-After),
+която се опреснява сама и пуска посетителите по реда на пристигане.
+
+Всичко е в кеша (споделен между процесите – Redis в прод):
+- wr:tail         – последният раздаден номер в опашката
+- wr:head         – до кой номер включително е пуснато
+- wr:grants:<b>   – колко посетители са пуснати във времевия прозорец b
+- wr:seen:<b>     – колко пуснати по-рано посетители са били активни в прозореца b
+- wr:wait:<n>     – чакащият с номер n е опреснил страницата наскоро (2 × WAITING_ROOM_IDLE_SECONDS)
+- wr:skip:<n>     – номер n е прескочен (притежателят му е спрял да чака)
+Заетостта на прозорец е grants + seen; пуска се, докато и текущият, и
+предишният прозорец са под капацитета. Пуска се винаги следващият чакащ номер;
+изоставените номера пред него се прескачат, без да заемат място, а върналият се
+притежател на прескочен номер застава отново на края на опашката.
+
+Номерът и състоянието стоят в подписана бисквитка, така че чакалнята не пипа
+базата. Пуснат посетител, неактивен повече от WAITING_ROOM_IDLE_SECONDS,
+минава отново през входа (веднага, ако има място).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+
+COOKIE_NAME = 'wr'
+COOKIE_SALT = 'shop.waiting_room'
+SKIP_LIMIT = 50  # изоставени номера, прескачани най-много при една заявка
+
+
+class Ticket:
+    """Номер в опашката, дали е пуснат и в кой прозорец е отчетен като активен."""
+
+    def __init__(self, number=0, admitted=False, bucket=-1):
+        self.number, self.admitted, self.bucket = number, admitted, bucket
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            number, admitted, bucket = value.split(':')
+            return cls(int(number), admitted == '1', int(bucket))
+        except (AttributeError, ValueError):
+            return None
+
+    def __str__(self):
+        return f"{self.number}:{int(self.admitted)}:{self.bucket}"
+
+
+class WaitingRoom:
+    def __init__(self):
+        self.cache = caches[settings.WAITING_ROOM_CACHE_ALIAS]
+        self.capacity = settings.WAITING_ROOM_CAPACITY
+        self.idle = settings.WAITING_ROOM_IDLE_SECONDS
+
+    def bucket(self):
+        return int(time.time() // self.idle)
+
+    def _incr(self, key, timeout=None):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key)
+        except ValueError:  # изтекъл между add и incr
+            self.cache.add(key, 0, timeout)
+            return self.cache.incr(key)
+
+    def head(self):
+        return self.cache.get('wr:head', 0)
+
+    def occupancy(self, b):
+        """Пуснатите в прозореца b + продължаващите от по-ранни прозорци, активни в b."""
+        counts = self.cache.get_many([f'wr:grants:{b}', f'wr:seen:{b}'])
+        return sum(counts.values())
+
+    def join(self) -> Ticket:
+        return Ticket(number=self._incr('wr:tail'))
+
+    def try_advance(self):
+        """
+        Пуска следващия чакащ номер, ако и текущият, и предишният прозорец са под капацитета.
+        Изоставените номера пред него се прескачат, без да се броят като пуснати.
+        """
+        for _ in range(SKIP_LIMIT):
+            number = self.head() + 1
+            if self.cache.get(f'wr:wait:{number}') is not None:
+                break
+            # само един процес прескача даден номер
+            if self.cache.add(f'wr:skip:{number}', 1, self.idle * 3):
+                self._incr('wr:head')
+        else:
+            return False
+        b = self.bucket()
+        self._incr(f'wr:grants:{b}', timeout=self.idle * 3)
+        if max(self.occupancy(b), self.occupancy(b - 1)) > self.capacity:
+            try:
+                self.cache.decr(f'wr:grants:{b}')
+            except ValueError:
+                pass
+            return False
+        self._incr('wr:head')
+        return True
+
+    def admit(self, ticket: Ticket) -> bool:
+        if ticket.number <= self.head() and self.cache.get(f'wr:skip:{ticket.number}') is not None:
+            ticket.number = self.join().number  # прескочен, докато е отсъствал – отново на края
+        if ticket.number > self.head():
+            self.cache.set(f'wr:wait:{ticket.number}', 1, self.idle * 2)
+            if not (self.try_advance() and ticket.number <= self.head()):
+                return False
+        ticket.admitted, ticket.bucket = True, self.bucket()
+        return True
+
+    def touch(self, ticket: Ticket):
+        """Пуснат посетител от по-ранен прозорец се отчита като активен веднъж на прозорец."""
+        b = self.bucket()
+        if ticket.bucket != b:
+            self._incr(f'wr:seen:{b}', timeout=self.idle * 3)
+            ticket.bucket = b
+
+    def is_idle(self, ticket: Ticket):
+        return ticket.bucket < self.bucket() - 1
+
+    def position(self, ticket: Ticket):
+        return max(1, ticket.number - self.head())
+
+
+class WaitingRoomMiddleware:
+    """Пропуска до WAITING_ROOM_CAPACITY активни купувачи по WAITING_ROOM_PATHS; останалите чакат."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def gated(self, request):
+        path = request.path_info
+        if any(path.startswith(p) for p in settings.WAITING_ROOM_EXEMPT_PATHS):
+            return False
+        prefixes = settings.WAITING_ROOM_PATHS
+        return not prefixes or any(path.startswith(p) for p in prefixes)
+
+    @staticmethod
+    def is_staff(request):
+        # сесията се чете само ако има бисквитка – иначе каталогът губи споделения кеш
+        return settings.SESSION_COOKIE_NAME in request.COOKIES and request.user.is_staff
+
+    def __call__(self, request):
+        if not settings.WAITING_ROOM or not self.gated(request) or self.is_staff(request):
+            return self.get_response(request)
+
+        room = WaitingRoom()
+        ticket = Ticket.parse(request.get_signed_cookie(COOKIE_NAME, default='', salt=COOKIE_SALT))
+        before = str(ticket) if ticket else ''
+
+        if ticket and ticket.admitted and room.is_idle(ticket):
+            ticket = None  # неактивен твърде дълго – отново през входа
+        if ticket is None:
+            ticket = room.join()
+
+        if ticket.admitted:
+            room.touch(ticket)
+        if ticket.admitted or room.admit(ticket):
+            response = self.get_response(request)
+        else:
+            response = self.waiting_page(room, ticket)
+
+        if str(ticket) != before:
+            # отговор с лична бисквитка не бива да попада в споделен кеш
+            patch_cache_control(response, private=True)
+            response.set_signed_cookie(
+                COOKIE_NAME, str(ticket), salt=COOKIE_SALT,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def waiting_page(self, room, ticket):
+        # без request и context processors – никакви заявки към базата
+        retry = settings.WAITING_ROOM_RETRY_SECONDS
+        html = render_to_string('waiting_room.html', {'position': room.position(ticket), 'retry': retry})
+        response = HttpResponse(html, status=503)
+        response['Retry-After'] = str(retry)
+        add_never_cache_headers(response)
+        return response